@@ -1,41 +1,68 @@
 from flask import Flask
-from flask_bootstrap import Bootstrap
 from flask_mail import Mail
-from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import config
-from flask_pagedown import PageDown
+from .ratelimit import RateLimiter
+from .compress import Compress
+from .live import Live
+from .passwords import Passwords
+from .dbpool import PoolMonitor
+from .sharding import Sharding
+from .archive import Archive
+from . import jobs, json_provider, templating
 
-bootstrap = Bootstrap()
 mail = Mail()
-moment = Moment()
 db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
-pagedown = PageDown()
 
 def create_app(config_name):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
+    templating.init_app(app)
+    json_provider.init_app(app)
     
-    # Initialize extensions
-    bootstrap.init_app(app)
+    # Initialize extensions, the limiter first so that it runs before
+    # anything that checks out a database connection, and compression
+    # next so that its after_request hook runs after all the others
+    RateLimiter(app)
+    Compress(app)
     mail.init_app(app)
-    moment.init_app(app)
+    PoolMonitor(app)
     db.init_app(app)
+    Sharding(app)
+    Archive(app)
     login_manager.init_app(app)
-    pagedown.init_app(app)
+    jobs.init_app(app)
+    Live(app)
+    Passwords(app)
+    from . import trending  # noqa: F401, registers the hot score listeners
     
     # Register blueprints
+    from .api import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
+    if app.config['FLASKY_APP_PROFILE'] == 'api':
+        # API-only processes skip the HTML extensions and blueprints
+        from .api.errors import page_not_found
+        app.register_error_handler(404, page_not_found)
+        return app
+
+    from flask_bootstrap import Bootstrap
+    from flask_moment import Moment
+    from flask_pagedown import PageDown
+    from .assets import Assets
+    Bootstrap(app)
+    Moment(app)
+    PageDown(app)
+    Assets(app)
+
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
     
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
     
-    from .api import api as api_blueprint
-    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
-    
-    return app
\ No newline at end of file
+    return app
@@ -1,5 +1,6 @@
-from flask import g, jsonify
+from flask import g, jsonify, current_app
 from flask_httpauth import HTTPBasicAuth
+from .. import db, queries, ratelimit
 from ..models import User
 from . import api
 from .errors import unauthorized, forbidden
@@ -15,12 +16,17 @@ def verify_password(email_or_token, password):
         g.current_user = User.verify_auth_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
-    user = User.query.filter_by(email=email_or_token.lower()).first()
-    if not user:
+    user = queries.user_by_email(email_or_token.lower())
+    if not user or not user.is_active:
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    if not user.verify_password(password):
+        return False
+    if db.session.is_modified(user):
+        # the password was rehashed with the current parameters
+        db.session.commit()
+    return True
 
 
 @auth.error_handler
@@ -31,8 +37,13 @@ def auth_error():
 @api.before_request
 @auth.login_required
 def before_request():
-    if not g.current_user.is_anonymous and \
-            not g.current_user.confirmed:
+    if g.current_user.is_anonymous:
+        return
+    # the bucket of the verified user, whichever address or token is used
+    limited = ratelimit.limit('user:%s' % g.current_user.id)
+    if limited is not None:
+        return limited
+    if not g.current_user.confirmed:
         return forbidden('Unconfirmed account')
 
 
@@ -40,5 +51,15 @@ def before_request():
 def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized('Invalid credentials')
+    expiration = current_app.config['FLASKY_TOKEN_EXPIRATION']
     return jsonify({'token': g.current_user.generate_auth_token(
-        expiration=3600), 'expiration': 3600})
+        expiration=expiration), 'expiration': expiration})
+
+
+@api.route('/tokens/', methods=['DELETE'])
+def revoke_tokens():
+    # every token of the user, the one used for this request included
+    user = db.session.get(User, g.current_user.id)
+    user.revoke_auth_tokens()
+    db.session.commit()
+    return '', 204
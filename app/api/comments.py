@@ -1,67 +1,84 @@
-from flask import jsonify, request, g, url_for, current_app
-from .. import db
+from flask import jsonify, request, g, url_for, current_app, abort
 from ..models import Post, Permission, Comment
 from . import api
 from .decorators import permission_required
+from .fields import representation, link_args, total
+from ..pagination import OffsetPagination
+from .. import sharding
 
 
 @api.route('/comments/')
 def get_comments():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    selection = representation(Comment)
+    query = sharding.all_comments()\
+        .order_by(Comment.timestamp.desc(), Comment.id.desc())
+    pagination = OffsetPagination(selection.apply(query), page,
+                                  current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1)
+        prev = url_for('api.get_comments', page=page-1, **link_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1)
+        next = url_for('api.get_comments', page=page+1, **link_args())
+    count = total(query)
     return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+        'comments': selection.serialize(comments),
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': count.value,
+        'count_exact': count.exact
     })
 
 
 @api.route('/comments/<int:id>')
 def get_comment(id):
-    comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    selection = representation(Comment)
+    comment = selection.apply(sharding.session().query(Comment))\
+        .filter_by(id=id).first()
+    if comment is None:
+        abort(404)
+    return jsonify(selection.serialize_one(comment))
 
 
 @api.route('/posts/<int:id>/comments/')
 def get_post_comments(id):
-    post = Post.query.get_or_404(id)
+    post = sharding.get_or_404(Post, id)
     page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    selection = representation(Comment)
+    query = sharding.comments_of(post.id)\
+        .order_by(Comment.timestamp.asc(), Comment.id.asc())
+    pagination = OffsetPagination(selection.apply(query), page,
+                                  current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_post_comments', id=id, page=page-1)
+        prev = url_for('api.get_post_comments', id=id, page=page-1,
+                       **link_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_post_comments', id=id, page=page+1)
+        next = url_for('api.get_post_comments', id=id, page=page+1,
+                       **link_args())
+    count = total(query)
     return jsonify({
-        'comments': [comment.to_json() for comment in comments],
+        'comments': selection.serialize(comments),
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': count.value,
+        'count_exact': count.exact
     })
 
 
 @api.route('/posts/<int:id>/comments/', methods=['POST'])
 @permission_required(Permission.COMMENT)
 def new_post_comment(id):
-    post = Post.query.get_or_404(id)
+    post = sharding.get_or_404(Post, id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
-    comment.post = post
-    db.session.add(comment)
-    db.session.commit()
+    comment.author_id = g.current_user.id
+    comment.post_id = post.id
+    session = sharding.session()
+    session.add(comment)
+    session.commit()
     return jsonify(comment.to_json()), 201, \
         {'Location': url_for('api.get_comment', id=comment.id)}
@@ -1,5 +1,5 @@
 from flask import jsonify
-from app.exceptions import ValidationError
+from app.exceptions import ValidationError, PasswordCheckBusy
 from . import api
 
 def not_found_error(message):
@@ -7,6 +7,10 @@ def not_found_error(message):
     response.status_code = 404
     return response
 
+def page_not_found(e):
+    return not_found_error('resource not found')
+
+
 def bad_request(message):
     response = jsonify({'error': 'bad request', 'message': message})
     response.status_code = 400
@@ -28,3 +32,13 @@ def forbidden(message):
 @api.errorhandler(ValidationError)
 def validation_error(e):
     return bad_request(e.args[0])
+
+
+@api.errorhandler(PasswordCheckBusy)
+def password_check_busy(e):
+    response = jsonify({'error': 'service unavailable',
+                        'message': 'Too many password checks, try again '
+                                   'shortly or use a token'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
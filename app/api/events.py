@@ -0,0 +1,15 @@
+from flask import request, current_app, g
+from . import api
+from .errors import bad_request
+from ..live import channels_for
+
+
+@api.route('/events')
+def get_events():
+    # server-sent events: ?feed=all|followed for new posts, ?post=<id>
+    # (repeatable) for new comments, resumes from Last-Event-ID
+    channels = channels_for(g.current_user, request.args.get('feed'),
+                            request.args.getlist('post', type=int))
+    if not channels:
+        return bad_request('nothing to listen to, pass feed or post')
+    return current_app.extensions['live'].stream(channels)
@@ -0,0 +1,19 @@
+from flask import request
+from ..counts import count
+
+
+def representation(model):
+    # ?fields=a,b limits the response (and the loaded columns) to those
+    # fields, ?embed=x,y adds related data loaded for the whole page
+    return model.projection.from_request(request.args)
+
+
+def link_args():
+    # carried over to the prev/next links
+    return {key: request.args[key] for key in ('fields', 'embed', 'exact')
+            if key in request.args}
+
+
+def total(query):
+    # an estimate unless the client asks for ?exact=1
+    return count(query, exact=request.args.get('exact') == '1')
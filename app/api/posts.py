@@ -1,45 +1,68 @@
-from flask import jsonify, request, g, url_for, current_app
-from .. import db
+from flask import jsonify, request, g, url_for, current_app, abort
 from ..models import Post, Permission
 from . import api
 from .decorators import permission_required
-from .errors import forbidden
+from .errors import forbidden, bad_request
+from .fields import representation, link_args, total
+from ..pagination import OffsetPagination
+from .. import archive, sharding
 
 
 @api.route('/posts/')
 def get_posts():
     page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    sort = request.args.get('sort')
+    if sort == 'hot':
+        query = sharding.hot_posts()
+    elif sort is None:
+        query = sharding.all_posts()\
+            .order_by(Post.timestamp.desc(), Post.id.desc())
+    else:
+        return bad_request('unknown sort order')
+    selection = representation(Post)
+    pagination = OffsetPagination(selection.apply(query), page,
+                                  current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page-1)
+        prev = url_for('api.get_posts', page=page-1, sort=sort, **link_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_posts', page=page+1)
+        next = url_for('api.get_posts', page=page+1, sort=sort, **link_args())
+    count = total(query)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': selection.serialize(posts),
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': count.value,
+        'count_exact': count.exact
     })
 
 
 @api.route('/posts/<int:id>')
 def get_post(id):
-    post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    selection = representation(Post)
+    post = selection.apply(sharding.session().query(Post))\
+        .filter_by(id=id).first()
+    if post is None:
+        post = archive.load_post(id)
+        if post is None:
+            abort(404)
+        data = selection.serialize_one(post)
+        if 'comment_count' in data:
+            data['comment_count'] = len(post.comments)
+        return jsonify(data)
+    return jsonify(selection.serialize_one(post))
 
 
 @api.route('/posts/', methods=['POST'])
 @permission_required(Permission.WRITE)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
-    db.session.add(post)
-    db.session.commit()
+    post.author_id = g.current_user.id
+    session = sharding.session()
+    session.add(post)
+    session.commit()
     return jsonify(post.to_json()), 201, \
         {'Location': url_for('api.get_post', id=post.id)}
 
@@ -47,11 +70,10 @@ def new_post():
 @api.route('/posts/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE)
 def edit_post(id):
-    post = Post.query.get_or_404(id)
-    if g.current_user != post.author and \
+    post = sharding.get_or_404(Post, id)
+    if g.current_user.id != post.author_id and \
             not g.current_user.can(Permission.ADMIN):
         return forbidden('Insufficient permissions')
     post.body = request.json.get('body', post.body)
-    db.session.add(post)
-    db.session.commit()
+    sharding.session().commit()
     return jsonify(post.to_json())
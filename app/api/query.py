@@ -0,0 +1,371 @@
+from flask import jsonify, request, current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only, lazyload
+from .. import db
+from ..exceptions import ValidationError
+from ..models import User, Post, Comment, Follow
+from . import api
+
+
+# POST /api/v1/query resolves a nested selection in one request:
+#
+#   {"post": {"id": 12, "fields": ["body", "timestamp"],
+#             "author": {"fields": ["username"]},
+#             "comments": {"limit": 5, "fields": ["body"],
+#                          "author": {"fields": ["username"]}}}}
+#
+# The tree is resolved one level at a time. Each relation on a level hands
+# the keys it needs to the loader of its type, then every loader runs a
+# single IN (...) query, so the number of queries follows the shape of the
+# query and not the number of rows. Rows are cached for the rest of the
+# request. Before anything runs the query is priced by the number of rows
+# it could return and refused when it is too deep or too expensive.
+
+class ToOne:
+    many = False
+
+    def __init__(self, type, column):
+        # column of the parent holding the id of the related row
+        self.type = type
+        self.column = column
+
+
+class ToMany:
+    many = True
+
+    def __init__(self, type, column):
+        # column of the related rows holding the id of the parent
+        self.type = type
+        self.column = column
+
+
+class Type:
+    def __init__(self, model, order, relations):
+        self.model = model
+        self.order = order
+        self.relations = relations
+        self.primary_key = [getattr(model, column.key)
+                            for column in inspect(model).primary_key]
+
+    @property
+    def projection(self):
+        return self.model.projection
+
+    def key(self, item):
+        if len(self.primary_key) == 1:
+            return getattr(item, self.primary_key[0].key)
+        return tuple(getattr(item, c.key) for c in self.primary_key)
+
+
+TYPES = {
+    'user': Type(User, User.member_since.desc(), {
+        'posts': ToMany('post', Post.author_id),
+        'comments': ToMany('comment', Comment.author_id),
+        'followers': ToMany('follow', Follow.followed_id),
+        'following': ToMany('follow', Follow.follower_id),
+    }),
+    'post': Type(Post, Post.timestamp.desc(), {
+        'author': ToOne('user', Post.author_id),
+        'comments': ToMany('comment', Comment.post_id),
+    }),
+    'comment': Type(Comment, Comment.timestamp.desc(), {
+        'author': ToOne('user', Comment.author_id),
+        'post': ToOne('post', Comment.post_id),
+    }),
+    'follow': Type(Follow, Follow.timestamp.desc(), {
+        'follower': ToOne('user', Follow.follower_id),
+        'followed': ToOne('user', Follow.followed_id),
+    }),
+}
+
+# root field: (type, many)
+ROOTS = {
+    'user': ('user', False), 'users': ('user', True),
+    'post': ('post', False), 'posts': ('post', True),
+    'comment': ('comment', False), 'comments': ('comment', True),
+}
+
+
+class Node:
+    def __init__(self, name, type, relation, spec, path):
+        self.name = name
+        self.type = TYPES[type]
+        self.relation = relation
+        self.path = path
+        if not isinstance(spec, dict):
+            raise ValidationError('%s: expected an object' % path)
+        config = current_app.config
+        self.id = self.ids = None
+        self.limit = 1
+        self.many = relation.many if relation is not None else ROOTS[name][1]
+        allowed = {'fields'} | set(self.type.relations)
+        if relation is None:
+            allowed |= {'ids', 'limit'} if self.many else {'id'}
+        elif self.many:
+            allowed |= {'limit'}
+        unknown = [key for key in spec if key not in allowed]
+        if unknown:
+            raise ValidationError('%s: unknown fields: %s' %
+                                  (path, ', '.join(sorted(unknown))))
+        if relation is None and not self.many:
+            self.id = self._int(spec.get('id'), 'id')
+        elif relation is None and 'ids' in spec:
+            self.ids = spec['ids']
+            if not isinstance(self.ids, list) or \
+                    len(self.ids) > config['FLASKY_QUERY_MAX_LIMIT']:
+                raise ValidationError(
+                    '%s: ids must be a list of at most %d ids' %
+                    (path, config['FLASKY_QUERY_MAX_LIMIT']))
+            self.ids = [self._int(id, 'ids') for id in self.ids]
+            self.limit = len(self.ids)
+        elif self.many:
+            self.limit = min(self._int(spec.get('limit', 10), 'limit'),
+                             config['FLASKY_QUERY_MAX_LIMIT'])
+        fields = spec.get('fields') or self.type.projection.default
+        if not isinstance(fields, list) or \
+                not all(isinstance(f, str) for f in fields):
+            raise ValidationError('%s: fields must be a list of names' % path)
+        unknown = [f for f in fields if f not in self.type.projection.fields]
+        if unknown:
+            raise ValidationError('%s: unknown fields: %s' %
+                                  (path, ', '.join(unknown)))
+        self.selection = self.type.projection.select(fields)
+        self.children = [
+            Node(key, relation.type, relation, spec[key],
+                 '%s.%s' % (path, key))
+            for key, relation in self.type.relations.items() if key in spec]
+        self.items = []
+        self.values = {}
+        self.data = {}
+
+    def _int(self, value, name):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValidationError('%s: %s must be a positive integer' %
+                                  (self.path, name))
+        return value
+
+    def cost(self, parents=1):
+        # rows this node and its children can return at most
+        rows = parents * self.limit
+        return rows + sum(child.cost(rows) for child in self.children)
+
+    def depth(self):
+        return 1 + max([child.depth() for child in self.children] or [0])
+
+    def columns(self, columns):
+        # every column of a type read anywhere in the query, so that rows
+        # shared between nodes never need a second trip to the database
+        needed = columns.setdefault(self.type, {})
+        for column in self.type.primary_key:
+            needed[column.key] = column
+        for name, field in self.selection.fields:
+            for column in field.columns:
+                needed[column.key] = column
+        for child in self.children:
+            if child.relation.many:
+                columns.setdefault(child.type, {})[
+                    child.relation.column.key] = child.relation.column
+            else:
+                needed[child.relation.column.key] = child.relation.column
+            child.columns(columns)
+        return columns
+
+    def want(self, context, parents):
+        if self.relation is None:
+            if self.many and self.ids is None:
+                self.items = context.latest(self.type, self.limit)
+            else:
+                keys = [self.id] if self.id is not None else self.ids
+                context.by_id(self.type).want(keys)
+        elif self.relation.many:
+            context.children(self).want([parent.id for parent in parents])
+        else:
+            context.by_id(self.type).want(
+                [getattr(p, self.relation.column.key) for p in parents])
+
+    def resolve(self, context, parents):
+        if self.relation is None:
+            if self.ids is not None:
+                self.items = [context.by_id(self.type).get(id)
+                              for id in self.ids]
+                self.items = [item for item in self.items if item is not None]
+            elif not self.many:
+                item = context.by_id(self.type).get(self.id)
+                self.items = [item] if item is not None else []
+            return
+        loader = context.children(self) if self.relation.many \
+            else context.by_id(self.type)
+        seen = {}
+        for parent in parents:
+            key = parent.id if self.relation.many \
+                else getattr(parent, self.relation.column.key)
+            value = loader.get(key)
+            self.values[id(parent)] = value
+            for item in (value if self.relation.many else [value]):
+                if item is not None:
+                    seen.setdefault(id(item), item)
+        self.items = list(seen.values())
+
+    def serialize_items(self):
+        self.data = dict(zip(map(id, self.items),
+                             self.selection.serialize(self.items)))
+
+    def render(self, item):
+        data = dict(self.data[id(item)])
+        for child in self.children:
+            value = child.values.get(id(item))
+            if child.relation.many:
+                data[child.name] = [child.render(i) for i in value or []]
+            else:
+                data[child.name] = child.render(value) \
+                    if value is not None else None
+        return data
+
+    def result(self):
+        if self.many:
+            return [self.render(item) for item in self.items]
+        return self.render(self.items[0]) if self.items else None
+
+
+class Loader:
+    # Keys asked for while a level is being planned are collected and
+    # fetched together when the level is dispatched; results are cached for
+    # the rest of the request.
+    missing = None
+
+    def __init__(self, context, type):
+        self.context = context
+        self.type = type
+        self.cache = {}
+        self.pending = set()
+
+    def want(self, keys):
+        self.pending.update(key for key in keys
+                            if key is not None and key not in self.cache)
+
+    def dispatch(self):
+        if not self.pending:
+            return
+        keys, self.pending = self.pending, set()
+        found = self.fetch(keys)
+        for key in keys:
+            self.cache[key] = found.get(key, self.missing)
+
+    def get(self, key):
+        return self.cache.get(key, self.missing)
+
+
+class ByIdLoader(Loader):
+    def fetch(self, keys):
+        column = self.type.primary_key[0]
+        items = self.context.query(self.type).filter(column.in_(keys)).all()
+        return {self.type.key(item): item for item in items}
+
+
+class ChildrenLoader(Loader):
+    # the newest `limit` related rows of each parent, in one query using
+    # row_number() over the rows of each parent
+    def __init__(self, context, type, relation, limit):
+        super().__init__(context, type)
+        self.relation = relation
+        self.limit = limit
+
+    @property
+    def missing(self):
+        return []
+
+    def fetch(self, keys):
+        column = self.relation.column
+        order = [self.type.order] + [c.desc() for c in self.type.primary_key]
+        rank = db.func.row_number().over(partition_by=column, order_by=order)
+        ranked = db.session.query(*self.type.primary_key,
+                                  rank.label('rank'))\
+            .filter(column.in_(keys)).subquery()
+        query = self.context.query(self.type).join(ranked, db.and_(*[
+            c == ranked.c[c.key] for c in self.type.primary_key]))\
+            .filter(ranked.c.rank <= self.limit).order_by(*order)
+        found = {}
+        for item in query:
+            found.setdefault(getattr(item, column.key), []).append(item)
+            self.context.prime(self.type, item)
+        return found
+
+
+class Context:
+    def __init__(self, columns):
+        self.columns = columns
+        self.loaders = {}
+
+    def query(self, type):
+        # relationships are never touched, only the loaders fetch rows
+        return type.model.query.options(
+            load_only(*self.columns[type].values()), lazyload('*'))
+
+    def by_id(self, type):
+        return self.loaders.setdefault(type, ByIdLoader(self, type))
+
+    def children(self, node):
+        key = (node.relation, node.limit)
+        if key not in self.loaders:
+            self.loaders[key] = ChildrenLoader(self, node.type, node.relation,
+                                               node.limit)
+        return self.loaders[key]
+
+    def prime(self, type, item):
+        if len(type.primary_key) == 1:
+            self.by_id(type).cache.setdefault(type.key(item), item)
+
+    def latest(self, type, limit):
+        items = self.query(type).order_by(type.order).limit(limit).all()
+        for item in items:
+            self.prime(type, item)
+        return items
+
+    def dispatch(self):
+        for loader in list(self.loaders.values()):
+            loader.dispatch()
+
+
+def parse(spec):
+    if not isinstance(spec, dict) or not spec:
+        raise ValidationError('query must be an object of root fields')
+    unknown = [name for name in spec if name not in ROOTS]
+    if unknown:
+        raise ValidationError('unknown root fields: %s' %
+                              ', '.join(sorted(unknown)))
+    roots = [Node(name, ROOTS[name][0], None, spec[name], name)
+             for name in spec]
+    config = current_app.config
+    depth = max(root.depth() for root in roots)
+    if depth > config['FLASKY_QUERY_MAX_DEPTH']:
+        raise ValidationError('query depth %d exceeds the limit of %d' %
+                              (depth, config['FLASKY_QUERY_MAX_DEPTH']))
+    cost = sum(root.cost() for root in roots)
+    if cost > config['FLASKY_QUERY_MAX_COST']:
+        raise ValidationError('query cost %d exceeds the limit of %d' %
+                              (cost, config['FLASKY_QUERY_MAX_COST']))
+    return roots, cost
+
+
+def execute(roots):
+    columns = {}
+    for root in roots:
+        root.columns(columns)
+    context = Context(columns)
+    level = [(root, None) for root in roots]
+    while level:
+        for node, parent in level:
+            node.want(context, parent.items if parent else None)
+        context.dispatch()
+        for node, parent in level:
+            node.resolve(context, parent.items if parent else None)
+            node.serialize_items()
+        level = [(child, node) for node, _ in level
+                 for child in node.children]
+    return {root.name: root.result() for root in roots}
+
+
+@api.route('/query', methods=['POST'])
+def query():
+    roots, cost = parse(request.get_json(silent=True))
+    return jsonify({'data': execute(roots), 'cost': cost})
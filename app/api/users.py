@@ -1,33 +1,42 @@
 from flask import jsonify, request, current_app, url_for
 from . import api
 from ..models import User, Post
+from .fields import representation, link_args, total
+from ..pagination import OffsetPagination
+from .. import sharding
 
 
 @api.route('/users/<int:id>')
 def get_user(id):
-    user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    selection = representation(User)
+    user = selection.apply(User.query).filter_by(id=id).first_or_404()
+    return jsonify(selection.serialize_one(user))
 
 
 @api.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    selection = representation(Post)
+    query = sharding.posts_by(user.id).order_by(Post.timestamp.desc())
+    pagination = OffsetPagination(selection.apply(query), page,
+                                  current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_user_posts', id=id, page=page-1)
+        prev = url_for('api.get_user_posts', id=id, page=page-1,
+                       **link_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_user_posts', id=id, page=page+1)
+        next = url_for('api.get_user_posts', id=id, page=page+1,
+                       **link_args())
+    count = total(query)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': selection.serialize(posts),
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': count.value,
+        'count_exact': count.exact
     })
 
 
@@ -35,19 +44,41 @@ def get_user_posts(id):
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    selection = representation(Post)
+    if sharding.enabled():
+        query = sharding.followed_posts(user.id)
+    else:
+        query = user.followed_posts
+    query = query.order_by(Post.timestamp.desc(), Post.id.desc())
+    pagination = OffsetPagination(selection.apply(query), page,
+                                  current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_user_followed_posts', id=id, page=page-1)
+        prev = url_for('api.get_user_followed_posts', id=id, page=page-1,
+                       **link_args())
     next = None
     if pagination.has_next:
-        next = url_for('api.get_user_followed_posts', id=id, page=page+1)
+        next = url_for('api.get_user_followed_posts', id=id, page=page+1,
+                       **link_args())
+    count = total(query)
     return jsonify({
-        'posts': [post.to_json() for post in posts],
+        'posts': selection.serialize(posts),
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': count.value,
+        'count_exact': count.exact
+    })
+
+
+@api.route('/users/<int:id>/suggestions/')
+def get_user_suggestions(id):
+    user = User.query.get_or_404(id)
+    limit = min(request.args.get('limit', 10, type=int),
+                current_app.config['FLASKY_SUGGESTIONS_PER_USER'])
+    selection = representation(User)
+    users = selection.apply(user.suggested_users(limit)).all()
+    return jsonify({
+        'users': selection.serialize(users),
+        'count': len(users)
     })
@@ -0,0 +1,293 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from flask import current_app, g
+from sqlalchemy import DateTime, delete, exists, func, insert, select
+
+
+# Posts whose thread went quiet before a cutoff (the post and all of its
+# comments older than it) are moved out of the posts and comments tables
+# into segment files, one or more per month of the posts' timestamps.
+# archived_posts maps a post id to its segment so the post page and the
+# API can still serve it; listings only show the rows left in the tables.
+#
+# A segment stores each table column by column in groups of ROW_GROUP
+# rows, every column of a group compressed on its own, preceded by the
+# sorted lookup key of the table (posts by id, comments by post_id) as a
+# raw little-endian int64 array. Reads memory-map the file, binary search
+# the key array and decompress only the groups holding the rows asked
+# for. The JSON footer lists where everything is:
+#
+#     MAGIC | keys | groups ... | keys | groups ... | footer | len | MAGIC
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'FLSEG01\n'
+ROW_GROUP = 64
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_segment(path, tables):
+    # tables: name -> (columns, rows sorted by key, index of the key)
+    footer = {'tables': {}}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for name, (columns, rows, key) in tables.items():
+            keys = np.array([row[key] for row in rows], dtype='<i8')
+            table = footer['tables'][name] = {
+                'rows': len(rows),
+                'columns': [c.name for c in columns],
+                'datetimes': [c.name for c in columns
+                              if isinstance(c.type, DateTime)],
+                'keys': f.tell(),
+                'groups': []}
+            f.write(keys.tobytes())
+            for start in range(0, len(rows), ROW_GROUP):
+                group = rows[start:start + ROW_GROUP]
+                chunks = []
+                for i in range(len(columns)):
+                    data = zlib.compress(json.dumps(
+                        [_encode(row[i]) for row in group],
+                        separators=(',', ':')).encode('utf-8'))
+                    chunks.append((f.tell(), len(data)))
+                    f.write(data)
+                table['groups'].append(chunks)
+        data = json.dumps(footer).encode('utf-8')
+        f.write(data)
+        f.write(struct.pack('<Q', len(data)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class Segment:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC or \
+                self.map[-len(MAGIC):] != MAGIC:
+            raise ValueError('%s is not an archive segment' % path)
+        end = len(self.map) - len(MAGIC) - 8
+        length, = struct.unpack('<Q', self.map[end:end + 8])
+        self.tables = json.loads(self.map[end - length:end])['tables']
+        self.keys = {name: np.frombuffer(self.map, '<i8', table['rows'],
+                                         table['keys'])
+                     for name, table in self.tables.items()}
+
+    def _group(self, name, index):
+        table = self.tables[name]
+        columns = []
+        for column, (offset, length) in zip(table['columns'],
+                                            table['groups'][index]):
+            values = json.loads(zlib.decompress(
+                self.map[offset:offset + length]))
+            if column in table['datetimes']:
+                values = [datetime.fromisoformat(v) if v else v
+                          for v in values]
+            columns.append(values)
+        return [dict(zip(table['columns'], row)) for row in zip(*columns)]
+
+    def rows(self, name, key):
+        # the rows of a table whose key equals key, in key order
+        keys = self.keys[name]
+        start = int(np.searchsorted(keys, key, 'left'))
+        stop = int(np.searchsorted(keys, key, 'right'))
+        rows = []
+        if start == stop:
+            return rows
+        for index in range(start // ROW_GROUP, (stop - 1) // ROW_GROUP + 1):
+            first = index * ROW_GROUP
+            rows += self._group(name, index)[max(start - first, 0):
+                                             stop - first]
+        return rows
+
+
+class ArchivedComments(list):
+    # stands in for the dynamic relationship in the templates
+    def count(self):
+        return len(self)
+
+
+class ColdRow:
+    archived = True
+
+    def __init__(self, row):
+        self.__dict__.update(row)
+
+    @property
+    def author(self):
+        from . import db
+        from .models import User
+        return db.session.get(User, self.author_id)
+
+
+class ColdPost(ColdRow):
+    def __init__(self, row, comments):
+        super().__init__(row)
+        self.comments = ArchivedComments(ColdRow(c) for c in comments)
+
+
+class Archive:
+    # open segments are kept mapped, the least recently read closed first
+    max_open = 64
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.lock = threading.Lock()
+        self.segments = OrderedDict()
+        app.extensions['archive'] = self
+        app.after_request(self.server_timing)
+
+    def segment(self, path):
+        with self.lock:
+            segment = self.segments.get(path)
+            if segment is not None:
+                self.segments.move_to_end(path)
+                return segment
+        segment = Segment(os.path.join(
+            current_app.config['FLASKY_ARCHIVE_DIR'], path))
+        with self.lock:
+            self.segments[path] = segment
+            while len(self.segments) > self.max_open:
+                self.segments.popitem(last=False)
+        return segment
+
+    def load_post(self, id):
+        from . import db
+        from .models import ArchivedPost, ArchiveSegment, User
+        path = db.session.execute(
+            select(ArchiveSegment.path)
+            .join(ArchivedPost, ArchivedPost.segment_id == ArchiveSegment.id)
+            .where(ArchivedPost.id == id)).scalar()
+        if path is None:
+            return None
+        start = time.perf_counter()
+        segment = self.segment(path)
+        rows = segment.rows('posts', id)
+        comments = segment.rows('comments', id)
+        # reported on the response (Server-Timing: archive), apart from
+        # the time spent in the database
+        g.archive_time = g.get('archive_time', 0.0) + \
+            time.perf_counter() - start
+        if not rows:
+            return None
+        # segments keep the rows of users deleted since, they are hidden
+        authors = {row['author_id'] for row in rows + comments}
+        authors = set(db.session.scalars(select(User.id)
+                                         .where(User.id.in_(authors))))
+        if rows[0]['author_id'] not in authors:
+            return None
+        return ColdPost(rows[0], [c for c in comments
+                                  if c['author_id'] in authors])
+
+    @staticmethod
+    def server_timing(response):
+        seconds = g.pop('archive_time', None)
+        if seconds is not None:
+            response.headers.add('Server-Timing',
+                                 'archive;dur=%.2f' % (seconds * 1000))
+        return response
+
+def load_post(id):
+    return current_app.extensions['archive'].load_post(id)
+
+
+def _cold_posts(before):
+    # posts older than before whose comments are all older too
+    from . import db
+    posts, comments = db.metadata.tables['posts'], \
+        db.metadata.tables['comments']
+    return posts.c.timestamp < before, ~exists().where(
+        comments.c.post_id == posts.c.id, comments.c.timestamp >= before)
+
+
+def count_cold_posts(before):
+    from . import db
+    posts = db.metadata.tables['posts']
+    return db.session.execute(select(func.count()).select_from(posts)
+                              .where(*_cold_posts(before))).scalar()
+
+
+def archive_posts(before, chunk_size=None):
+    from . import db
+    from .models import ArchivedPost, ArchiveSegment
+    from .partitions import add_months, month_start
+    posts, comments = db.metadata.tables['posts'], \
+        db.metadata.tables['comments']
+    chunk_size = chunk_size or current_app.config['FLASKY_ARCHIVE_CHUNK']
+    directory = current_app.config['FLASKY_ARCHIVE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    cold = _cold_posts(before)
+    written = []
+    while True:
+        oldest = db.session.execute(select(func.min(posts.c.timestamp))
+                                    .where(*cold)).scalar()
+        if oldest is None:
+            break
+        month = month_start(oldest)
+        post_rows = db.session.execute(
+            select(*posts.c).where(*cold, posts.c.timestamp >= month,
+                                   posts.c.timestamp < add_months(month, 1))
+            .order_by(posts.c.id).limit(chunk_size).with_for_update()).all()
+        # no comment can be added to the locked posts until the commit, but
+        # one may have been committed since the query above started
+        comment_rows = db.session.execute(
+            select(*comments.c)
+            .where(comments.c.post_id.in_([row.id for row in post_rows]))
+            .order_by(comments.c.post_id, comments.c.timestamp,
+                      comments.c.id)).all()
+        awake = {row.post_id for row in comment_rows
+                 if row.timestamp is not None and row.timestamp >= before}
+        post_rows = [row for row in post_rows if row.id not in awake]
+        comment_rows = [row for row in comment_rows
+                        if row.post_id not in awake]
+        if not post_rows:
+            db.session.commit()
+            continue
+        ids = [row.id for row in post_rows]
+        segment = ArchiveSegment(path='', month=month, posts=len(post_rows),
+                                 comments=len(comment_rows), size=0)
+        db.session.add(segment)
+        db.session.flush()
+        segment.path = 'posts_%04d_%02d_%06d.seg' % (month.year, month.month,
+                                                     segment.id)
+        path = os.path.join(directory, segment.path)
+        try:
+            segment.size = write_segment(path, {
+                'posts': (list(posts.c), post_rows,
+                          list(posts.c).index(posts.c.id)),
+                'comments': (list(comments.c), comment_rows,
+                             list(comments.c).index(comments.c.post_id))})
+            db.session.execute(insert(ArchivedPost), [
+                {'id': id, 'segment_id': segment.id} for id in ids])
+            # only the comments written to the segment
+            db.session.execute(delete(comments).where(
+                comments.c.id.in_([row.id for row in comment_rows])))
+            db.session.execute(delete(posts).where(posts.c.id.in_(ids)))
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        log.info('Archived %d posts and %d comments to %s', len(post_rows),
+                 len(comment_rows), path)
+        written.append((path, len(post_rows), len(comment_rows)))
+    return written
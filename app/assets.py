@@ -0,0 +1,225 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from flask import current_app, request, send_from_directory
+
+
+# `flask build-assets` copies every file under app/static into
+# app/static/dist with a content hash in its name, next to .gz and .br
+# versions of the compressible ones, and records the mapping in
+# dist/manifest.json. When the manifest exists url_for('static') points at
+# the hashed copies, which never change and can be cached for good.
+OUTPUT_DIR = 'dist'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map', '.ico'}
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def minify_css(text):
+    # conservative: drops comments and whitespace around punctuation that
+    # can never be significant, leaves ":" alone because of selectors such
+    # as "a :hover"
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+# a / after one of these (or after a keyword) starts a regular expression
+# literal rather than a division
+_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'new',
+                   'delete', 'void', 'throw', 'instanceof'}
+
+
+def minify_js(text):
+    # conservative too: only comments and whitespace go. Strings, template
+    # literals and regular expressions are copied as they are, runs of
+    # whitespace become one space, or one line break if they held one so
+    # that automatic semicolon insertion still sees it
+    out = []
+    i, n = 0, len(text)
+
+    def space(blank):
+        if out and out[-1] in (' ', '\n'):
+            if blank == '\n':
+                out[-1] = blank
+        else:
+            out.append(blank)
+
+    def starts_regex():
+        # from the last significant character or word written so far
+        code = ''.join(out[-64:]).rstrip()
+        if code.endswith(('++', '--')):
+            # a postfix operator, what follows divides
+            return False
+        word = re.search(r'[A-Za-z_$][\w$]*$', code)
+        if word:
+            return word.group(0) in _REGEX_KEYWORDS
+        return code[-1:] in _REGEX_AFTER or not code
+
+    while i < n:
+        c = text[i]
+        if c in '\'"`':
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            out.append(text[i:j + 1])
+            i = j + 1
+        elif text.startswith('//', i):
+            i = text.find('\n', i)
+            i = n if i == -1 else i
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            # a comment spanning lines counts as a line break for ASI
+            space('\n' if '\n' in text[i:end] else ' ')
+            i = end
+        elif c == '/' and starts_regex():
+            j, in_class = i + 1, False
+            while j < n and (in_class or text[j] != '/') and text[j] != '\n':
+                if text[j] == '\\':
+                    j += 1
+                elif text[j] == '[':
+                    in_class = True
+                elif text[j] == ']':
+                    in_class = False
+                j += 1
+            out.append(text[i:j + 1])
+            i = j + 1
+        elif c.isspace():
+            j = i
+            while j < n and text[j].isspace():
+                j += 1
+            space('\n' if '\n' in text[i:j] else ' ')
+            i = j
+        else:
+            out.append(c)
+            i += 1
+    # the spaces left before line breaks
+    text = re.sub(r' \n', '\n', ''.join(out))
+    return text.strip() + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _precompress(path, data):
+    import brotli
+    written = []
+    compressed = {
+        '.gz': gzip.compress(data, compresslevel=9, mtime=0),
+        '.br': brotli.compress(data, quality=11),
+    }
+    for suffix, body in compressed.items():
+        if len(body) < len(data):
+            _write(path + suffix, body)
+            written.append(suffix)
+    return written
+
+
+def build_assets(static_folder, echo=None):
+    output = os.path.join(static_folder, OUTPUT_DIR)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d != OUTPUT_DIR]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder)\
+                .replace(os.sep, '/')
+            stem, ext = posixpath.splitext(filename)
+            with open(source, 'rb') as f:
+                data = f.read()
+            if ext in MINIFIERS:
+                data = MINIFIERS[ext](data.decode('utf-8')).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = '%s/%s.%s%s' % (OUTPUT_DIR, stem, digest, ext)
+            target = os.path.join(static_folder, *hashed.split('/'))
+            # older hashed copies stay around for pages rendered before
+            # the deploy
+            if not os.path.exists(target):
+                _write(target, data)
+                if ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+                    _precompress(target, data)
+            manifest[filename] = hashed
+            if echo:
+                echo('%s -> %s' % (filename, hashed))
+    _write(os.path.join(output, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, OUTPUT_DIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class Assets:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.manifest = {}
+        self.precompressed = {}
+        if app.config['FLASKY_HASHED_ASSETS']:
+            self.manifest = load_manifest(app.static_folder)
+        for hashed in self.manifest.values():
+            path = os.path.join(app.static_folder, *hashed.split('/'))
+            self.precompressed[hashed] = [
+                (encoding, suffix) for encoding, suffix in ENCODINGS
+                if os.path.exists(path + suffix)]
+        app.extensions['assets'] = self
+        if self.manifest:
+            app.url_defaults(self.hashed_url)
+            app.before_request(self.send_precompressed)
+            app.after_request(self.cache_headers)
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == 'static':
+            values['filename'] = self.manifest.get(values.get('filename'),
+                                                   values.get('filename'))
+
+    def _static_filename(self):
+        if request.endpoint != 'static' or not request.view_args:
+            return None
+        filename = request.view_args.get('filename')
+        return filename if filename in self.precompressed else None
+
+    def send_precompressed(self):
+        filename = self._static_filename()
+        if filename is None:
+            return
+        for encoding, suffix in self.precompressed[filename]:
+            if request.accept_encodings[encoding]:
+                response = send_from_directory(
+                    current_app.static_folder, filename + suffix,
+                    mimetype=mimetypes.guess_type(filename)[0])
+                response.headers['Content-Encoding'] = encoding
+                return response
+
+    def cache_headers(self, response):
+        if self._static_filename() is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.vary.add('Accept-Encoding')
+        return response
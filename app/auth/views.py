@@ -2,7 +2,8 @@ from flask import render_template, redirect, request, url_for, flash
 from flask_login import login_user, logout_user, login_required, \
     current_user
 from . import auth
-from .. import db
+from .. import db, queries
+from ..exceptions import PasswordCheckBusy
 from ..models import User
 from ..email import send_email
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
@@ -27,12 +28,22 @@ def unconfirmed():
     return render_template('auth/unconfirmed.html')
 
 
+@auth.errorhandler(PasswordCheckBusy)
+def password_check_busy(e):
+    flash('Too many sign-ins right now, please try again in a moment.')
+    return redirect(request.url)
+
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data.lower()).first()
+        user = queries.user_by_email(form.email.data.lower())
         if user is not None and user.verify_password(form.password.data):
+            if not user.is_active:
+                flash('This account has been disabled.')
+                return render_template('auth/login.html', form=form)
+            # the login log entry also commits a rehashed password
             login_user(user, form.remember_me.data)
             next = request.args.get('next')
             if next is None or not next.startswith('/'):
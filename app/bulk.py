@@ -0,0 +1,183 @@
+import logging
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import delete, exists, insert, select, tuple_, update
+from . import db, jobs, sharding, tokens
+from .models import Comment, DeletionJob, Follow, PendingDeletion, Post, \
+    Role, Suggestion, SuggestionRefresh, User, UserLog
+
+
+# Bulk operations of /manage on a set of users, the checked rows or every
+# user matching the search. Disabling, enabling and changing the role are
+# one UPDATE each; disabling and changing the role also bump the token
+# generation, revoking the API tokens issued before. Users waiting for
+# deletion are left out of enabling and of role changes.
+#
+# Deleting disables the users at once and leaves the rest to a background
+# job. It deletes one user at a time, the user's comments, posts, follows,
+# suggestions and log references in chunks of FLASKY_DELETE_CHUNK rows with one
+# transaction each, so that a user with a million comments neither holds
+# locks on all of them until the end nor loads them, then the user row;
+# the ON DELETE CASCADE foreign keys take whatever is left with it. The
+# pending_deletions rows of a job are the users still to delete, a job cut
+# short by a worker restart can be queued again and carries on.
+
+log = logging.getLogger(__name__)
+
+
+def user_filter(q='', role_name=''):
+    # the criteria of the /manage search
+    criteria = []
+    if q:
+        search = f"%{q}%"
+        criteria.append(db.or_(User.username.ilike(search),
+                               User.email.ilike(search)))
+    if role_name:
+        criteria.append(User.role_id == select(Role.id)
+                        .where(Role.name == role_name).scalar_subquery())
+    return criteria
+
+
+def _update(criteria, values, revoke):
+    if revoke:
+        values['token_generation'] = User.token_generation + 1
+    ids = db.session.scalars(
+        update(User).where(*criteria).values(**values).returning(User.id),
+        execution_options={'synchronize_session': False}).all()
+    db.session.commit()
+    if revoke:
+        cache = tokens.generation_cache()
+        for id in ids:
+            cache.forget(id)
+    return ids
+
+
+def _not_pending():
+    return ~exists().where(PendingDeletion.user_id == User.id)
+
+
+def set_disabled(criteria, disabled):
+    if not disabled:
+        criteria = list(criteria) + [_not_pending()]
+    return len(_update(criteria, {'disabled': disabled}, revoke=disabled))
+
+
+def set_role(criteria, role):
+    return len(_update(list(criteria) + [_not_pending()],
+                       {'role_id': role.id}, revoke=True))
+
+
+def delete_users(criteria, requested_by=None):
+    ids = _update(criteria, {'disabled': True}, revoke=True)
+    if not ids:
+        return None
+    job = DeletionJob(requested_by_id=requested_by.id if requested_by
+                      else None, total=len(ids))
+    db.session.add(job)
+    db.session.flush()
+    db.session.execute(insert(PendingDeletion), [
+        {'job_id': job.id, 'user_id': id} for id in ids])
+    db.session.commit()
+    job_id = job.id
+    jobs.enqueue('delete_users', job_id)
+    return db.session.get(DeletionJob, job_id)
+
+
+def _chunks(user_id, chunk_size):
+    # (execute, statement) pairs, a statement deletes or detaches up to
+    # chunk_size rows of the user and is run until it does fewer
+    posts, comments, follows, suggestions, refreshes, logs = (
+        Post.__table__, Comment.__table__, Follow.__table__,
+        Suggestion.__table__, SuggestionRefresh.__table__,
+        UserLog.__table__)
+
+    def some(columns, *where):
+        key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        return key.in_(select(*columns).where(*where).limit(chunk_size))
+
+    content = [
+        # the comments on the user's posts, then those of the user
+        delete(comments).where(some([comments.c.id], comments.c.post_id.in_(
+            select(posts.c.id).where(posts.c.author_id == user_id)))),
+        delete(comments).where(some([comments.c.id],
+                                    comments.c.author_id == user_id)),
+        delete(posts).where(some([posts.c.id], posts.c.author_id == user_id)),
+    ]
+    follow = [follows.c.follower_id, follows.c.followed_id]
+    suggestion = [suggestions.c.user_id, suggestions.c.suggested_id]
+    main = [
+        delete(follows).where(some(follow, follows.c.follower_id == user_id)),
+        delete(follows).where(some(follow, follows.c.followed_id == user_id)),
+        delete(suggestions).where(some(suggestion,
+                                       suggestions.c.user_id == user_id)),
+        delete(suggestions).where(some(suggestion,
+                                       suggestions.c.suggested_id == user_id)),
+        delete(refreshes).where(refreshes.c.user_id == user_id),
+        update(logs).where(logs.c.user_id == user_id,
+                           some([logs.c.id], logs.c.user_id == user_id))
+        .values(user_id=None),
+    ]
+    if sharding.enabled():
+        engines = current_app.extensions['sharding'].engines.values()
+        for engine in engines:
+            for statement in content:
+                yield _on_engine(engine), statement
+    else:
+        for statement in content:
+            yield _on_session, statement
+    for statement in main:
+        yield _on_session, statement
+
+
+def _on_session(statement):
+    # committed with the progress of the job
+    return db.session.execute(statement).rowcount
+
+
+def _on_engine(engine):
+    def execute(statement):
+        with engine.begin() as connection:
+            return connection.execute(statement).rowcount
+    return execute
+
+
+def run_deletion(job_id, chunk_size=None):
+    chunk_size = chunk_size or current_app.config['FLASKY_DELETE_CHUNK']
+    job = db.session.get(DeletionJob, job_id)
+    if job is None or job.status == 'finished':
+        return
+    job.status = 'running'
+    db.session.commit()
+    try:
+        while True:
+            user_id = db.session.scalar(
+                select(PendingDeletion.user_id)
+                .where(PendingDeletion.job_id == job_id)
+                .order_by(PendingDeletion.user_id).limit(1))
+            if user_id is None:
+                break
+            for execute, statement in _chunks(user_id, chunk_size):
+                while True:
+                    count = execute(statement)
+                    job.rows += count
+                    db.session.commit()
+                    if count < chunk_size:
+                        break
+            db.session.execute(delete(PendingDeletion).where(
+                PendingDeletion.job_id == job_id,
+                PendingDeletion.user_id == user_id))
+            db.session.execute(delete(User).where(User.id == user_id))
+            job.done += 1
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished = datetime.utcnow()
+        db.session.commit()
+        raise
+    job.status = 'finished'
+    job.finished = datetime.utcnow()
+    db.session.commit()
+    log.info('Deletion job %d deleted %d users and %d of their rows',
+             job.id, job.done, job.rows)
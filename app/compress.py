@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from flask import current_app, request
+
+
+# Response compression negotiated from Accept-Encoding. Buffered bodies are
+# compressed in one go and the result is kept in a small LRU keyed by a
+# digest of the body, so a page served over and over (the first page of an
+# API listing, say) is only compressed once per worker. Streamed bodies are
+# compressed chunk by chunk and flushed after each chunk so that nothing is
+# held back from the client.
+
+def _brotli(level):
+    import brotli
+    return lambda data: brotli.compress(data, quality=level)
+
+
+def _zstd(level):
+    import zstandard
+    return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _gzip(level):
+    return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class GzipStream:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, level):
+        import brotli
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self, level):
+        import zstandard
+        self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data) + \
+            self.compressor.flush(self.flush_mode)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+CODECS = {
+    'br': (_brotli, BrotliStream),
+    'zstd': (_zstd, ZstdStream),
+    'gzip': (_gzip, GzipStream),
+}
+
+
+class CompressedCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes // 8:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+
+
+def _stream(chunks, stream):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                data = stream.compress(chunk)
+                if data:
+                    yield data
+        yield stream.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Compress:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.algorithms = [a for a in config['COMPRESS_ALGORITHMS']
+                           if a in CODECS]
+        self.levels = config['COMPRESS_LEVELS']
+        self.compressors = {a: CODECS[a][0](self.levels[a])
+                            for a in self.algorithms}
+        self.cache = CompressedCache(config['COMPRESS_CACHE_SIZE'])
+        app.extensions['compress'] = self
+        app.after_request(self.after_request)
+
+    def choose(self):
+        # highest quality value from the client wins, ties go to the
+        # first algorithm in COMPRESS_ALGORITHMS
+        best, best_q = None, 0
+        for algorithm in self.algorithms:
+            q = request.accept_encodings[algorithm]
+            if q > best_q:
+                best, best_q = algorithm, q
+        return best
+
+    def after_request(self, response):
+        config = current_app.config
+        if not config['COMPRESS_ENABLED'] or \
+                response.mimetype not in config['COMPRESS_MIMETYPES'] or \
+                response.status_code < 200 or \
+                response.status_code in (204, 206, 304) or \
+                'Content-Encoding' in response.headers or \
+                response.direct_passthrough:
+            return response
+        response.vary.add('Accept-Encoding')
+        algorithm = self.choose()
+        if algorithm is None:
+            return response
+
+        if response.is_streamed:
+            stream = CODECS[algorithm][1](self.levels[algorithm])
+            response.response = _stream(response.response, stream)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            key = (hashlib.blake2b(data, digest_size=16).digest(), algorithm)
+            compressed = self.cache.get(key)
+            if compressed is None:
+                compressed = self.compressors[algorithm](data)
+                self.cache.put(key, compressed)
+            response.set_data(compressed)
+        response.headers['Content-Encoding'] = algorithm
+        if response.headers.get('ETag'):
+            # each encoding is a different representation
+            tag, weak = response.get_etag()
+            response.set_etag('%s-%s' % (tag, algorithm), weak)
+        return response
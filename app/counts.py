@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from sqlalchemy import Table, text
+
+
+# Totals for listings without a COUNT(*) over millions of rows on every
+# page view. On PostgreSQL a whole table is sized from pg_class.reltuples
+# (summed over the partitions of a partitioned table) and a filtered query
+# from the planner's row estimate. Small estimates are counted exactly,
+# that is cheap and the difference between "about 3" and "2" shows. The
+# few filters shown on every page view, such as the moderation tabs, get
+# exact counts cached for COUNTS_CACHE_TTL seconds instead. Other
+# databases keep no statistics and always count.
+
+Count = namedtuple('Count', 'value exact')
+
+TABLE_ESTIMATE = text(
+    "SELECT sum(reltuples), bool_or(reltuples < 0) FROM pg_class "
+    "WHERE relkind <> 'p' AND (oid = CAST(:table AS regclass) OR oid IN ("
+    "SELECT inhrelid FROM pg_inherits "
+    "WHERE inhparent = CAST(:table AS regclass)))")
+
+
+def table_estimate(connection, table):
+    # None when a table was never analyzed, the planner does better then
+    total, unknown = connection.execute(TABLE_ESTIMATE,
+                                        {'table': table.name}).first()
+    if total is None or unknown:
+        return None
+    return int(total)
+
+
+def planner_estimate(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    plan = connection.exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + compiled.string, compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate(query):
+    query = query.order_by(None)
+    if query.session.info.get('sharded'):
+        # the statistics of a single shard say nothing about the total
+        return None
+    connection = query.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    statement = query.statement
+    froms = statement.get_final_froms()
+    if statement.whereclause is None and len(froms) == 1 and \
+            isinstance(froms[0], Table):
+        rows = table_estimate(connection, froms[0])
+        if rows is not None:
+            return rows
+    return planner_estimate(connection, statement)
+
+
+def count(query, exact=False):
+    query = query.order_by(None)
+    if not exact:
+        rows = estimate(query)
+        if rows is not None and \
+                rows >= current_app.config['COUNTS_EXACT_BELOW']:
+            return Count(rows, False)
+    return Count(query.count(), True)
+
+
+class CountCache:
+    max_entries = 1000
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, ttl):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic() - ttl:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def cached_count(query, exact=False):
+    # exact, but at most COUNTS_CACHE_TTL seconds old
+    query = query.order_by(None)
+    compiled = query.statement.compile()
+    key = (compiled.string, tuple(sorted(compiled.params.items())))
+    cache = current_app.extensions.setdefault('count_cache', CountCache())
+    value = None if exact else \
+        cache.get(key, current_app.config['COUNTS_CACHE_TTL'])
+    if value is None:
+        value = query.count()
+        cache.put(key, value)
+    return Count(value, True)
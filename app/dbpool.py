@@ -0,0 +1,272 @@
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import Counter, deque
+from datetime import datetime
+from functools import partial
+from flask import has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# Connection pool statistics for the current worker process. A QueuePool
+# subclass times every checkout (waiting for a free connection or opening
+# a new one) and counts timeouts and checkouts that needed overflow
+# connections; the pool's checkout and checkin events record how long
+# each endpoint holds its connections and how many are out at once. A
+# background thread reports connections held longer than
+# FLASKY_POOL_LEAK_THRESHOLD seconds with the stack of the thread holding
+# them. From the observed concurrency it suggests pool_size and
+# max_overflow for the workload this process has seen. A forked process
+# starts over with a lock, statistics and leak detector of its own; under
+# gunicorn the detector is started in each worker, never in the master
+# (see gunicorn.conf.py), elsewhere by the first checkout.
+
+log = logging.getLogger(__name__)
+
+# checkouts slower than this count as having waited for the pool
+SLOW_CHECKOUT = 0.01
+
+
+class MonitoredQueuePool(QueuePool):
+    monitor = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.monitor.timed_out(time.perf_counter() - start)
+            raise
+        self.monitor.waited(time.perf_counter() - start, self.overflow())
+        return record
+
+
+class Checkout:
+    __slots__ = ('start', 'endpoint', 'thread', 'stack', 'reported')
+
+    def __init__(self, endpoint, stack):
+        self.start = time.monotonic()
+        self.endpoint = endpoint
+        self.thread = threading.get_ident()
+        self.stack = stack
+        self.reported = False
+
+
+class PoolStats:
+    def __init__(self):
+        self.started = datetime.utcnow()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow = 0
+        self.timeouts = 0
+        self.overflow_checkouts = 0
+        self.overflow_peak = 0
+        self.peak = 0
+        self.concurrency = Counter()
+        self.endpoints = {}
+        self.leaks = deque(maxlen=20)
+
+    def percentile(self, fraction):
+        # concurrency seen by that fraction of checkouts
+        total = sum(self.concurrency.values())
+        seen = 0
+        for value in sorted(self.concurrency):
+            seen += self.concurrency[value]
+            if seen >= total * fraction:
+                return value
+        return 0
+
+
+def _after_fork(ref):
+    monitor = ref()
+    if monitor is not None:
+        monitor.after_fork()
+
+
+class PoolMonitor:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['FLASKY_POOL_MONITOR'] and make_url(
+            config['SQLALCHEMY_DATABASE_URI']).get_backend_name() != 'sqlite'
+        self.leak_threshold = config['FLASKY_POOL_LEAK_THRESHOLD']
+        self.trace_checkouts = config['FLASKY_POOL_TRACE_CHECKOUTS']
+        self.lock = threading.Lock()
+        self.watcher_pid = None
+        self.autostart = True
+        self.reset()
+        app.extensions['pool_monitor'] = self
+        if not self.enabled:
+            return
+        os.register_at_fork(after_in_child=partial(_after_fork,
+                                                   weakref.ref(self)))
+        # a pool class of our own per app, so the events only see its pools
+        pool_class = type('MonitoredQueuePool', (MonitoredQueuePool,),
+                          {'monitor': self})
+        event.listen(pool_class, 'checkout', self.checkout)
+        event.listen(pool_class, 'checkin', self.checkin)
+        event.listen(pool_class, 'detach', self.checkin)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            poolclass=pool_class)
+
+    def reset(self):
+        with self.lock:
+            self.stats = PoolStats()
+            self.outstanding = {}
+
+    def after_fork(self):
+        # another thread of the parent may have held the lock at the fork
+        self.lock = threading.Lock()
+        self.watcher_pid = None
+        self.stats = PoolStats()
+        self.outstanding = {}
+
+    def _start_watcher(self):
+        # called with the lock held
+        pid = os.getpid()
+        if self.leak_threshold > 0 and self.watcher_pid != pid:
+            self.watcher_pid = pid
+            threading.Thread(target=self._watch, args=(pid,),
+                             name='pool-leaks', daemon=True).start()
+
+    def start_watcher(self):
+        with self.lock:
+            self._start_watcher()
+
+    def waited(self, seconds, overflow):
+        with self.lock:
+            stats = self.stats
+            stats.wait_total += seconds
+            stats.wait_max = max(stats.wait_max, seconds)
+            if seconds >= SLOW_CHECKOUT:
+                stats.slow += 1
+            if overflow > 0:
+                stats.overflow_checkouts += 1
+                stats.overflow_peak = max(stats.overflow_peak, overflow)
+
+    def timed_out(self, seconds):
+        with self.lock:
+            self.stats.timeouts += 1
+            self.stats.wait_max = max(self.stats.wait_max, seconds)
+
+    def checkout(self, dbapi_connection, record, proxy):
+        endpoint = (request.endpoint or request.path) \
+            if has_request_context() else '(outside a request)'
+        stack = traceback.extract_stack()[:-1] if self.trace_checkouts \
+            else None
+        with self.lock:
+            if self.autostart:
+                self._start_watcher()
+            self.outstanding[id(record)] = Checkout(endpoint, stack)
+            stats = self.stats
+            stats.checkouts += 1
+            concurrency = len(self.outstanding)
+            stats.concurrency[concurrency] += 1
+            stats.peak = max(stats.peak, concurrency)
+
+    def checkin(self, dbapi_connection, record):
+        with self.lock:
+            checkout = self.outstanding.pop(id(record), None)
+            if checkout is None:
+                return
+            held = time.monotonic() - checkout.start
+            entry = self.stats.endpoints.setdefault(checkout.endpoint,
+                                                    [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += held
+            entry[2] = max(entry[2], held)
+
+    def _watch(self, pid):
+        interval = max(1.0, self.leak_threshold / 2)
+        while self.watcher_pid == pid:
+            time.sleep(interval)
+            self.find_leaks()
+
+    def find_leaks(self):
+        now = time.monotonic()
+        with self.lock:
+            leaked = [c for c in self.outstanding.values() if not c.reported
+                      and now - c.start >= self.leak_threshold]
+            for checkout in leaked:
+                checkout.reported = True
+        frames = sys._current_frames() if leaked else {}
+        for checkout in leaked:
+            held = now - checkout.start
+            frame = frames.get(checkout.thread)
+            holder = ''.join(traceback.format_stack(frame)) if frame \
+                else '(thread has exited)\n'
+            message = 'Connection held for %.1fs by %s\nHolding thread:\n%s' \
+                % (held, checkout.endpoint, holder)
+            if checkout.stack:
+                message += 'Checked out at:\n' + \
+                    ''.join(traceback.format_list(checkout.stack))
+            log.warning(message)
+            with self.lock:
+                self.stats.leaks.append((datetime.utcnow(), checkout.endpoint,
+                                         held))
+        return len(leaked)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            stats = self.stats
+            endpoints = sorted(
+                ((name, count, total, total / count, longest)
+                 for name, (count, total, longest) in stats.endpoints.items()),
+                key=lambda row: row[2], reverse=True)
+            return {
+                'pid': os.getpid(),
+                'started': stats.started,
+                'checked_out': len(self.outstanding),
+                'oldest': max([now - c.start
+                               for c in self.outstanding.values()] or [0]),
+                'checkouts': stats.checkouts,
+                'wait_avg': stats.wait_total / stats.checkouts
+                if stats.checkouts else 0,
+                'wait_max': stats.wait_max,
+                'slow': stats.slow,
+                'timeouts': stats.timeouts,
+                'overflow_checkouts': stats.overflow_checkouts,
+                'overflow_peak': stats.overflow_peak,
+                'peak': stats.peak,
+                'p50': stats.percentile(0.5),
+                'p95': stats.percentile(0.95),
+                'endpoints': endpoints,
+                'leaks': list(stats.leaks),
+            }
+
+    def recommend(self, pool_size, max_overflow):
+        # pool_size covers what 95% of checkouts saw, overflow the peak;
+        # with timeouts or slow checkouts at the current limit the limit
+        # was the bottleneck, so the peak is no upper bound and half as
+        # many connections again are suggested on top
+        with self.lock:
+            stats = self.stats
+            if not stats.checkouts:
+                return None
+            size = max(1, stats.percentile(0.95))
+            peak = stats.peak
+            starved = stats.timeouts or (
+                stats.slow and peak >= pool_size + max_overflow)
+        overflow = max(0, peak - size)
+        if starved:
+            overflow += int(math.ceil(peak / 2))
+        reasons = ['95%% of checkouts found at most %d connections in use, '
+                   'the peak was %d' % (size, peak)]
+        if starved:
+            reasons.append('checkouts waited or timed out with all %d '
+                           'connections in use' % (pool_size + max_overflow))
+        return {'pool_size': size, 'max_overflow': overflow,
+                'reasons': reasons}
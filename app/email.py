@@ -1,20 +1,13 @@
-from threading import Thread
 from flask import current_app, render_template
-from flask_mail import Message
-from . import mail
-
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+from . import jobs
 
 
 def send_email(to, subject, template, **kwargs):
+    # templates are rendered here, where the request is available for
+    # building links, and the message is delivered by a background job
     app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return jobs.enqueue(
+        'send_email', to,
+        app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+        render_template(template + '.txt', **kwargs),
+        render_template(template + '.html', **kwargs))
@@ -1,2 +1,10 @@
 class ValidationError(ValueError):
     pass
+
+
+class InvalidCursor(ValidationError):
+    pass
+
+
+class PasswordCheckBusy(Exception):
+    pass
@@ -1,7 +1,7 @@
 from random import randint
 from faker import Faker
 from .models import User, Post
-from app import db
+from app import db, sharding
 from sqlalchemy.exc import IntegrityError
 
 
@@ -26,12 +26,13 @@ def users(count=100):
 
 def posts(count=100):
     fake = Faker()
+    session = sharding.session()
     user_count = User.query.count()
     for i in range(count):
         u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(), author=u)
-        db.session.add(p)
+        p = Post(body=fake.text(), author_id=u.id)
+        session.add(p)
         try:
-            db.session.commit()
+            session.commit()
         except IntegrityError:
-            db.session.rollback()
\ No newline at end of file
+            session.rollback()
\ No newline at end of file
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+
+# Celery is imported and configured on first use rather than in
+# create_app, so processes that never enqueue anything do not pay for it.
+# Without a broker (task_always_eager) jobs run in a pool of JOBS_THREADS
+# threads of the process, so that a request does not wait for an SMTP
+# server or a deletion; with JOBS_THREADS = 0 they run inline.
+log = logging.getLogger(__name__)
+_lock = threading.Lock()
+_signals_connected = False
+
+
+def init_app(app):
+    app.extensions['celery'] = None
+
+
+def get_celery(app=None):
+    app = app or current_app._get_current_object()
+    celery = app.extensions.get('celery')
+    if celery is None:
+        with _lock:
+            celery = app.extensions.get('celery')
+            if celery is None:
+                celery = app.extensions['celery'] = create_celery(app)
+    celery.set_default()
+    return celery
+
+
+def create_celery(app):
+    from celery import Celery, Task
+
+    class AppTask(Task):
+        # every task runs in its own application context, so it gets its
+        # own database session whether it runs in a worker or eagerly
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    connect_signals()
+    celery = Celery(app.import_name, task_cls=AppTask)
+    celery.config_from_object(app.config['CELERY'])
+    celery.flask_app = app
+    from . import tasks  # noqa: F401, registers the shared tasks
+    return celery
+
+
+def get_executor(app):
+    # one per process, the threads of a forked parent's are not ours
+    pid, executor = app.extensions.get('jobs_executor', (None, None))
+    if pid != os.getpid():
+        with _lock:
+            pid, executor = app.extensions.get('jobs_executor', (None, None))
+            if pid != os.getpid():
+                executor = ThreadPoolExecutor(app.config['JOBS_THREADS'],
+                                              thread_name_prefix='jobs')
+                app.extensions['jobs_executor'] = (os.getpid(), executor)
+    return executor
+
+
+def _apply(task, args, kwargs):
+    result = task.apply(args, kwargs, throw=False)
+    if result.failed():
+        log.error('Job %s failed:\n%s', task.name, result.traceback)
+    return result
+
+
+def enqueue(name, *args, **kwargs):
+    app = current_app._get_current_object()
+    celery = get_celery(app)
+    from . import tasks
+    task = getattr(tasks, name)
+    if celery.conf.task_always_eager and app.config['JOBS_THREADS'] > 0:
+        return get_executor(app).submit(_apply, task, args, kwargs)
+    return task.delay(*args, **kwargs)
+
+
+class TaskStats:
+    # Per-task counters kept by every worker process. Wait time is measured
+    # from publish to start, so it is only known for tasks sent through the
+    # broker.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = {}
+        self.tasks = {}
+
+    def start(self, task_id, enqueued_at):
+        self.started[task_id] = (time.time(), enqueued_at)
+
+    def finish(self, task_id, name, state):
+        started, enqueued_at = self.started.pop(task_id, (None, None))
+        if started is None:
+            return
+        runtime = time.time() - started
+        with self.lock:
+            entry = self.tasks.setdefault(name, {
+                'count': 0, 'failed': 0, 'runtime': 0.0, 'max_runtime': 0.0,
+                'waited': 0, 'wait': 0.0, 'max_wait': 0.0})
+            entry['count'] += 1
+            if state != 'SUCCESS':
+                entry['failed'] += 1
+            entry['runtime'] += runtime
+            entry['max_runtime'] = max(entry['max_runtime'], runtime)
+            if enqueued_at:
+                wait = max(0.0, started - enqueued_at)
+                entry['waited'] += 1
+                entry['wait'] += wait
+                entry['max_wait'] = max(entry['max_wait'], wait)
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for name, entry in self.tasks.items():
+                result[name] = {
+                    'count': entry['count'],
+                    'failed': entry['failed'],
+                    'avg_runtime': entry['runtime'] / entry['count'],
+                    'max_runtime': entry['max_runtime'],
+                    'avg_wait': entry['wait'] / entry['waited']
+                    if entry['waited'] else None,
+                    'max_wait': entry['max_wait'] if entry['waited'] else None,
+                }
+            return result
+
+
+stats = TaskStats()
+
+
+def connect_signals():
+    global _signals_connected
+    if _signals_connected:
+        return
+    from celery.signals import (before_task_publish, task_prerun,
+                                task_postrun, worker_process_init)
+    from celery.worker.control import inspect_command
+
+    @before_task_publish.connect(weak=False)
+    def stamp_enqueued(headers=None, **kwargs):
+        if headers is not None:
+            headers['enqueued_at'] = time.time()
+
+    @task_prerun.connect(weak=False)
+    def task_started(task_id=None, task=None, **kwargs):
+        stats.start(task_id, getattr(task.request, 'enqueued_at', None))
+
+    @task_postrun.connect(weak=False)
+    def task_finished(task_id=None, task=None, state=None, **kwargs):
+        stats.finish(task_id, task.name, state)
+
+    @worker_process_init.connect(weak=False)
+    def reset_pool(**kwargs):
+        # pooled connections inherited from the parent must not be shared
+        # with the forked worker processes
+        from celery import current_app as celery
+        from . import db
+        with celery.flask_app.app_context():
+            db.engine.dispose(close=False)
+
+    @inspect_command()
+    def task_stats(state):
+        """Runtime and queue wait per task in this worker."""
+        return stats.snapshot()
+
+    _signals_connected = True
+
+
+def queue_depth(celery, queues=None):
+    from kombu.exceptions import ChannelError
+    queues = queues or [celery.conf.task_default_queue]
+    depth = {}
+    with celery.connection_for_read() as conn:
+        for name in queues:
+            try:
+                depth[name] = conn.default_channel.queue_declare(
+                    queue=name, passive=True).message_count
+            except ChannelError:
+                # nothing has been sent to the queue yet
+                depth[name] = 0
+    return depth
+
+
+def job_stats(celery, timeout=1.0):
+    if celery.conf.task_always_eager:
+        return {'eager': True, 'queues': {}, 'workers': {'local': stats.snapshot()}}
+    workers = {}
+    for reply in celery.control.broadcast('task_stats', reply=True,
+                                          timeout=timeout):
+        workers.update(reply)
+    return {'eager': False, 'queues': queue_depth(celery), 'workers': workers}
@@ -0,0 +1,60 @@
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Same output as the default provider (dates as HTTP dates, sorted keys,
+    # indented in debug mode) produced by orjson. Anything orjson refuses,
+    # such as integers wider than 64 bits, goes through the stdlib encoder.
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def _options(self, indent=False):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _indent(self):
+        compact = self.compact
+        return not compact if compact is not None else self._app.debug
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self._default,
+                                option=self._options()).decode('utf-8')
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            data = orjson.dumps(obj, default=self._default,
+                                option=self._options(self._indent()))
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
+
+
+def init_app(app):
+    if orjson is not None and app.config['FLASKY_FAST_JSON']:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,257 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from flask import current_app, jsonify, request
+
+
+# Live updates over server-sent events. Committed posts and comments are
+# published as events on channels ("posts", "user:<author id>" and
+# "post:<post id>"); every process keeps the latest events in a ring buffer
+# that the open streams wait on. With the memory backend events only reach
+# streams of the process that published them; the Redis backend carries
+# them through a Redis stream to every worker, Celery included, and also
+# lets a client resume on a worker other than the one it was connected to.
+
+Event = namedtuple('Event', 'id kind channels data')
+
+log = logging.getLogger(__name__)
+
+
+class Hub:
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.sequence = 0
+
+    def receive(self, event):
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, event))
+            self.condition.notify_all()
+
+    def position(self, event_id):
+        # sequence of an event still in the buffer
+        with self.condition:
+            for sequence, event in self.events:
+                if event.id == event_id:
+                    return sequence
+        return None
+
+    def wait(self, after, timeout):
+        with self.condition:
+            if self.sequence <= after:
+                self.condition.wait(timeout)
+            return [(s, e) for s, e in self.events if s > after]
+
+
+class MemoryBackend:
+    def __init__(self, hub):
+        self.hub = hub
+        # ids from another process never match ours
+        self.prefix = uuid.uuid4().hex[:8]
+        self.counter = itertools.count(1)
+
+    def publish(self, kind, channels, data):
+        self.hub.receive(Event('%s-%d' % (self.prefix, next(self.counter)),
+                               kind, channels, data))
+
+    def history(self, last_id, count):
+        return None
+
+    def start(self):
+        pass
+
+
+def _stream_id(id):
+    ms, _, seq = id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+class RedisBackend:
+    def __init__(self, hub, url, stream, maxlen):
+        import redis
+        self.hub = hub
+        self.client = redis.Redis.from_url(url)
+        self.errors = (redis.RedisError,)
+        self.stream = stream
+        self.maxlen = maxlen
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def publish(self, kind, channels, data):
+        self.client.xadd(self.stream,
+                         {'event': json.dumps([kind, channels, data])},
+                         maxlen=self.maxlen, approximate=True)
+
+    def _event(self, id, fields):
+        kind, channels, data = json.loads(fields[b'event'])
+        return Event(id.decode('ascii'), kind, channels, data)
+
+    def history(self, last_id, count):
+        # events after last_id, None when some of them were trimmed off
+        # the stream or there are too many to replay
+        try:
+            _stream_id(last_id)
+            first = self.client.xrange(self.stream, '-', '+', count=1)
+            if not first or \
+                    _stream_id(first[0][0].decode('ascii')) > \
+                    _stream_id(last_id):
+                return None
+            entries = self.client.xrange(self.stream, '(' + last_id, '+',
+                                         count=count + 1)
+        except (ValueError,) + self.errors:
+            return None
+        if len(entries) > count:
+            return None
+        return [self._event(*entry) for entry in entries]
+
+    def start(self):
+        # one reader thread per process, started after the fork
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._read, name='live-events',
+                             daemon=True).start()
+
+    def _read(self):
+        last = '$'
+        while True:
+            try:
+                response = self.client.xread({self.stream: last},
+                                             block=5000, count=100)
+            except self.errors:
+                log.exception('Reading live events from Redis failed')
+                time.sleep(1)
+                continue
+            for _, entries in response:
+                for id, fields in entries:
+                    last = id
+                    self.hub.receive(self._event(id, fields))
+
+
+def create_backend(url, hub, config):
+    if url == 'memory://':
+        return MemoryBackend(hub)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(hub, url, config['LIVE_REDIS_STREAM'],
+                            config['LIVE_REDIS_MAXLEN'])
+    raise ValueError('unsupported live events backend %r' % url)
+
+
+def _format(event):
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (
+        event.id, event.kind, json.dumps(event.data, separators=(',', ':')))
+
+
+# tells the client that events were missed and the page should be reloaded
+RESET = 'event: reset\ndata: {}\n\n'
+
+
+class Live:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.hub = Hub(config['LIVE_BUFFER_SIZE'])
+        self.backend = create_backend(config['LIVE_BACKEND_URL'], self.hub,
+                                      config)
+        # streams hold a thread each for as long as they are open
+        self.slots = threading.BoundedSemaphore(config['LIVE_MAX_STREAMS'])
+        app.extensions['live'] = self
+
+    def publish(self, kind, channels, data):
+        self.backend.publish(kind, channels, data)
+
+    def listen(self, channels, last_id, timeout, heartbeat):
+        self.backend.start()
+        after = self.hub.sequence
+        replayed = set()
+        if last_id:
+            position = self.hub.position(last_id)
+            if position is not None:
+                after = position
+            else:
+                history = self.backend.history(last_id,
+                                               self.hub.events.maxlen)
+                if history is None:
+                    yield RESET
+                for event in history or ():
+                    replayed.add(event.id)
+                    if channels.intersection(event.channels):
+                        yield _format(event)
+        deadline = time.monotonic() + timeout
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            events = self.hub.wait(after, heartbeat)
+            if events and events[0][0] > after + 1:
+                # fell behind by more than the buffer holds
+                yield RESET
+            chunk = ''
+            for sequence, event in events:
+                after = sequence
+                if event.id not in replayed and \
+                        channels.intersection(event.channels):
+                    chunk += _format(event)
+            if chunk:
+                yield chunk
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+
+    def stream(self, channels):
+        # Streams end after LIVE_STREAM_TIMEOUT, the browser reconnects on
+        # its own and picks up where it left off through Last-Event-ID.
+        config = current_app.config
+        if not self.slots.acquire(blocking=False):
+            response = jsonify({'error': 'service unavailable',
+                                'message': 'Too many live streams'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            return response
+        last_id = request.headers.get('Last-Event-ID') or \
+            request.args.get('last_event_id')
+        body = itertools.chain(
+            ['retry: %d\n\n' % config['LIVE_RETRY_MS']],
+            self.listen(set(channels), last_id,
+                        config['LIVE_STREAM_TIMEOUT'],
+                        config['LIVE_HEARTBEAT']))
+        response = current_app.response_class(
+            body, mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.call_on_close(self.slots.release)
+        return response
+
+
+def channels_for(user, feed=None, posts=()):
+    # "all" follows every new post, "followed" the accounts the user follows
+    from . import db
+    from .models import Follow
+    channels = {'post:%d' % id for id in posts}
+    if feed == 'all':
+        channels.add('posts')
+    elif feed == 'followed' and user.is_authenticated:
+        channels.update('user:%d' % id for id, in db.session.query(
+            Follow.followed_id).filter_by(follower_id=user.id))
+    return channels
+
+
+def publish(kind, channels, data):
+    live = current_app.extensions.get('live')
+    if live is None:
+        return
+    try:
+        live.publish(kind, channels, data)
+    except Exception:
+        # the change is committed already, a missed event only means
+        # clients see it on their next reload
+        current_app.logger.exception('Could not publish a live event')
@@ -58,3 +58,21 @@ class PostForm(FlaskForm):
 class CommentForm(FlaskForm):
     body = StringField('Enter your comment', validators=[DataRequired()])
     submit = SubmitField('Submit')
+
+
+class ModerateCommentsForm(FlaskForm):
+    enable = SubmitField('Enable selected')
+    disable = SubmitField('Disable selected')
+
+
+class BulkUsersForm(FlaskForm):
+    action = SelectField('Action')
+    everyone = BooleanField('Every user matching the search')
+    submit = SubmitField('Apply')
+
+    def __init__(self, *args, **kwargs):
+        super(BulkUsersForm, self).__init__(*args, **kwargs)
+        self.action.choices = [('disable', 'Disable'), ('enable', 'Enable')] + \
+            [('role:%d' % role.id, 'Make %s' % role.name)
+             for role in Role.query.order_by(Role.name).all()] + \
+            [('delete', 'Delete')]
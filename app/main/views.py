@@ -1,13 +1,23 @@
 from flask import render_template, redirect, url_for, abort, flash, request,\
-    current_app, make_response
+    current_app, make_response, jsonify
 from flask_login import login_required, current_user
+from flask_wtf.csrf import validate_csrf
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+from wtforms import ValidationError as CSRFValidationError
 # from flask_sqlalchemy import get_debug_queries
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm,\
-    CommentForm
+    CommentForm, ModerateCommentsForm, BulkUsersForm
 from .. import db
-from ..models import Permission, Role, User, Post, Comment, UserLog
+from ..models import Permission, Role, User, Post, Comment, UserLog, \
+    Follow, DeletionJob
 from ..decorators import admin_required, permission_required
+from ..pagination import KeysetPagination
+from ..counts import count, cached_count
+from ..exceptions import InvalidCursor
+from ..moderation import STATUSES, moderation_queue, set_disabled
+from ..live import channels_for
+from .. import archive, bulk, queries, sharding
 
 
 # @main.after_app_request
@@ -32,41 +42,69 @@ from ..decorators import admin_required, permission_required
 #     return 'Shutting down...'
 
 
+def exact():
+    return request.args.get('exact') == '1'
+
+
+def paginate(query, columns, per_page, descending=True):
+    # seek pagination driven by ?after=, ?before= and ?last=1
+    if not isinstance(query, StatementLambdaElement):
+        query = query.order_by(None)
+    try:
+        return KeysetPagination(
+            query, columns, per_page=per_page,
+            after=request.args.get('after'), before=request.args.get('before'),
+            descending=descending, last=bool(request.args.get('last')))
+    except InvalidCursor:
+        abort(400)
+
+
 @main.route('/', methods=['GET', 'POST'])
 def index():
     form = PostForm()
     if current_user.can(Permission.WRITE) and form.validate_on_submit():
-        post = Post(body=form.body.data,
-                    author=current_user._get_current_object())
-        db.session.add(post)
-        db.session.commit()
+        session = sharding.session()
+        session.add(Post(body=form.body.data, author_id=current_user.id))
+        session.commit()
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_posts
+        query = sharding.followed_posts(current_user.id)
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+        query = sharding.all_posts()
+    pagination = paginate(query, [Post.timestamp, Post.id],
+                          current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
+    suggestions = []
+    if current_user.can(Permission.FOLLOW):
+        suggestions = current_user.suggested_users(5).all()
     return render_template('index.html', form=form, posts=posts,
-                           show_followed=show_followed, pagination=pagination)
+                           show_followed=show_followed, pagination=pagination,
+                           suggestions=suggestions)
+
+
+@main.route('/hot')
+def hot():
+    pagination = paginate(sharding.hot_posts(), [Post.hot_score, Post.id],
+                          current_app.config['FLASKY_POSTS_PER_PAGE'])
+    posts = pagination.items
+    return render_template('hot.html', posts=posts, pagination=pagination)
 
 
 @main.route('/user/<username>')
 def user(username):
-    user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    user = queries.user_by_username(username)
+    if user is None:
+        abort(404)
+    posts = sharding.posts_by(user.id)
+    post_count = posts.count()
+    pagination = paginate(posts, [Post.timestamp, Post.id],
+                          current_app.config['FLASKY_POSTS_PER_PAGE'])
     posts = pagination.items
     return render_template('user.html', user=user, posts=posts,
-                           pagination=pagination)
+                           post_count=post_count, pagination=pagination)
 
 
 @main.route('/edit-profile', methods=['GET', 'POST'])
@@ -96,6 +134,10 @@ def edit_profile_admin(id):
     if form.validate_on_submit():
         user.email = form.email.data
         user.username = form.username.data
+        if user.role_id != form.role.data or \
+                user.confirmed != form.confirmed.data:
+            # API tokens carry the old permissions
+            user.revoke_auth_tokens()
         user.confirmed = form.confirmed.data
         user.role = Role.query.get(form.role.data)
         user.name = form.name.data
@@ -117,40 +159,52 @@ def edit_profile_admin(id):
 
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
 def post(id):
-    post = Post.query.get_or_404(id)
+    post = sharding.get(Post, id) or archive.load_post(id)
+    if post is None:
+        abort(404)
     form = CommentForm()
+    if post.archived:
+        # read only, with all of its comments
+        return render_template('post.html', posts=[post], form=form,
+                               comments=post.comments, pagination=None)
     if form.validate_on_submit():
-        comment = Comment(body=form.body.data,
-                          post=post,
-                          author=current_user._get_current_object())
-        db.session.add(comment)
-        db.session.commit()
+        session = sharding.session()
+        session.add(Comment(body=form.body.data, post_id=post.id,
+                            author_id=current_user.id))
+        session.commit()
         flash('Your comment has been published.')
-        return redirect(url_for('.post', id=post.id, page=-1))
-    page = request.args.get('page', 1, type=int)
-    if page == -1:
-        page = (post.comments.count() - 1) // \
-            current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+        return redirect(url_for('.post', id=post.id, last=1,
+                                _anchor='comments'))
+    pagination = paginate(sharding.comments_of(post.id),
+                          [Comment.timestamp, Comment.id],
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+                          descending=False)
     comments = pagination.items
     return render_template('post.html', posts=[post], form=form,
                            comments=comments, pagination=pagination)
 
 
+@main.route('/events')
+def events():
+    # ?feed=all|followed for new posts, ?post=<id> for new comments
+    channels = channels_for(current_user, request.args.get('feed'),
+                            request.args.getlist('post', type=int))
+    if not channels:
+        abort(400)
+    return current_app.extensions['live'].stream(channels)
+
+
 @main.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
-    post = Post.query.get_or_404(id)
-    if current_user != post.author and \
+    post = sharding.get_or_404(Post, id)
+    if current_user.id != post.author_id and \
             not current_user.can(Permission.ADMIN):
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
         post.body = form.body.data
-        db.session.add(post)
-        db.session.commit()
+        sharding.session().commit()
         flash('The post has been updated.')
         return redirect(url_for('.post', id=post.id))
     form.body.data = post.body
@@ -161,7 +215,7 @@ def edit(id):
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
-    user = User.query.filter_by(username=username).first()
+    user = queries.user_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -178,7 +232,7 @@ def follow(username):
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
-    user = User.query.filter_by(username=username).first()
+    user = queries.user_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -193,36 +247,36 @@ def unfollow(username):
 
 @main.route('/followers/<username>')
 def followers(username):
-    user = User.query.filter_by(username=username).first()
+    user = queries.user_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page=page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.followers,
+                          [Follow.timestamp, Follow.follower_id],
+                          current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followers of",
                            endpoint='.followers', pagination=pagination,
-                           follows=follows)
+                           follows=follows,
+                           total=count(user.followers, exact()))
 
 
 @main.route('/followed_by/<username>')
 def followed_by(username):
-    user = User.query.filter_by(username=username).first()
+    user = queries.user_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page=page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(user.followed,
+                          [Follow.timestamp, Follow.followed_id],
+                          current_app.config['FLASKY_FOLLOWERS_PER_PAGE'])
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followed by",
                            endpoint='.followed_by', pagination=pagination,
-                           follows=follows)
+                           follows=follows,
+                           total=count(user.followed, exact()))
 
 
 @main.route('/all')
@@ -241,82 +295,183 @@ def show_followed():
     return resp
 
 
-@main.route('/moderate')
+@main.route('/moderate', methods=['GET', 'POST'])
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    status = request.args.get('status', 'queue')
+    if status not in STATUSES:
+        abort(400)
+    filters = {'status': status,
+               'author': request.args.get('author', '').strip(),
+               'post': request.args.get('post', type=int)}
+    params = {k: v for k, v in filters.items() if v}
+    form = ModerateCommentsForm()
+    if form.validate_on_submit():
+        updated = set_disabled(request.form.getlist('ids', type=int),
+                               form.disable.data)
+        flash('%d comments %s.' % (updated, 'disabled' if form.disable.data
+                                   else 'enabled'))
+        return redirect(url_for('.moderate', after=request.args.get('after'),
+                                before=request.args.get('before'), **params))
+    query = moderation_queue(status, author=filters['author'],
+                             post_id=filters['post'])
+    pagination = paginate(query if sharding.enabled() else
+                          query.options(db.joinedload(Comment.author)),
+                          [Comment.timestamp, Comment.id],
+                          current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     comments = pagination.items
-    return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+    # the status tabs are counted on every page view, those counts are
+    # cached; a listing narrowed to an author or post is small anyway
+    counts = {s: cached_count(moderation_queue(s), exact()) for s in STATUSES}
+    total = counts[status] if not filters['author'] and \
+        not filters['post'] else count(query, exact())
+    return render_template('moderate.html', comments=comments, form=form,
+                           pagination=pagination, filters=filters,
+                           params=params, statuses=STATUSES, counts=counts,
+                           total=total)
+
+
+@main.route('/moderate/comments', methods=['POST'])
+@login_required
+@permission_required(Permission.MODERATE)
+def moderate_comments():
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except CSRFValidationError:
+            return jsonify({'error': 'bad request',
+                            'message': 'missing or invalid CSRF token'}), 400
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    ids = data.get('ids')
+    if action not in ('enable', 'disable') or not isinstance(ids, list) or \
+            not all(isinstance(id, int) for id in ids):
+        return jsonify({'error': 'bad request',
+                        'message': 'expected an action and a list of ids'}), 400
+    updated = set_disabled(ids, action == 'disable')
+    return jsonify({'ids': ids, 'disabled': action == 'disable',
+                    'updated': updated})
 
 
 @main.route('/moderate/enable/<int:id>')
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_enable(id):
-    comment = Comment.query.get_or_404(id)
-    comment.disabled = False
-    db.session.add(comment)
-    db.session.commit()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    if not set_disabled([id], False):
+        abort(404)
+    return redirect(url_for('.moderate'))
 
 
 @main.route('/moderate/disable/<int:id>')
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_disable(id):
-    comment = Comment.query.get_or_404(id)
-    comment.disabled = True
-    db.session.add(comment)
-    db.session.commit()
-    return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+    if not set_disabled([id], True):
+        abort(404)
+    return redirect(url_for('.moderate'))
     
-@main.route('/manage')
+@main.route('/manage', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def manage():
-    page = request.args.get('page', 1, type=int)
     q = request.args.get('q', '').strip()
     role_name = request.args.get('role', '').strip()
-    query = User.query
-    if q:
-        search = f"%{q}%"
-        query = query.filter(
-            db.or_(
-                User.username.ilike(search),
-                User.email.ilike(search)
-            )
-        )
-    if role_name:
-        query = query.join(Role).filter(Role.name == role_name)
-    pagination = query.order_by(User.id.asc()).paginate(
-        page=page, per_page=current_app.config['FLASKY_USERS_PER_PAGE'], error_out=False)
+    params = {k: v for k, v in {'q': q, 'role': role_name}.items() if v}
+    form = BulkUsersForm()
+    if form.validate_on_submit():
+        if form.everyone.data:
+            criteria = bulk.user_filter(q, role_name)
+        else:
+            criteria = [User.id.in_(request.form.getlist('ids', type=int))]
+        # never the administrator applying it
+        criteria.append(User.id != current_user.id)
+        action = form.action.data
+        if action == 'delete':
+            job = bulk.delete_users(criteria, current_user)
+            flash('Deleting %d users in the background.' % job.total if job
+                  else 'No users to delete.')
+        elif action.startswith('role:'):
+            role = Role.query.get_or_404(int(action[len('role:'):]))
+            flash('%d users are now %s.' % (bulk.set_role(criteria, role),
+                                            role.name))
+        else:
+            flash('%d users %sd.' % (bulk.set_disabled(
+                criteria, action == 'disable'), action))
+        return redirect(url_for('.manage', **params))
+    query = User.query.filter(*bulk.user_filter(q, role_name))
+    pagination = paginate(query, [User.id],
+                          current_app.config['FLASKY_USERS_PER_PAGE'],
+                          descending=False)
     users = pagination.items
     roles = Role.query.order_by(Role.name).all()
-    return render_template('manage.html', users=users, pagination=pagination, q=q, roles=roles, role_name=role_name)
+    deletions = DeletionJob.query.order_by(DeletionJob.id.desc()).limit(5)\
+        .all()
+    return render_template('manage.html', users=users, pagination=pagination, q=q, roles=roles, role_name=role_name,
+                           params=params, total=count(query, exact()),
+                           form=form, deletions=deletions)
+
+@main.route('/manage/deletions/<int:id>')
+@login_required
+@admin_required
+def deletion(id):
+    # polled by /manage while the job runs
+    return jsonify(DeletionJob.query.get_or_404(id).to_json())
 
-@main.route('/delete_user/<int:id>')
+@main.route('/delete_user/<int:id>', methods=['POST'])
 @login_required
 @admin_required
 def delete_user(id):
-    user = User.query.get_or_404(id)
-    db.session.delete(user)
-    db.session.commit()
-    flash('User deleted successfully.')
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.form.get('csrf_token'))
+        except CSRFValidationError:
+            abort(400)
+    if id == current_user.id:
+        abort(400)
+    if bulk.delete_users([User.id == id], current_user) is None:
+        abort(404)
+    flash('Deleting the user in the background.')
     return redirect(url_for('.manage'))
 
+@main.route('/pool')
+@login_required
+@admin_required
+def pool():
+    # statistics of the worker process that serves this request
+    monitor = current_app.extensions['pool_monitor']
+    options = current_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    return render_template(
+        'pool.html', enabled=monitor.enabled, stats=monitor.snapshot(),
+        options=options, leak_threshold=monitor.leak_threshold,
+        recommendation=monitor.recommend(options.get('pool_size', 5),
+                                         options.get('max_overflow', 10)))
+
 @main.route('/logs')
 @login_required
 @admin_required
 def user_logs():
-    page = request.args.get('page', 1, type=int)
-    pagination = UserLog.query.order_by(UserLog.timestamp.desc()).paginate(
-        page=page, per_page=20, error_out=False)
+    filters = {name: request.args.get(name, '').strip()
+               for name in ('user', 'ip', 'action')}
+    query = UserLog.query.options(db.joinedload(UserLog.user))
+    if filters['user']:
+        query = query.filter(UserLog.user_id == db.session.query(User.id)
+                             .filter_by(username=filters['user'])
+                             .scalar_subquery())
+    if filters['ip']:
+        query = query.filter(UserLog.ip == filters['ip'])
+    if filters['action']:
+        query = query.filter(UserLog.action == filters['action'])
+    pagination = paginate(query, [UserLog.timestamp, UserLog.id],
+                          current_app.config['FLASKY_LOGS_PER_PAGE'])
     logs = pagination.items
-    return render_template('user_logs.html', logs=logs, pagination=pagination)
+    # the action filter alone is common enough to keep its count cached
+    if filters['user'] or filters['ip']:
+        total = count(query, exact())
+    elif filters['action']:
+        total = cached_count(query, exact())
+    else:
+        total = count(UserLog.query, exact())
+    return render_template('user_logs.html', logs=logs, pagination=pagination,
+                           filters=filters, total=total,
+                           params={k: v for k, v in filters.items() if v})
@@ -0,0 +1,44 @@
+import heapq
+from itertools import islice
+from sqlalchemy import literal, tuple_
+
+
+# Lazy k-way merge of sorted streams, used to read one listing out of
+# several databases (see app/sharding.py). The heap holds the head row of
+# every stream and nothing else; the next row of a stream is pulled only
+# once its head has been handed out, so reading the first N rows of the
+# merge never asks a stream for more than N + 1 of them. Streams from the
+# database (keyset_stream) fetch their rows in batches, which bounds the
+# memory of a merge at one batch per stream.
+
+# rows fetched per round trip when the caller gives no limit
+BATCH = 100
+
+
+def merge(streams, key, descending=False):
+    # rows of all streams in key order, each stream sorted by the same key;
+    # heapq.merge keeps one (key, row) per stream and advances a stream
+    # only when its row is yielded
+    return heapq.merge(*streams, key=key, reverse=descending)
+
+
+def top(streams, key, n, descending=False, offset=0):
+    # rows offset .. offset + n of the merge
+    return list(islice(merge(streams, key, descending), offset, offset + n))
+
+
+def keyset_stream(query, columns, descending=True, batch=BATCH):
+    # the rows of a Query ordered by columns (a unique key such as
+    # (timestamp, id)), fetched `batch` at a time, each batch seeking
+    # past the last row of the one before
+    order = [c.desc() if descending else c.asc() for c in columns]
+    key = tuple_(*columns)
+    page = query
+    while True:
+        rows = page.order_by(*order).limit(batch).all()
+        yield from rows
+        if len(rows) < batch:
+            return
+        last = tuple_(*[literal(getattr(rows[-1], c.key), c.type)
+                        for c in columns])
+        page = query.filter(key < last if descending else key > last)
@@ -1,13 +1,14 @@
 from datetime import datetime
 import hashlib
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer as Serializer
-from markdown import markdown
-import bleach
-from flask import current_app, request, url_for
+from flask import current_app, request
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
-from app.exceptions import ValidationError
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from . import db, login_manager, tokens
+from app.exceptions import PasswordCheckBusy, ValidationError
+from .projection import Field, Projection
+from .urls import external_url
 
 class Permission:
     FOLLOW = 1
@@ -72,12 +73,49 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = 'follows'
-    follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+    follower_id = db.Column(db.Integer,
+                            db.ForeignKey('users.id', ondelete='CASCADE'),
                             primary_key=True)
-    followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+    followed_id = db.Column(db.Integer,
+                            db.ForeignKey('users.id', ondelete='CASCADE'),
                             primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_follows_followed_id_timestamp',
+                 'followed_id', 'timestamp', 'follower_id'),
+        db.Index('ix_follows_follower_id_timestamp',
+                 'follower_id', 'timestamp', 'followed_id'),
+    )
+
+
+class Suggestion(db.Model):
+    __tablename__ = 'suggestions'
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True)
+    suggested_id = db.Column(db.Integer,
+                             db.ForeignKey('users.id', ondelete='CASCADE'),
+                             primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SuggestionRefresh(db.Model):
+    # users whose follow edges changed since suggestions were last computed
+    __tablename__ = 'suggestion_refreshes'
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def mark(user):
+        if user.id is None:
+            return
+        db.session.merge(SuggestionRefresh(user_id=user.id,
+                                           timestamp=datetime.utcnow()))
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -93,18 +131,31 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.Text())
-    posts = db.relationship('Post', backref='author', lazy='dynamic', cascade='all, delete-orphan')
+    # bumped to revoke the API tokens issued so far
+    token_generation = db.Column(db.Integer, nullable=False, default=0,
+                                 server_default='0')
+    # disabled accounts can neither log in nor use the API
+    disabled = db.Column(db.Boolean, nullable=False, default=False,
+                         server_default=db.false())
+    # the rows of a deleted user go with ON DELETE CASCADE in the database,
+    # they are not loaded to be deleted one by one
+    posts = db.relationship('Post', backref='author', lazy='dynamic',
+                            cascade='all, delete-orphan', passive_deletes=True)
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
                                backref=db.backref('follower', lazy='joined'),
                                lazy='dynamic',
-                               cascade='all, delete-orphan')
+                               cascade='all, delete-orphan',
+                               passive_deletes=True)
     followers = db.relationship('Follow',
                                 foreign_keys=[Follow.followed_id],
                                 backref=db.backref('followed', lazy='joined'),
                                 lazy='dynamic',
-                                cascade='all, delete-orphan')
-    comments = db.relationship('Comment', backref='author', lazy='dynamic', cascade='all, delete-orphan')
+                                cascade='all, delete-orphan',
+                                passive_deletes=True)
+    comments = db.relationship('Comment', backref='author', lazy='dynamic',
+                               cascade='all, delete-orphan',
+                               passive_deletes=True)
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -122,10 +173,23 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = current_app.extensions['passwords'].hash(password)
+        if self.id is not None:
+            self.revoke_auth_tokens()
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # hashes made with older parameters are replaced, the caller commits
+        passwords = current_app.extensions['passwords']
+        if not passwords.verify(self.password_hash, password):
+            return False
+        if passwords.needs_rehash(self.password_hash):
+            # only the check may turn a login away, a rehash that finds
+            # the pool busy is left to the next login
+            try:
+                self.password_hash = passwords.hash(password)
+            except PasswordCheckBusy:
+                pass
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config['SECRET_KEY'])
@@ -209,43 +273,57 @@ class User(UserMixin, db.Model):
         if not self.is_following(user):
             f = Follow(follower=self, followed=user)
             db.session.add(f)
+            SuggestionRefresh.mark(self)
 
     def unfollow(self, user):
         f = self.followed.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            SuggestionRefresh.mark(self)
 
     def is_following(self, user):
         if user.id is None:
             return False
-        return self.followed.filter_by(
-            followed_id=user.id).first() is not None
+        from . import queries
+        return queries.is_following(self.id, user.id)
 
     def is_followed_by(self, user):
         if user.id is None:
             return False
-        return self.followers.filter_by(
-            follower_id=user.id).first() is not None
+        from . import queries
+        return queries.is_following(user.id, self.id)
 
     @property
     def followed_posts(self):
         return Post.query.join(Follow, Follow.followed_id == Post.author_id)\
             .filter(Follow.follower_id == self.id)\
             .order_by(Post.timestamp.desc())
+
+    def suggested_users(self, limit=5):
+        already_followed = db.session.query(Follow.followed_id)\
+            .filter(Follow.follower_id == self.id)
+        return User.query.join(Suggestion, Suggestion.suggested_id == User.id)\
+            .filter(Suggestion.user_id == self.id)\
+            .filter(User.id.notin_(already_followed))\
+            .order_by(Suggestion.score.desc())\
+            .limit(limit)
             
-    def generate_auth_token(self):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        return s.dumps({'id': self.id}, salt='auth-token')
-    
+    def generate_auth_token(self, expiration=3600):
+        return tokens.generate(self, expiration)
+
     @staticmethod
-    def verify_auth_token(self, token, max_age=3600):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token, salt='auth-token', max_age=max_age)
-        except:
-            return None
-        return User.query.get(data['id'])
-    
+    def verify_auth_token(token):
+        # a TokenUser, the User row is not loaded
+        return tokens.verify(token)
+
+    @property
+    def is_active(self):
+        return not self.disabled
+
+    def revoke_auth_tokens(self):
+        self.token_generation = (self.token_generation or 0) + 1
+        tokens.generation_cache().forget(self.id)
+
     @staticmethod
     def add_self_follows():
         for user in User.query.all():
@@ -277,15 +355,7 @@ class User(UserMixin, db.Model):
                 db.session.rollback()
         
     def to_json(self):
-        json_user = {
-            'url': url_for('api.get_user', id=self.id, _external=True),
-            'username': self.username,
-            'member_since': self.member_since,
-            'last_seen': self.last_seen,
-            'posts_url': url_for('api.get_user_posts', id=self.id, _external=True),
-            'post_count': self.posts.count()
-        }
-        return json_user
+        return User.projection.select().serialize_one(self)
     
 
     def __repr__(self):
@@ -307,7 +377,9 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user = User.query.get(int(user_id))
+    # a session of an account disabled since it logged in ends here
+    return user if user is not None and user.is_active else None
 
 
 class Post(db.Model):
@@ -316,17 +388,24 @@ class Post(db.Model):
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    comments = db.relationship('Comment', backref='post', lazy='dynamic')
+    author_id = db.Column(db.Integer,
+                          db.ForeignKey('users.id', ondelete='CASCADE'))
+    hot_score = db.Column(db.Float)
+    comments = db.relationship('Comment', backref='post', lazy='dynamic',
+                               passive_deletes=True)
+    # see app/archive.py for the posts read back from the archive
+    archived = False
+
+    __table_args__ = (
+        db.Index('ix_posts_hot_score', 'hot_score', 'id'),
+        db.Index('ix_posts_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_posts_author_id_timestamp', 'author_id', 'timestamp', 'id'),
+    )
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        # rendered again by a background job once the change is committed
+        target.body_html = None
         
     
     @staticmethod
@@ -334,15 +413,18 @@ class Post(db.Model):
         from random import randint
         from faker import Faker
 
+        from . import sharding
+
         fake = Faker()
+        session = sharding.session()
         user_count = User.query.count()
         for i in range(count):
             u = User.query.offset(randint(0, user_count - 1)).first()
             p = Post(body=fake.paragraph(nb_sentences=randint(1, 3)),
                     timestamp=fake.date_time_this_year(),
-                    author=u)
-            db.session.add(p)
-            db.session.commit()
+                    author_id=u.id)
+            session.add(p)
+            session.commit()
         
     @staticmethod
     def from_json(json_post):
@@ -352,16 +434,7 @@ class Post(db.Model):
         return Post(body=body)
     
     def to_json(self):
-        json_post = {
-            'url': url_for('api.get_post', id=self.id, _external=True),
-            'body': self.body,
-            'body_html': self.body_html,
-            'timestamp': self.timestamp,
-            'author_url': url_for('api.get_user', id=self.author.id, _external=True),
-            'comments_url': url_for('api.get_post_comments', id=self.id, _external=True),
-            'comment_count': self.comments.count()
-        }
-        return json_post
+        return Post.projection.select().serialize_one(self)
 
 db.event.listen(Post.body, 'set', Post.on_changed_body)
 
@@ -371,27 +444,28 @@ class Comment(db.Model):
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    disabled = db.Column(db.Boolean)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    disabled = db.Column(db.Boolean)  # None until a moderator reviews it
+    author_id = db.Column(db.Integer,
+                          db.ForeignKey('users.id', ondelete='CASCADE'))
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('posts.id', ondelete='CASCADE'))
+
+    __table_args__ = (
+        db.Index('ix_comments_moderation', 'timestamp', 'id',
+                 postgresql_where=db.text('disabled IS NOT false'),
+                 sqlite_where=db.text('disabled IS NOT 0')),
+        db.Index('ix_comments_author_id_timestamp',
+                 'author_id', 'timestamp', 'id'),
+        db.Index('ix_comments_post_id_timestamp', 'post_id', 'timestamp', 'id'),
+    )
     
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        # rendered again by a background job once the change is committed
+        target.body_html = None
         
     def to_json(self):
-        json_comment = {
-            'url': url_for('api.get_comment', id=self.id, _external=True),
-            'body': self.body,
-            'body_html': self.body_html,
-            'timestamp': self.timestamp
-        }
-        return json_comment
+        return Comment.projection.select().serialize_one(self)
     
     def from_json(json_comment):
         body = json_comment.get('body')
@@ -405,35 +479,67 @@ class Comment(db.Model):
         from sqlalchemy.exc import IntegrityError
         from faker import Faker
         
+        from . import sharding
+        
         fake = Faker()
+        session = sharding.session()
         user_count = User.query.count()
-        post_count = Post.query.count()
+        post_ids = [p.id for p in sharding.all_posts().options(
+            db.load_only(Post.id)).order_by(Post.id.desc()).all()]
         
         for i in range(count):
             u = User.query.offset(randint(0, user_count - 1)).first()
-            p = Post.query.offset(randint(0, post_count - 1)).first()
             c = Comment(body=fake.text(),
                        timestamp=fake.past_date(),
                        disabled=False,
-                       author=u,
-                       post=p)
-            db.session.add(c)
+                       author_id=u.id,
+                       post_id=post_ids[randint(0, len(post_ids) - 1)])
+            session.add(c)
         try:
-            db.session.commit()
+            session.commit()
         except IntegrityError:
-            db.session.rollback()
+            session.rollback()
         
 db.event.listen(Comment.body, 'set', Comment.on_changed_body)
 
+class ArchiveSegment(db.Model):
+    # a file of archived posts and their comments, see app/archive.py
+    __tablename__ = 'archive_segments'
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(255), nullable=False)  # in FLASKY_ARCHIVE_DIR
+    month = db.Column(db.DateTime, nullable=False)
+    posts = db.Column(db.Integer, nullable=False)
+    comments = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ArchivedPost(db.Model):
+    __tablename__ = 'archived_posts'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    segment_id = db.Column(db.Integer, db.ForeignKey('archive_segments.id'),
+                           nullable=False, index=True)
+
+
 class UserLog(db.Model):
     __tablename__ = 'user_logs'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # kept when the user is deleted
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='SET NULL'))
     action = db.Column(db.String(20))  # 'login' hoặc 'logout'
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     ip = db.Column(db.String(64))
 
-    user = db.relationship('User', backref='logs')
+    # on PostgreSQL the table is range partitioned by month on timestamp,
+    # see app/partitions.py
+    __table_args__ = (
+        db.Index('ix_user_logs_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_user_logs_timestamp_id', 'timestamp', 'id'),
+    )
+
+    user = db.relationship('User', backref=db.backref('logs',
+                                                      passive_deletes=True))
     @staticmethod
     def generate_fake_logs(count=100):
         from random import seed, randint
@@ -457,6 +563,171 @@ class UserLog(db.Model):
             db.session.commit()
         except IntegrityError:
             db.session.rollback()
-    
-    
 
+
+class DeletionJob(db.Model):
+    # users deleted in the background from /manage, see app/bulk.py
+    __tablename__ = 'deletion_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    requested_by_id = db.Column(db.Integer,
+                                db.ForeignKey('users.id', ondelete='SET NULL'))
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    total = db.Column(db.Integer, nullable=False)  # users
+    done = db.Column(db.Integer, nullable=False, default=0)
+    rows = db.Column(db.BigInteger, nullable=False, default=0)
+    error = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    finished = db.Column(db.DateTime)
+
+    def to_json(self):
+        return {'id': self.id, 'status': self.status, 'total': self.total,
+                'done': self.done, 'rows': self.rows, 'error': self.error}
+
+
+class PendingDeletion(db.Model):
+    # the users of a job not deleted yet, a row goes with its user
+    __tablename__ = 'pending_deletions'
+    job_id = db.Column(db.Integer,
+                       db.ForeignKey('deletion_jobs.id', ondelete='CASCADE'),
+                       primary_key=True)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True, index=True)
+
+
+
+# JSON representations used by to_json and the API (?fields=, ?embed=),
+# see app/projection.py
+
+def count_by(column, items):
+    # posts and comments are counted on their shards
+    from . import sharding
+    return dict(sharding.session().query(column, db.func.count())
+                .filter(column.in_([item.id for item in items]))
+                .group_by(column).all())
+
+
+def load_authors(items):
+    selection = User.projection.select(
+        ['url', 'username', 'member_since', 'last_seen', 'posts_url'])
+    ids = {item.author_id for item in items if item.author_id is not None}
+    users = selection.apply(User.query.filter(User.id.in_(ids))).all() \
+        if ids else []
+    return dict(zip([u.id for u in users], selection.serialize(users)))
+
+
+User.projection = Projection({
+    'url': Field([User.id], lambda u, _: external_url('api.get_user', u.id)),
+    'username': Field([User.username], lambda u, _: u.username),
+    'member_since': Field([User.member_since], lambda u, _: u.member_since),
+    'last_seen': Field([User.last_seen], lambda u, _: u.last_seen),
+    'posts_url': Field([User.id], lambda u, _: external_url(
+        'api.get_user_posts', u.id)),
+    'post_count': Field([User.id], lambda u, counts: counts.get(u.id, 0),
+                        lambda users: count_by(Post.author_id, users)),
+})
+
+Post.projection = Projection({
+    'url': Field([Post.id], lambda p, _: external_url('api.get_post', p.id)),
+    'body': Field([Post.body], lambda p, _: p.body),
+    'body_html': Field([Post.body_html], lambda p, _: p.body_html),
+    'timestamp': Field([Post.timestamp], lambda p, _: p.timestamp),
+    'author_url': Field([Post.author_id], lambda p, _: external_url(
+        'api.get_user', p.author_id)),
+    'comments_url': Field([Post.id], lambda p, _: external_url(
+        'api.get_post_comments', p.id)),
+    'comment_count': Field([Post.id], lambda p, counts: counts.get(p.id, 0),
+                           lambda posts: count_by(Comment.post_id, posts)),
+}, embeds={
+    'author': Field([Post.author_id],
+                    lambda p, authors: authors.get(p.author_id), load_authors),
+    'comment_count': Field([Post.id], lambda p, counts: counts.get(p.id, 0),
+                           lambda posts: count_by(Comment.post_id, posts)),
+})
+
+Comment.projection = Projection({
+    'url': Field([Comment.id], lambda c, _: external_url(
+        'api.get_comment', c.id)),
+    'body': Field([Comment.body], lambda c, _: c.body),
+    'body_html': Field([Comment.body_html], lambda c, _: c.body_html),
+    'timestamp': Field([Comment.timestamp], lambda c, _: c.timestamp),
+    'author_url': Field([Comment.author_id], lambda c, _: external_url(
+        'api.get_user', c.author_id)),
+    'post_url': Field([Comment.post_id], lambda c, _: external_url(
+        'api.get_post', c.post_id)),
+}, default=['url', 'body', 'body_html', 'timestamp'], embeds={
+    'author': Field([Comment.author_id],
+                    lambda c, authors: authors.get(c.author_id), load_authors),
+})
+
+Follow.projection = Projection({
+    'follower_url': Field([Follow.follower_id], lambda f, _: external_url(
+        'api.get_user', f.follower_id)),
+    'followed_url': Field([Follow.followed_id], lambda f, _: external_url(
+        'api.get_user', f.followed_id)),
+    'timestamp': Field([Follow.timestamp], lambda f, _: f.timestamp),
+})
+
+
+# Post and comment bodies are rendered to HTML by a background job once the
+# transaction that changed them commits (see app/tasks.py). Until then
+# body_html is NULL and the templates fall back to the plain body.
+
+@db.event.listens_for(Session, 'after_flush')
+def collect_changed_bodies(session, flush_context):
+    pending = session.info.setdefault('render_body_html', set())
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, (Post, Comment)) and \
+                inspect(obj).attrs.body.history.has_changes():
+            pending.add((obj.__tablename__, obj.id))
+
+
+@db.event.listens_for(Session, 'after_commit')
+def enqueue_renders(session):
+    pending = session.info.pop('render_body_html', ())
+    if pending:
+        from . import jobs
+        for table, id in sorted(pending):
+            jobs.enqueue('render_body_html', table, id)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def discard_renders(session):
+    session.info.pop('render_body_html', None)
+
+
+# New posts and comments are pushed to the open live streams once they are
+# committed (see app/live.py). What goes out is read at flush time, after
+# the commit the attributes are expired and reading them would mean a query.
+
+def live_channels(*channels):
+    return [name % id for name, id in channels if id is not None]
+
+
+@db.event.listens_for(Session, 'after_flush')
+def collect_live_events(session, flush_context):
+    events = session.info.setdefault('live_events', [])
+    for obj in session.new:
+        if isinstance(obj, Post):
+            events.append(('post', ['posts'] + live_channels(
+                ('user:%d', obj.author_id)),
+                {'id': obj.id, 'author_id': obj.author_id}))
+        elif isinstance(obj, Comment):
+            events.append(('comment', live_channels(
+                ('post:%d', obj.post_id), ('user:%d', obj.author_id)),
+                {'id': obj.id, 'post_id': obj.post_id,
+                 'author_id': obj.author_id}))
+
+
+@db.event.listens_for(Session, 'after_commit')
+def publish_live_events(session):
+    events = session.info.pop('live_events', ())
+    if events:
+        from . import live
+        for kind, channels, data in events:
+            live.publish(kind, channels, data)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def discard_live_events(session):
+    session.info.pop('live_events', None)
@@ -0,0 +1,44 @@
+from . import db, sharding
+from .models import Comment, User
+
+
+# Comment.disabled is three-valued: NULL for comments no moderator has
+# looked at yet, False once approved and True once disabled. Only the
+# pending and disabled ones are covered by the partial moderation index,
+# so every queue filter repeats the index predicate to let the planner
+# use it. With sharding the queue is read from every shard and merged.
+STATUSES = ('queue', 'pending', 'disabled', 'approved', 'all')
+
+in_queue = Comment.disabled.is_not(False)
+
+
+def moderation_queue(status='queue', author=None, post_id=None):
+    query = sharding.all_comments()
+    if status == 'queue':
+        query = query.filter(in_queue)
+    elif status == 'pending':
+        query = query.filter(in_queue, Comment.disabled.is_(None))
+    elif status == 'disabled':
+        query = query.filter(in_queue, Comment.disabled.is_(True))
+    elif status == 'approved':
+        query = query.filter(Comment.disabled.is_(False))
+    if author:
+        # looked up first, the shards have no users table
+        author_id = db.session.query(User.id).filter_by(username=author)\
+            .scalar()
+        query = query.filter(Comment.author_id == author_id
+                             if author_id is not None else db.false())
+    if post_id:
+        query = query.filter(Comment.post_id == post_id)
+    return query
+
+
+def set_disabled(ids, disabled):
+    ids = [int(id) for id in ids]
+    if not ids:
+        return 0
+    session = sharding.session()
+    count = session.query(Comment).filter(Comment.id.in_(ids))\
+        .update({Comment.disabled: disabled}, synchronize_session=False)
+    session.commit()
+    return count
@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import DateTime, literal, tuple_
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+from .exceptions import InvalidCursor
+
+
+class KeysetPagination:
+    # Seek ("keyset") pagination over a unique, indexed sort key such as
+    # (timestamp, id). Pages are addressed by the key of a boundary row
+    # instead of an OFFSET, so every page costs the same index range scan
+    # and no COUNT(*) is needed to render the navigation. `last` jumps to
+    # the far end of the listing (the latest comments of a post, say) by
+    # reading the index backwards. `query` is a Query or a lambda statement
+    # (see app/queries.py) selecting one entity.
+
+    def __init__(self, query, columns, per_page, after=None, before=None,
+                 descending=True, last=False):
+        self.per_page = per_page
+        self.columns = columns
+        self.descending = descending
+        self.has_prev = self.has_next = False
+        key = tuple_(*columns)
+
+        if before is not None or last:
+            # walk back towards the start of the listing, then restore order
+            if before is not None:
+                values = self.bind(self.decode(before))
+                query = self._filter(
+                    query, key > values if descending else key < values)
+            items = self._fetch(query, not descending, per_page + 1)
+            self.has_prev = len(items) > per_page
+            self.has_next = before is not None
+            items = list(reversed(items[:per_page]))
+        else:
+            if after is not None:
+                values = self.bind(self.decode(after))
+                query = self._filter(
+                    query, key < values if descending else key > values)
+                self.has_prev = True
+            items = self._fetch(query, descending, per_page + 1)
+            self.has_next = len(items) > per_page
+            items = items[:per_page]
+
+        self.items = items
+        if not items:
+            # an empty page reached through a stale cursor still offers a
+            # way back to the first page
+            self.has_next = False
+            self.has_prev = before is not None or after is not None or last
+        self.next_cursor = self.cursor(items[-1]) \
+            if items and self.has_next else None
+        self.prev_cursor = self.cursor(items[0]) \
+            if items and self.has_prev else None
+
+    def _order(self, descending):
+        return [c.desc() if descending else c.asc() for c in self.columns]
+
+    def bind(self, values):
+        # bound parameters keep a lambda statement's cache key the same
+        # whatever the cursor
+        return tuple_(*[literal(value, column.type)
+                        for column, value in zip(self.columns, values)])
+
+    @staticmethod
+    def _filter(query, condition):
+        if isinstance(query, StatementLambdaElement):
+            return query + (lambda s: s.where(condition))
+        return query.filter(condition)
+
+    def _fetch(self, query, descending, limit):
+        order = self._order(descending)
+        if isinstance(query, StatementLambdaElement):
+            from . import db
+            query += lambda s: s.order_by(*order).limit(limit)
+            return db.session.scalars(query).all()
+        return query.order_by(*order).limit(limit).all()
+
+    def cursor(self, item):
+        values = []
+        for column in self.columns:
+            value = getattr(item, column.key)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(
+            json.dumps(values, separators=(',', ':')).encode('utf-8'))\
+            .decode('ascii').rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded))
+            if not isinstance(values, list) or \
+                    len(values) != len(self.columns):
+                raise ValueError(cursor)
+            return tuple(
+                datetime.fromisoformat(v)
+                if isinstance(column.type, DateTime) else v
+                for column, v in zip(self.columns, values))
+        except (ValueError, TypeError):
+            raise InvalidCursor('invalid page cursor')
+
+
+class OffsetPagination:
+    # ?page= pagination for the API. Whether there is a next page comes
+    # from one extra row instead of a COUNT(*); totals are up to the
+    # caller, see app/counts.py.
+
+    def __init__(self, query, page, per_page):
+        self.page = max(page, 1)
+        self.per_page = per_page
+        items = query.limit(per_page + 1)\
+            .offset((self.page - 1) * per_page).all()
+        self.has_prev = self.page > 1
+        self.has_next = len(items) > per_page
+        self.items = items[:per_page]
@@ -0,0 +1,137 @@
+import gzip
+import os
+import re
+from datetime import datetime
+from sqlalchemy import text
+from . import db
+
+
+# Monthly range partitions are named <table>_YYYY_MM and hold rows with
+# timestamps in [first day of the month, first day of the next month).
+PARTITION_RE = re.compile(r'^(?P<table>.+)_(?P<year>\d{4})_(?P<month>\d{2})$')
+
+
+def month_start(d):
+    return datetime(d.year, d.month, 1)
+
+
+def add_months(d, months):
+    index = d.year * 12 + d.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '%s_%04d_%02d' % (table, month.year, month.month)
+
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def is_partitioned(table):
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        'SELECT 1 FROM pg_partitioned_table pt '
+        'JOIN pg_class c ON c.oid = pt.partrelid '
+        'WHERE c.relname = :table'), {'table': table}).first() is not None
+
+
+def list_partitions(table):
+    rows = db.session.execute(text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :table ORDER BY c.relname'), {'table': table})
+    partitions = []
+    for name, in rows:
+        match = PARTITION_RE.match(name)
+        if match and match.group('table') == table:
+            partitions.append((name, datetime(int(match.group('year')),
+                                              int(match.group('month')), 1)))
+    return partitions
+
+
+def _bounds(month):
+    # partition bounds are DDL and cannot be sent as bound parameters
+    return "FOR VALUES FROM ('%s') TO ('%s')" % (
+        month.strftime('%Y-%m-%d'), add_months(month, 1).strftime('%Y-%m-%d'))
+
+
+def _default_partition(table):
+    name = table + '_default'
+    exists = db.session.execute(text(
+        'SELECT 1 FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :table AND c.relname = :name'),
+        {'table': table, 'name': name}).first()
+    return name if exists else None
+
+
+def create_partitions(table, months_ahead, start=None, column='timestamp'):
+    start = month_start(start or datetime.utcnow())
+    existing = {name for name, month in list_partitions(table)}
+    default = _default_partition(table)
+    created = []
+    for i in range(months_ahead + 1):
+        month = add_months(start, i)
+        name = partition_name(table, month)
+        if name in existing:
+            continue
+        bounds = {'start': month, 'end': add_months(month, 1)}
+        in_range = '%s >= :start AND %s < :end' % (_quote(column),
+                                                    _quote(column))
+        if default and db.session.execute(text(
+                'SELECT 1 FROM %s WHERE %s LIMIT 1'
+                % (_quote(default), in_range)), bounds).first():
+            # rows that landed in the default partition because maintenance
+            # fell behind have to move before the range can be attached
+            db.session.execute(text(
+                'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS '
+                'INCLUDING CONSTRAINTS)' % (_quote(name), _quote(table))))
+            db.session.execute(text(
+                'WITH moved AS (DELETE FROM %s WHERE %s RETURNING *) '
+                'INSERT INTO %s SELECT * FROM moved'
+                % (_quote(default), in_range, _quote(name))), bounds)
+            db.session.execute(text(
+                'ALTER TABLE %s ATTACH PARTITION %s %s'
+                % (_quote(table), _quote(name), _bounds(month))))
+        else:
+            db.session.execute(text(
+                'CREATE TABLE %s PARTITION OF %s %s'
+                % (_quote(name), _quote(table), _bounds(month))))
+        created.append(name)
+    db.session.commit()
+    return created
+
+
+def archive_partition(name, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, name + '.csv.gz')
+    tmp_path = path + '.tmp'
+    connection = db.session.connection().connection
+    with gzip.open(tmp_path, 'wb') as f:
+        connection.cursor().copy_expert(
+            'COPY %s TO STDOUT WITH (FORMAT csv, HEADER)' % _quote(name), f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def expire_partitions(table, keep_months, archive_dir=None, dry_run=False,
+                      now=None):
+    cutoff = add_months(month_start(now or datetime.utcnow()), -keep_months)
+    expired = []
+    for name, month in list_partitions(table):
+        if add_months(month, 1) > cutoff:
+            continue
+        path = None
+        if not dry_run:
+            if archive_dir:
+                path = archive_partition(name, archive_dir)
+            db.session.execute(text('ALTER TABLE %s DETACH PARTITION %s'
+                                    % (_quote(table), _quote(name))))
+            db.session.execute(text('DROP TABLE %s' % _quote(name)))
+            db.session.commit()
+        expired.append((name, path))
+    return expired
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from .exceptions import PasswordCheckBusy
+
+
+# Password hashing with a configurable cost, off the request threads.
+# Hashes are computed by a small pool per worker process and at most
+# FLASKY_PASSWORD_WORKERS of them run at once; a login that cannot get a
+# slot within FLASKY_PASSWORD_QUEUE_TIMEOUT fails with PasswordCheckBusy
+# instead of queueing behind a burst of other logins, so page requests keep
+# their threads and CPU. Hashes made with other parameters than
+# FLASKY_PASSWORD_METHOD still verify and are replaced on the next login.
+
+def _method(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+class Passwords:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.method = config['FLASKY_PASSWORD_METHOD']
+        # werkzeug fills in the defaults, e.g. scrypt -> scrypt:32768:8:1
+        self.current = _method(generate_password_hash('', self.method))
+        self.pool = config['FLASKY_PASSWORD_POOL']
+        if self.pool not in ('thread', 'process'):
+            raise ValueError('FLASKY_PASSWORD_POOL must be thread or process')
+        self.workers = config['FLASKY_PASSWORD_WORKERS']
+        self.timeout = config['FLASKY_PASSWORD_QUEUE_TIMEOUT']
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        app.extensions['passwords'] = self
+
+    def _executor(self):
+        # created on first use in each process, pools do not survive a fork
+        with self.lock:
+            if self.pid != os.getpid():
+                if self.pool == 'process':
+                    self.executor = ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self.executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='passwords')
+                self.pid = os.getpid()
+            return self.executor
+
+    def _run(self, func, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PasswordCheckBusy('too many password checks in progress')
+        try:
+            return self._executor().submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return _method(pwhash) != self.current
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None and self.pid == os.getpid():
+                self.executor.shutdown()
+            self.executor = self.pid = None
@@ -0,0 +1,66 @@
+from sqlalchemy.orm import load_only
+from .exceptions import ValidationError
+
+
+# JSON representations built from a table of fields. Each field names the
+# columns it reads, so a request for a subset (?fields=) only loads those
+# columns, and fields that need other rows (counts, embedded resources)
+# have a loader that fetches them for the whole page in one query instead
+# of once per item.
+
+class Field:
+    def __init__(self, columns, get, load=None):
+        self.columns = columns
+        self.get = get
+        self.load = load
+
+
+class Projection:
+    def __init__(self, fields, default=None, embeds=None):
+        self.fields = fields
+        self.default = default or list(fields)
+        self.embeds = embeds or {}
+
+    def select(self, fields=None, embed=()):
+        return Selection(self, fields or self.default, embed)
+
+    def from_request(self, args):
+        return self.select(self._names(args, 'fields', self.fields),
+                           self._names(args, 'embed', self.embeds))
+
+    @staticmethod
+    def _names(args, key, choices):
+        value = args.get(key)
+        if not value:
+            return []
+        names = list(dict.fromkeys(n.strip() for n in value.split(',')
+                                   if n.strip()))
+        unknown = [n for n in names if n not in choices]
+        if unknown:
+            raise ValidationError('unknown %s: %s' % (key, ', '.join(unknown)))
+        return names
+
+
+class Selection:
+    def __init__(self, projection, fields, embed):
+        self.fields = [(name, projection.fields[name]) for name in fields]
+        self.fields += [(name, projection.embeds[name]) for name in embed
+                        if name not in fields]
+
+    def apply(self, query):
+        columns = {}
+        for name, field in self.fields:
+            for column in field.columns:
+                columns[column.key] = column
+        return query.options(load_only(*columns.values()))
+
+    def serialize(self, items):
+        data = {}
+        for name, field in self.fields:
+            if field.load is not None and items:
+                data[name] = field.load(items)
+        return [{name: field.get(item, data.get(name))
+                 for name, field in self.fields} for item in items]
+
+    def serialize_one(self, item):
+        return self.serialize([item])[0]
@@ -0,0 +1,40 @@
+from sqlalchemy import lambda_stmt, select
+from . import db
+from .models import User, Post, Follow
+
+
+# The lookups that run on nearly every request, as lambda statements. A
+# lambda's code object is its cache key, so after the first call
+# SQLAlchemy reuses the statement and its compiled SQL without rebuilding
+# the query or walking it to compute a cache key; only the values of the
+# closure variables (username, ids) are bound again. Keep the lambdas free
+# of Python logic, everything that changes between calls must be a plain
+# closure variable.
+
+def user_by_username(username):
+    stmt = lambda_stmt(
+        lambda: select(User).where(User.username == username).limit(1))
+    return db.session.scalars(stmt).first()
+
+
+def user_by_email(email):
+    stmt = lambda_stmt(
+        lambda: select(User).where(User.email == email).limit(1))
+    return db.session.scalars(stmt).first()
+
+
+def is_following(follower_id, followed_id):
+    stmt = lambda_stmt(
+        lambda: select(Follow.follower_id)
+        .where(Follow.follower_id == follower_id,
+               Follow.followed_id == followed_id).limit(1))
+    return db.session.scalars(stmt).first() is not None
+
+
+def followed_posts(user_id):
+    # a statement for KeysetPagination, see User.followed_posts for the
+    # Query the API counts and pages with offsets
+    return lambda_stmt(
+        lambda: select(Post)
+        .join(Follow, Follow.followed_id == Post.author_id)
+        .where(Follow.follower_id == user_id))
@@ -0,0 +1,181 @@
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from flask import current_app, g, jsonify, request, session
+
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(rate):
+    # "300/minute" -> refill rate in tokens per second and bucket size
+    count, _, period = rate.partition('/')
+    period = period.strip().rstrip('s')
+    if period not in PERIODS:
+        raise ValueError('invalid rate limit %r' % rate)
+    count = int(count)
+    return count / PERIODS[period], count
+
+
+class MemoryStore:
+    max_keys = 100000
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            if len(self.buckets) > self.max_keys:
+                self.buckets = {k: v for k, v in self.buckets.items()
+                                if v[1] > now - 86400}
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class FileStore:
+    # Buckets live in a small SQLite file so that every worker process on
+    # the host shares them. Put it on tmpfs (/dev/shm) to keep it in memory.
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def consume(self, key, rate, capacity, now=None):
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets '
+                               'WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            # full buckets carry no state, drop them once in a while
+            if random.random() < 0.001:
+                conn.execute('DELETE FROM buckets WHERE updated < ?',
+                             (now - 86400,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+def create_store(url):
+    if url.startswith('file://'):
+        return FileStore(url[len('file://'):])
+    if url == 'memory://':
+        return MemoryStore()
+    raise ValueError('unsupported rate limit storage %r' % url)
+
+
+def client_identity():
+    # worked out before authentication: the user of a (signed) session
+    # cookie, otherwise the address. Credentials in the request are not
+    # verified yet, keying by them would let anyone drain another user's
+    # bucket or get a fresh one with every made up name; the API charges
+    # the bucket of its user too once they are verified, see limit()
+    user_id = session.get('_user_id')
+    if user_id:
+        return 'user:%s' % user_id
+    return 'ip:%s' % request.remote_addr
+
+
+def limit(identity):
+    return current_app.extensions['ratelimit'].limit(identity)
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = create_store(app.config['RATELIMIT_STORAGE_URL'])
+        # each worker process has its own connection pool, so admission
+        # is limited per process to what the pool can hand out
+        self.slots = threading.BoundedSemaphore(
+            app.config['RATELIMIT_MAX_CONCURRENT'])
+        app.extensions['ratelimit'] = self
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def rule_for(self, rules):
+        if request.endpoint in rules:
+            return request.endpoint, rules[request.endpoint]
+        if request.blueprint in rules:
+            return request.blueprint, rules[request.blueprint]
+        if 'default' in rules:
+            return 'default', rules['default']
+        return None, None
+
+    def limit(self, identity):
+        # charges the bucket of identity under the rule of this request,
+        # returns the response to send instead when it is empty
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED']:
+            return None
+        name, rule = self.rule_for(config['RATELIMIT_RULES'])
+        if not rule:
+            return None
+        rate, capacity = parse_rate(rule)
+        allowed, retry_after = self.store.consume(
+            '%s:%s' % (name, identity), rate, capacity)
+        if not allowed:
+            return self.reject(429, 'too many requests',
+                               'Rate limit exceeded', retry_after)
+        return None
+
+    def before_request(self):
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED'] or request.endpoint == 'static':
+            return
+        response = self.limit(client_identity())
+        if response is not None:
+            return response
+        if not self.slots.acquire(timeout=config['RATELIMIT_QUEUE_TIMEOUT']):
+            return self.reject(503, 'service unavailable',
+                               'Server is busy, try again shortly', 1)
+        g.ratelimit_slot = True
+
+    def teardown_request(self, exc):
+        if g.pop('ratelimit_slot', False):
+            self.slots.release()
+
+    def reject(self, status, error, message, retry_after):
+        if request.blueprint == 'api' or \
+                request.accept_mimetypes.best == 'application/json':
+            response = jsonify({'error': error, 'message': message})
+        else:
+            response = current_app.response_class(message + '\n',
+                                                  mimetype='text/plain')
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
@@ -0,0 +1,509 @@
+from itertools import islice
+from flask import abort, current_app, g
+from sqlalchemy import (Column, ForeignKey, Index, Integer, MetaData,
+                        String, Table, create_engine, delete, event, func,
+                        insert, inspect, select, update)
+from sqlalchemy.ext.horizontal_shard import ShardedSession, set_shard_id
+from sqlalchemy.orm import object_session, undefer
+from sqlalchemy.sql import operators, visitors
+from . import merge
+
+
+# Optional horizontal sharding of posts and comments. With
+# FLASKY_SHARD_URLS set, posts live on shard author_id % n and comments on
+# the shard of their post; users, follows and everything else stay on the
+# primary database, which the sharded session reaches as shard "main".
+# Ids are handed out per shard so that id % n is the shard of the row
+# (and post_id % n that of a comment), which lets a lookup by id go to a
+# single shard. Queries on the other columns are routed from their
+# author_id / post_id criteria and go to every shard when there are none.
+#
+# Rows written to the primary before sharding was turned on are moved by
+# `flask move-to-shards` (move_from_primary) to the shard of their author,
+# keeping their ids, so old links still work. Those ids say nothing about
+# the shard: the highest one moved is recorded per table and a lookup of
+# an id up to it asks every shard. The shards hand out ids above it.
+
+shard_metadata = MetaData()
+
+# one row per table and shard, the last id handed out on that shard, and
+# one per table for the highest id moved from the primary
+sequences = Table('shard_sequences', shard_metadata,
+                  Column('name', String(64), primary_key=True),
+                  Column('value', Integer, nullable=False))
+
+LEGACY = '%s.legacy'
+
+
+def _shard_tables():
+    # copies of the posts and comments tables without the foreign keys to
+    # users, which are on the primary database only
+    from .models import Post, Comment
+    if 'posts' in shard_metadata.tables:
+        return [shard_metadata.tables['posts'],
+                shard_metadata.tables['comments']]
+    tables = []
+    for table in (Post.__table__, Comment.__table__):
+        columns = []
+        for column in table.columns:
+            keys = [ForeignKey(fk.target_fullname, ondelete=fk.ondelete)
+                    for fk in column.foreign_keys
+                    if fk.column.table.name in ('posts', 'comments')]
+            columns.append(Column(column.name, column.type, *keys,
+                                  primary_key=column.primary_key,
+                                  nullable=column.nullable))
+        copy = Table(table.name, shard_metadata, *columns)
+        for index in table.indexes:
+            Index(index.name, *[copy.c[c.name] for c in index.columns],
+                  unique=index.unique, **index.dialect_kwargs)
+        tables.append(copy)
+    return tables
+
+
+def _comparisons(statement):
+    # (column, value) for the column = value and column IN (...)
+    # comparisons in a statement
+    found = []
+
+    def visit_binary(binary):
+        column, value = binary.left, binary.right
+        if getattr(value, 'table', None) is not None:
+            # relationship loaders compare :param = column
+            column, value = value, column
+        if getattr(column, 'table', None) is None or \
+                not hasattr(value, 'effective_value'):
+            return
+        if binary.operator == operators.eq:
+            found.append((column, [value.effective_value]))
+        elif binary.operator == operators.in_op and \
+                isinstance(value.effective_value, (list, tuple)):
+            found.append((column, list(value.effective_value)))
+
+    # the whole statement, count() wraps the query in a subquery
+    visitors.traverse(statement, {}, {'binary': visit_binary})
+    return found
+
+
+class Sharding:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = [url for url in app.config['FLASKY_SHARD_URLS'] if url]
+        self.engines = {str(i): create_engine(url)
+                        for i, url in enumerate(urls)}
+        self.enabled = bool(self.engines)
+        self._legacy = None
+        app.extensions['sharding'] = self
+        app.teardown_appcontext(self.remove_session)
+
+    @property
+    def count(self):
+        return len(self.engines)
+
+    def shard_of(self, id):
+        return str(id % self.count)
+
+    def legacy(self, table):
+        # the highest id of the table moved from the primary, read once per
+        # process (restart after `flask move-to-shards`)
+        if self._legacy is None:
+            with self.engines['0'].connect() as connection:
+                self._legacy = dict(connection.execute(
+                    select(sequences.c.name, sequences.c.value)
+                    .where(sequences.c.name.like(LEGACY % '%'))).all())
+        return self._legacy.get(LEGACY % table, 0)
+
+    def shards_for(self, table, id):
+        # the shards a row of the table with this id can be on
+        if id <= self.legacy(table):
+            return sorted(self.engines)
+        return [self.shard_of(id)]
+
+    def engines_for(self, table, id):
+        # where the post or comment with this id may be stored
+        from . import db
+        if not self.enabled:
+            return [db.engine]
+        return [self.engines[shard] for shard in self.shards_for(table, id)]
+
+    def create_all(self):
+        _shard_tables()
+        for engine in self.engines.values():
+            shard_metadata.create_all(engine)
+        self.reserve_ids()
+
+    def drop_all(self):
+        _shard_tables()
+        for engine in self.engines.values():
+            shard_metadata.drop_all(engine)
+
+    def reserve_ids(self, legacy=None):
+        # ids handed out by the shards start above every id of the primary
+        from . import db
+        from .models import ArchivedPost, Comment, Post
+        legacy = legacy or {}
+        for model in (Post, Comment):
+            table = model.__table__.name
+            top = max(db.session.scalar(select(func.max(model.id))) or 0,
+                      self.legacy(table), legacy.get(table, 0))
+            if model is Post:
+                # the post pages fall back to the archive
+                top = max(top, db.session.scalar(
+                    select(func.max(ArchivedPost.id))) or 0)
+            for engine in self.engines.values():
+                with engine.begin() as connection:
+                    _raise_value(connection, table, top // self.count)
+                    if table in legacy:
+                        _raise_value(connection, LEGACY % table,
+                                     legacy[table])
+        db.session.commit()
+        self._legacy = None
+
+    def move_from_primary(self, chunk_size=1000):
+        # the posts of the primary database and their comments, a chunk of
+        # posts at a time; a chunk is written to the shards before it is
+        # deleted from the primary, so an interrupted move can run again
+        from . import db
+        posts, comments = _shard_tables()
+        moved_posts = moved_comments = 0
+        highest = {'posts': 0, 'comments': 0}
+        primary_posts = db.metadata.tables['posts']
+        primary_comments = db.metadata.tables['comments']
+        while True:
+            post_rows = db.session.execute(
+                select(*primary_posts.c).order_by(primary_posts.c.id)
+                .limit(chunk_size).with_for_update()).all()
+            if not post_rows:
+                break
+            shard_of_post = {row.id: self.shard_of(row.author_id)
+                             for row in post_rows}
+            comment_rows = db.session.execute(
+                select(*primary_comments.c)
+                .where(primary_comments.c.post_id.in_(list(shard_of_post)))
+                .order_by(primary_comments.c.id)).all()
+            for shard, engine in self.engines.items():
+                with engine.begin() as connection:
+                    _copy_rows(connection, posts, [
+                        row for row in post_rows
+                        if shard_of_post[row.id] == shard])
+                    _copy_rows(connection, comments, [
+                        row for row in comment_rows
+                        if shard_of_post[row.post_id] == shard])
+            db.session.execute(delete(primary_comments).where(
+                primary_comments.c.id.in_([row.id for row in comment_rows])))
+            db.session.execute(delete(primary_posts).where(
+                primary_posts.c.id.in_(list(shard_of_post))))
+            db.session.commit()
+            moved_posts += len(post_rows)
+            moved_comments += len(comment_rows)
+            highest['posts'] = max(highest['posts'], post_rows[-1].id)
+            if comment_rows:
+                highest['comments'] = max(highest['comments'],
+                                          comment_rows[-1].id)
+        self.reserve_ids(legacy=highest)
+        return moved_posts, moved_comments
+
+    # routing
+
+    def _sharded(self, mapper):
+        from .models import Post, Comment
+        return mapper is not None and mapper.class_ in (Post, Comment)
+
+    def shard_chooser(self, mapper, instance, clause=None):
+        from .models import Post
+        if not self._sharded(mapper):
+            return 'main'
+        if instance is None:
+            raise ValueError('%s rows need an instance to pick a shard' %
+                             mapper.class_.__name__)
+        # a row loaded from a shard stays there
+        token = inspect(instance).identity_token
+        if token is not None:
+            return token
+        if instance.id is not None:
+            return self.shard_of(instance.id)
+        if isinstance(instance, Post):
+            author_id = instance.author_id if instance.author_id is not None \
+                else instance.author.id
+            return self.shard_of(author_id)
+        post_id = instance.post_id if instance.post_id is not None \
+            else instance.post.id
+        shards = self.shards_of_post(object_session(instance), post_id)
+        if not shards:
+            raise ValueError('there is no post %d' % post_id)
+        return shards[0]
+
+    def shards_of_post(self, session, post_id):
+        # the shard of a post and its comments; a post moved from the
+        # primary is on the shard of its author, looked up (usually in the
+        # identity map already)
+        from .models import Post
+        if post_id > self.legacy('posts'):
+            return [self.shard_of(post_id)]
+        with session.no_autoflush:
+            post = session.get(Post, post_id)
+        return [inspect(post).identity_token] if post is not None else []
+
+    def identity_chooser(self, mapper, primary_key, **kwargs):
+        if not self._sharded(mapper):
+            return ['main']
+        return self.shards_for(mapper.local_table.name, primary_key[0])
+
+    def execute_chooser(self, context):
+        from .models import Post
+        mapper = context.bind_mapper
+        if not self._sharded(mapper):
+            return ['main']
+        shards = set()
+        keys = {('posts', 'id'), ('posts', 'author_id')} \
+            if mapper.class_ is Post else \
+            {('comments', 'id'), ('comments', 'post_id')}
+        for column, values in _comparisons(context.statement):
+            key = (column.table.name, column.key)
+            if key not in keys:
+                continue
+            for value in values:
+                if value is None:
+                    continue
+                if key == ('posts', 'author_id'):
+                    shards.add(self.shard_of(value))
+                elif key == ('comments', 'post_id'):
+                    shards.update(self.shards_of_post(context.session,
+                                                      value))
+                else:
+                    shards.update(self.shards_for(key[0], value))
+        return sorted(shards) or list(self.engines)
+
+    # sessions
+
+    @property
+    def session(self):
+        # one session per application context, next to db.session
+        if 'sharded_session' not in g:
+            from . import db
+            session = ShardedSession(
+                shard_chooser=self.shard_chooser,
+                identity_chooser=self.identity_chooser,
+                execute_chooser=self.execute_chooser,
+                shards=dict(self.engines, main=db.engine))
+            session.info['sharded'] = True
+            _allocate_ids(session, self)
+            g.sharded_session = session
+        return g.sharded_session
+
+    @staticmethod
+    def remove_session(exc):
+        session = g.pop('sharded_session', None)
+        if session is not None:
+            session.close()
+
+
+def _allocate_ids(session, sharding):
+    from .models import Post, Comment
+
+    @event.listens_for(session, 'before_flush')
+    def before_flush(session, flush_context, instances):
+        for instance in session.new:
+            if isinstance(instance, (Post, Comment)) and instance.id is None:
+                mapper = type(instance).__mapper__
+                shard = sharding.shard_chooser(mapper, instance)
+                name = mapper.local_table.name
+                connection = session.connection(
+                    bind_arguments={'shard_id': shard})
+                value = _next_value(connection, name)
+                instance.id = value * sharding.count + int(shard)
+
+
+def _raise_value(connection, name, value):
+    current = connection.execute(select(sequences.c.value)
+                                 .where(sequences.c.name == name)).scalar()
+    if current is None:
+        connection.execute(sequences.insert().values(name=name, value=value))
+    elif current < value:
+        connection.execute(update(sequences).where(sequences.c.name == name)
+                           .values(value=value))
+
+
+def _copy_rows(connection, table, rows):
+    # rows of an earlier, interrupted move are there already
+    if not rows:
+        return
+    ids = [row.id for row in rows]
+    present = {row.id: row for row in connection.execute(
+        select(*table.c).where(table.c.id.in_(ids)))}
+    for row in rows:
+        if row.id in present and tuple(present[row.id]) != tuple(row):
+            raise ValueError('%s %d is on the shard already and differs' %
+                             (table.name, row.id))
+    connection.execute(insert(table), [row._asdict() for row in rows
+                                       if row.id not in present])
+
+
+def _next_value(connection, name):
+    updated = connection.execute(update(sequences)
+                                 .where(sequences.c.name == name)
+                                 .values(value=sequences.c.value + 1))
+    if not updated.rowcount:
+        connection.execute(sequences.insert().values(name=name, value=1))
+        return 1
+    return connection.execute(select(sequences.c.value)
+                              .where(sequences.c.name == name)).scalar()
+
+
+def _sharding():
+    return current_app.extensions['sharding']
+
+
+def enabled():
+    return _sharding().enabled
+
+
+def session():
+    # the session posts and comments are written through
+    from . import db
+    return _sharding().session if enabled() else db.session
+
+
+class ScatterQuery:
+    # The same query run on several shards and merged in the order it was
+    # asked for (see app/merge.py); enough of the Query interface for
+    # KeysetPagination, OffsetPagination and app/counts.py. Every shard is
+    # read in batches of `limit` rows from the position of its last row,
+    # so a page holds at most one batch per shard.
+
+    def __init__(self, session, queries, order=(), limit=None, offset=0):
+        self.session = session
+        self.queries = queries
+        self.order = order
+        self._limit = limit
+        self._offset = offset
+
+    def _copy(self, **changes):
+        args = dict(queries=self.queries, order=self.order,
+                    limit=self._limit, offset=self._offset)
+        args.update(changes)
+        return ScatterQuery(self.session, **args)
+
+    def filter(self, *criteria):
+        return self._copy(queries=[q.filter(*criteria)
+                                   for q in self.queries])
+
+    def options(self, *options):
+        return self._copy(queries=[q.options(*options)
+                                   for q in self.queries])
+
+    def order_by(self, *clauses):
+        if len(clauses) == 1 and clauses[0] is None:
+            clauses = ()
+        return self._copy(order=clauses)
+
+    def limit(self, limit):
+        return self._copy(limit=limit)
+
+    def offset(self, offset):
+        return self._copy(offset=offset or 0)
+
+    def count(self):
+        return sum(q.count() for q in self.queries)
+
+    @property
+    def statement(self):
+        # what app/counts.py caches the count by, the same on every shard
+        return self.queries[0].statement
+
+    def all(self):
+        if not self.order:
+            raise ValueError('a merged query needs an order')
+        columns = [clause.element for clause in self.order]
+        descending = self.order[0].modifier is operators.desc_op
+        batch = self._limit or merge.BATCH
+        streams = []
+        for query in self.queries:
+            # the merge reads the sort key even with ?fields= in effect
+            entity = query.column_descriptions[0]['entity']
+            query = query.options(*[undefer(getattr(entity, c.key))
+                                    for c in columns])
+            streams.append(merge.keyset_stream(query, columns, descending,
+                                               batch))
+        rows = merge.merge(
+            streams, descending=descending,
+            key=lambda item: tuple(getattr(item, c.key) for c in columns))
+        stop = None if self._limit is None else self._offset + self._limit
+        return list(islice(rows, self._offset, stop))
+
+
+def scatter(model):
+    # the same query on every shard
+    sharding = _sharding()
+    session = sharding.session
+    return ScatterQuery(session, [session.query(model)
+                                  .options(set_shard_id(shard))
+                                  for shard in sorted(sharding.engines)])
+
+
+# The views go through these, they fall back to the primary database when
+# sharding is off.
+
+def get(model, id):
+    return session().get(model, id)
+
+
+def get_or_404(model, id):
+    item = get(model, id)
+    if item is None:
+        abort(404)
+    return item
+
+
+def engines():
+    # the databases posts and comments are stored in
+    from . import db
+    return list(_sharding().engines.values()) if enabled() else [db.engine]
+
+
+def all_posts():
+    from .models import Post
+    return scatter(Post) if enabled() else Post.query
+
+
+def all_comments():
+    from .models import Comment
+    return scatter(Comment) if enabled() else Comment.query
+
+
+def hot_posts():
+    from . import trending
+    from .models import Post
+    if not enabled():
+        return trending.hot_posts()
+    return scatter(Post).order_by(Post.hot_score.desc(), Post.id.desc())
+
+
+def posts_by(author_id):
+    from .models import Post
+    return session().query(Post).filter(Post.author_id == author_id)
+
+
+def comments_of(post_id):
+    from .models import Comment
+    return session().query(Comment).filter(Comment.post_id == post_id)
+
+
+def followed_posts(user_id):
+    # posts of the followed accounts, one query per shard that has any
+    from . import db, queries
+    from .models import Follow, Post
+    if not enabled():
+        return queries.followed_posts(user_id)
+    shards = {}
+    for author_id, in db.session.query(Follow.followed_id)\
+            .filter_by(follower_id=user_id):
+        shards.setdefault(_sharding().shard_of(author_id), []).append(
+            author_id)
+    session = _sharding().session
+    return ScatterQuery(session, [session.query(Post)
+                                  .options(set_shard_id(shard))
+                                  .filter(Post.author_id.in_(ids))
+                                  for shard, ids in sorted(shards.items())])
@@ -0,0 +1,17 @@
+// Shows a notice when new posts or comments arrive on the live stream of
+// the page (see app/live.py). The notice links to the refreshed page.
+(function () {
+    var notice = document.getElementById('live-notice');
+    if (!notice || !window.EventSource) {
+        return;
+    }
+    var count = 0;
+    var source = new EventSource(notice.getAttribute('data-url'));
+    function show() {
+        count += 1;
+        notice.querySelector('.live-count').textContent = count;
+        notice.style.display = '';
+    }
+    source.addEventListener(notice.getAttribute('data-event'), show);
+    source.addEventListener('reset', show);
+})();
@@ -0,0 +1,167 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, delete, insert
+from . import db
+from .models import Follow, Suggestion, SuggestionRefresh
+
+
+# weight of "followed by people who follow the same users as you" relative
+# to a plain friends-of-friends path
+CO_FOLLOW_WEIGHT = 0.5
+
+
+def load_follow_graph(chunk_size=100000):
+    import numpy as np
+    from scipy import sparse
+
+    followers, followed = [], []
+    result = db.session.execute(
+        select(Follow.follower_id, Follow.followed_id)
+        .where(Follow.follower_id != Follow.followed_id)
+        .execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        followers.append(pairs[:, 0])
+        followed.append(pairs[:, 1])
+    if not followers:
+        return np.empty(0, dtype=np.int64), sparse.csr_matrix((0, 0))
+    followers = np.concatenate(followers)
+    followed = np.concatenate(followed)
+
+    # map sparse user ids onto a dense 0..n-1 index
+    user_ids = np.unique(np.concatenate([followers, followed]))
+    rows = np.searchsorted(user_ids, followers).astype(np.int32)
+    cols = np.searchsorted(user_ids, followed).astype(np.int32)
+    del followers, followed
+    n = len(user_ids)
+    graph = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, n))
+    return user_ids, graph
+
+
+def score_batch(graph, similarity_graph, rows, neighbors, limit):
+    import numpy as np
+
+    followed = graph[rows]
+    # users reachable through someone you follow
+    scores = followed @ graph
+    # users followed by the people most similar to you (shared followees)
+    shared = _top_k_per_row(followed @ similarity_graph.T, rows, neighbors)
+    scores = (scores + CO_FOLLOW_WEIGHT * (shared @ graph)).tocsr()
+
+    results = []
+    for i, row in enumerate(rows):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        candidates = scores.indices[start:end]
+        values = scores.data[start:end]
+        exclude = followed.indices[followed.indptr[i]:followed.indptr[i + 1]]
+        keep = ~np.isin(candidates, exclude) & (candidates != row)
+        candidates, values = candidates[keep], values[keep]
+        if len(candidates) > limit:
+            top = np.argpartition(-values, limit)[:limit]
+            candidates, values = candidates[top], values[top]
+        order = np.argsort(-values, kind='stable')
+        results.append((row, candidates[order], values[order]))
+    return results
+
+
+def _top_k_per_row(matrix, rows, k):
+    import numpy as np
+    from scipy import sparse
+
+    matrix = matrix.tocsr()
+    data, indices, indptr = [], [], [0]
+    for i, row in enumerate(rows):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        cols = matrix.indices[start:end]
+        values = matrix.data[start:end]
+        keep = cols != row
+        cols, values = cols[keep], values[keep]
+        if len(cols) > k:
+            top = np.argpartition(-values, k)[:k]
+            cols, values = cols[top], values[top]
+        indices.append(cols)
+        data.append(values)
+        indptr.append(indptr[-1] + len(cols))
+    return sparse.csr_matrix(
+        (np.concatenate(data) if data else [],
+         np.concatenate(indices) if indices else [], indptr),
+        shape=matrix.shape, dtype=np.float32)
+
+
+def _stale_users(user_ids, graph, started):
+    import numpy as np
+
+    stale = np.array([r[0] for r in db.session.execute(
+        select(SuggestionRefresh.user_id)
+        .where(SuggestionRefresh.timestamp <= started))], dtype=np.int64)
+    if len(user_ids) == 0:
+        return stale, np.empty(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(user_ids, stale),
+                           len(user_ids) - 1)
+    known = user_ids[positions] == stale
+    # a change in who you follow also changes the friends-of-friends of
+    # everybody following you
+    rows = positions[known]
+    followers = graph.T.tocsr()[rows].indices
+    targets = np.unique(np.concatenate([rows, followers])).astype(np.int64)
+    return stale[~known], targets
+
+
+def recompute_suggestions(full=False, batch_size=None, limit=None,
+                          echo=None):
+    import numpy as np
+    from scipy import sparse
+
+    config = current_app.config
+    batch_size = batch_size or config['FLASKY_SUGGESTIONS_BATCH_SIZE']
+    limit = limit or config['FLASKY_SUGGESTIONS_PER_USER']
+    started = datetime.utcnow()
+
+    user_ids, graph = load_follow_graph()
+
+    # very popular accounts say little about similarity and would make the
+    # shared-followee products dense, so leave them out of that step
+    similarity_graph = graph
+    fanout = config['FLASKY_SUGGESTIONS_MAX_FANOUT']
+    if len(user_ids) and fanout:
+        in_degree = np.asarray(graph.sum(axis=0)).ravel()
+        if (in_degree > fanout).any():
+            similarity_graph = graph @ sparse.diags(
+                (in_degree <= fanout).astype(np.float32), format='csr')
+
+    if full:
+        db.session.execute(delete(Suggestion))
+        targets = np.arange(len(user_ids))
+    else:
+        # users left without any edge simply lose their suggestions
+        isolated, targets = _stale_users(user_ids, graph, started)
+        if len(isolated):
+            db.session.execute(delete(Suggestion).where(
+                Suggestion.user_id.in_([int(u) for u in isolated])))
+
+    done = 0
+    for start in range(0, len(targets), batch_size):
+        rows = targets[start:start + batch_size]
+        results = score_batch(graph, similarity_graph, rows,
+                              config['FLASKY_SUGGESTIONS_NEIGHBORS'], limit)
+        batch_users = [int(user_ids[row]) for row in rows]
+        db.session.execute(delete(Suggestion)
+                           .where(Suggestion.user_id.in_(batch_users)))
+        values = [{'user_id': int(user_ids[row]),
+                   'suggested_id': int(user_ids[c]),
+                   'score': float(v),
+                   'timestamp': started}
+                  for row, candidates, scores in results
+                  for c, v in zip(candidates, scores)]
+        if values:
+            db.session.execute(insert(Suggestion), values)
+        db.session.commit()
+        done += len(rows)
+        if echo:
+            echo('%d/%d users processed' % (done, len(targets)))
+
+    db.session.execute(delete(SuggestionRefresh)
+                       .where(SuggestionRefresh.timestamp <= started))
+    db.session.commit()
+    return done
@@ -0,0 +1,73 @@
+from celery import shared_task
+from flask import current_app
+from sqlalchemy import select, update
+from . import db, mail
+from .models import User, Post, Comment, UserLog
+
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i',
+                'li', 'ol', 'pre', 'strong', 'ul', 'h1', 'h2', 'h3', 'p']
+
+RENDERED_MODELS = {model.__tablename__: model for model in (Post, Comment)}
+
+
+def render_markdown(value):
+    from markdown import markdown
+    import bleach
+    return bleach.linkify(bleach.clean(markdown(value, output_format='html'),
+                                       tags=ALLOWED_TAGS, strip=True))
+
+
+@shared_task(ignore_result=True)
+def render_body_html(table, id):
+    rendered = RENDERED_MODELS[table].__table__
+    columns = rendered.c
+    sharding = current_app.extensions['sharding']
+    for engine in sharding.engines_for(table, id):
+        with engine.begin() as connection:
+            body = connection.execute(
+                select(columns.body).where(columns.id == id)).scalar()
+            if body is None:
+                continue
+            # skip the write if the body was edited again meanwhile, the
+            # job queued by that edit renders the newer text
+            connection.execute(
+                update(rendered)
+                .where(columns.id == id, columns.body == body)
+                .values(body_html=render_markdown(body)))
+            return
+
+
+@shared_task(ignore_result=True)
+def send_email(to, subject, body, html):
+    from flask_mail import Message
+    msg = Message(subject, sender=current_app.config['FLASKY_MAIL_SENDER'],
+                  recipients=[to])
+    msg.body = body
+    msg.html = html
+    mail.send(msg)
+
+
+@shared_task(ignore_result=True)
+def add_self_follows():
+    User.add_self_follows()
+
+
+@shared_task(ignore_result=True)
+def generate_fake(users=0, posts=0, comments=0, logs=0):
+    # a single task so that each kind is generated after the ones it
+    # references
+    if users:
+        User.generate_fake(users)
+    if posts:
+        Post.generate_fake(posts)
+    if comments:
+        Comment.generate_fake_comments(comments)
+    if logs:
+        UserLog.generate_fake_logs(logs)
+
+
+@shared_task(ignore_result=True)
+def delete_users(job_id):
+    from .bulk import run_deletion
+    run_deletion(job_id)
@@ -0,0 +1,48 @@
+import os
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+
+def init_app(app):
+    # Compiled templates are kept in a directory shared by every worker on
+    # the host, so a fresh worker loads bytecode instead of parsing the
+    # sources again. Has to run before anything touches app.jinja_env.
+    cache_dir = app.config['FLASKY_TEMPLATE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(
+            app.jinja_options,
+            bytecode_cache=FileSystemBytecodeCache(cache_dir, '%s.jinja.cache'))
+
+
+def compile_templates(app, echo=None):
+    # loading a template compiles it and stores the bytecode in the cache
+    compiled, errors = [], []
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            compiled.append(name)
+        except TemplateSyntaxError as e:
+            errors.append((name, e))
+            if echo:
+                echo('%s:%s: %s' % (name, e.lineno, e.message))
+    return compiled, errors
+
+
+def warm_up(app):
+    # Render the busiest pages once so that the templates they use sit in
+    # the environment's cache. Run in the gunicorn master before forking,
+    # every worker inherits the result.
+    compile_templates(app)
+    client = app.test_client()
+    for path in app.config['FLASKY_WARM_UP_URLS']:
+        try:
+            response = client.get(path)
+            if response.status_code >= 500:
+                app.logger.warning('Warm-up request to %s returned %d',
+                                   path, response.status_code)
+        except Exception:
+            app.logger.exception('Warm-up request to %s failed', path)
+    # connections opened by the requests must not be inherited by workers
+    from . import db
+    with app.app_context():
+        db.engine.dispose()
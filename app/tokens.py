@@ -0,0 +1,96 @@
+import threading
+import time
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer as Serializer
+
+
+# Signed API tokens that carry what an API request needs to know about its
+# user: id, confirmed flag and permission bits. Checking the signature is
+# enough to authorize a request; the User row is only loaded by the views
+# that need it. A token also carries the user's token generation, bumping
+# User.token_generation revokes every token issued before. Generations are
+# cached per process for FLASKY_TOKEN_GENERATION_TTL seconds, so a revoked
+# token can keep working that long on other workers, and permissions
+# embedded in a token are those the user had when it was issued.
+
+SALT = 'auth-token'
+
+
+class TokenUser:
+    is_anonymous = False
+    is_authenticated = True
+    is_active = True
+
+    def __init__(self, id, confirmed, permissions, generation):
+        self.id = id
+        self.confirmed = confirmed
+        self.permissions = permissions
+        self.generation = generation
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+    def is_administrator(self):
+        from .models import Permission
+        return self.can(Permission.ADMIN)
+
+    def get_id(self):
+        return str(self.id)
+
+
+class GenerationCache:
+    max_entries = 10000
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id, ttl):
+        with self.lock:
+            entry = self.entries.get(user_id)
+        if entry is not None and entry[1] >= time.monotonic() - ttl:
+            return entry[0]
+        from . import db
+        from .models import User
+        generation = db.session.query(User.token_generation)\
+            .filter_by(id=user_id).scalar()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            self.entries[user_id] = (generation, time.monotonic())
+        return generation
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+def generation_cache():
+    return current_app.extensions.setdefault('token_generations',
+                                             GenerationCache())
+
+
+def generate(user, expiration):
+    s = Serializer(current_app.config['SECRET_KEY'])
+    return s.dumps({'id': user.id, 'c': bool(user.confirmed),
+                    'p': user.role.permissions if user.role else 0,
+                    'g': user.token_generation or 0, 'e': expiration},
+                   salt=SALT)
+
+
+def verify(token):
+    s = Serializer(current_app.config['SECRET_KEY'])
+    try:
+        data, issued = s.loads(token, salt=SALT, return_timestamp=True)
+        user = TokenUser(int(data['id']), bool(data['c']), int(data['p']),
+                         int(data['g']))
+        expiration = int(data['e'])
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+    if issued.timestamp() + expiration < time.time():
+        return None
+    generation = generation_cache().get(
+        user.id, current_app.config['FLASKY_TOKEN_GENERATION_TTL'])
+    if generation is None or generation != user.generation:
+        return None
+    return user
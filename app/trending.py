@@ -0,0 +1,95 @@
+import math
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+from . import db
+from .models import Post, Comment
+
+
+# Scores are stored as log(sum(exp((t - HOT_EPOCH) / tau))) over the post
+# and its comments. Decaying every score by the same factor never changes
+# their order, so the value only has to change when a comment arrives and
+# an index on posts.hot_score is enough to serve the ranking.
+HOT_EPOCH = datetime(2025, 1, 1)
+
+
+def decay_exponent(timestamp, half_life=None):
+    if half_life is None:
+        half_life = current_app.config['FLASKY_HOT_HALF_LIFE']
+    tau = half_life * 3600 / math.log(2)
+    return (timestamp - HOT_EPOCH).total_seconds() / tau
+
+
+def add_exponent(score, x):
+    if score is None:
+        return x
+    high, low = max(score, x), min(score, x)
+    return high + math.log1p(math.exp(low - high))
+
+
+def hot_posts():
+    return Post.query.order_by(Post.hot_score.desc(), Post.id.desc())
+
+
+def on_post_insert(mapper, connection, target):
+    if target.hot_score is None:
+        target.hot_score = decay_exponent(target.timestamp or
+                                          datetime.utcnow())
+
+
+def on_comment_insert(mapper, connection, target):
+    if target.post_id is None:
+        return
+    x = decay_exponent(target.timestamp or datetime.utcnow())
+    posts = Post.__table__
+    score = connection.execute(
+        select(posts.c.hot_score).where(posts.c.id == target.post_id)
+        .with_for_update()).scalar()
+    connection.execute(update(posts).where(posts.c.id == target.post_id)
+                       .values(hot_score=add_exponent(score, x)))
+
+
+def rebuild_hot_scores(missing_only=False, chunk_size=1000):
+    # every database holding posts, the primary or each shard
+    from . import sharding
+    count = 0
+    for engine in sharding.engines():
+        with engine.connect() as connection:
+            count += _rebuild_hot_scores(connection, missing_only,
+                                         chunk_size)
+    return count
+
+
+def _rebuild_hot_scores(connection, missing_only, chunk_size):
+    posts, comments = Post.__table__, Comment.__table__
+    half_life = current_app.config['FLASKY_HOT_HALF_LIFE']
+    set_score = update(posts).where(posts.c.id == bindparam('post_id'))\
+        .values(hot_score=bindparam('score'))
+    last_id, count = 0, 0
+    while True:
+        query = select(posts.c.id, posts.c.timestamp)\
+            .where(posts.c.id > last_id)
+        if missing_only:
+            query = query.where(posts.c.hot_score.is_(None))
+        rows = connection.execute(
+            query.order_by(posts.c.id).limit(chunk_size)).all()
+        if not rows:
+            break
+        scores = {id: decay_exponent(ts or HOT_EPOCH, half_life)
+                  for id, ts in rows}
+        for post_id, ts in connection.execute(
+                select(comments.c.post_id, comments.c.timestamp)
+                .where(comments.c.post_id.in_(list(scores)))):
+            if ts is not None:
+                scores[post_id] = add_exponent(
+                    scores[post_id], decay_exponent(ts, half_life))
+        connection.execute(set_score, [
+            {'post_id': id, 'score': score} for id, score in scores.items()])
+        connection.commit()
+        last_id = rows[-1][0]
+        count += len(rows)
+    return count
+
+
+db.event.listen(Post, 'before_insert', on_post_insert)
+db.event.listen(Comment, 'after_insert', on_comment_insert)
@@ -0,0 +1,108 @@
+"""Reading posts back from archive segments against the database.
+
+    FLASK_CONFIG=development python benchmarks/archive.py --posts 5000
+
+Writes a segment of --posts synthetic posts with --comments comments each
+(the layout of app/archive.py) to a temporary directory and reports its
+size against the raw text, then the time to read one post with its
+comments: from a segment opened for the read, from one already mapped,
+and, for comparison, a post and its comments from the configured
+database.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from faker import Faker  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.archive import Segment, write_segment  # noqa: E402
+from app.models import Comment, Post  # noqa: E402
+
+
+def make_rows(count, per_post):
+    fake = Faker()
+    posts, comments = [], []
+    start = datetime(2025, 1, 1)
+    comment_id = 0
+    for id in range(1, count + 1):
+        timestamp = start + timedelta(minutes=id)
+        body = fake.text(400)
+        posts.append((id, body, '<p>%s</p>' % body, timestamp,
+                      random.randint(1, 100), 1.0))
+        for i in range(per_post):
+            comment_id += 1
+            body = fake.sentence()
+            comments.append((comment_id, body, '<p>%s</p>' % body,
+                             timestamp + timedelta(seconds=i), None,
+                             random.randint(1, 100), id))
+    return posts, comments
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=5)
+    parser.add_argument('--calls', type=int, default=1000)
+    args = parser.parse_args()
+    random.seed(1)
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    posts, comments = make_rows(args.posts, args.comments)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'bench.seg')
+        post_columns, comment_columns = list(Post.__table__.c), \
+            list(Comment.__table__.c)
+        size = write_segment(path, {
+            'posts': (post_columns, posts, 0),
+            'comments': (comment_columns, comments, 6)})
+        raw = sum(len(row[1]) + len(row[2]) for row in posts + comments)
+        print('segment %.1f MB for %.1f MB of body text (%.0f%%)' % (
+            size / 1e6, raw / 1e6, size * 100.0 / raw))
+
+        def read(segment):
+            id = random.randint(1, args.posts)
+            segment.rows('posts', id)
+            segment.rows('comments', id)
+
+        print('%-28s %8.0f us' % ('opened for every read', per_call(
+            lambda: read(Segment(path)), args.calls)))
+        segment = Segment(path)
+        print('%-28s %8.0f us' % ('already mapped', per_call(
+            lambda: read(segment), args.calls)))
+    finally:
+        shutil.rmtree(directory)
+
+    with app.app_context():
+        ids = [id for id, in db.session.query(Post.id).limit(1000)]
+        if not ids:
+            print('no posts in the database, run flask fake first')
+            return
+
+        def hot():
+            id = random.choice(ids)
+            db.session.get(Post, id)
+            Comment.query.filter_by(post_id=id).order_by(
+                Comment.timestamp).all()
+            db.session.expunge_all()
+
+        print('%-28s %8.0f us' % ('database', per_call(hot, args.calls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Deleting a user with many rows: ORM cascade, ON DELETE CASCADE, chunks.
+
+    FLASK_CONFIG=development python benchmarks/bulk.py --comments 20000
+
+Creates a throwaway user with --posts posts and --comments comments (on
+those posts, from the user) and deletes it three ways: loading every row
+into the session and deleting them one by one, as the relationship
+cascade did; one DELETE of the user row left to the ON DELETE CASCADE
+foreign keys; and the chunked job of app/bulk.py with --chunk rows per
+transaction. Reports the total time and the longest transaction, the time
+the deleted rows stay locked. Needs PostgreSQL, SQLite does not enforce
+the foreign keys by default.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from sqlalchemy import event, insert  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.bulk import run_deletion  # noqa: E402
+from app.models import (Comment, DeletionJob, PendingDeletion,  # noqa: E402
+                        Post, User)
+
+
+class Transactions:
+    # the longest transaction on the engine while it is watched
+    def __init__(self, engine):
+        self.engine = engine
+        self.longest = 0.0
+        self.count = 0
+        self.started = None
+
+    def begin(self, connection):
+        self.started = time.perf_counter()
+
+    def commit(self, connection):
+        if self.started is not None:
+            self.longest = max(self.longest,
+                               time.perf_counter() - self.started)
+            self.count += 1
+            self.started = None
+
+    def __enter__(self):
+        event.listen(self.engine, 'begin', self.begin)
+        event.listen(self.engine, 'commit', self.commit)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'begin', self.begin)
+        event.remove(self.engine, 'commit', self.commit)
+
+
+def make_user(name, posts, comments):
+    user = User(email='%s@bench.invalid' % name, username=name,
+                password='x', confirmed=True)
+    db.session.add(user)
+    db.session.commit()
+    post_ids = db.session.scalars(insert(Post).returning(Post.id), [
+        {'body': 'post %d' % i, 'author_id': user.id}
+        for i in range(posts)]).all()
+    db.session.execute(insert(Comment), [
+        {'body': 'comment %d' % i, 'author_id': user.id,
+         'post_id': post_ids[i % len(post_ids)]} for i in range(comments)])
+    db.session.commit()
+    return user.id
+
+
+def loaded(id, chunk):
+    user = db.session.get(User, id)
+    for post in user.posts:
+        for comment in post.comments:
+            db.session.delete(comment)
+        db.session.delete(post)
+    for comment in user.comments:
+        db.session.delete(comment)
+    db.session.delete(user)
+    db.session.commit()
+
+
+def cascade(id, chunk):
+    db.session.execute(db.delete(User).where(User.id == id))
+    db.session.commit()
+
+
+def chunked(id, chunk):
+    job = DeletionJob(total=1)
+    db.session.add(job)
+    db.session.flush()
+    db.session.add(PendingDeletion(job_id=job.id, user_id=id))
+    db.session.commit()
+    run_deletion(job.id, chunk)
+    db.session.delete(job)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--chunk', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.app_context():
+        print('%-16s %10s %16s %8s' % ('', 'total ms', 'longest tx ms',
+                                       'commits'))
+        for name, delete in [('orm cascade', loaded),
+                             ('on delete', cascade), ('chunked', chunked)]:
+            id = make_user('bench_%s' % name.replace(' ', '_'), args.posts,
+                           args.comments)
+            db.session.close()
+            with Transactions(db.engine) as transactions:
+                start = time.perf_counter()
+                delete(id, args.chunk)
+                total = time.perf_counter() - start
+            print('%-16s %10.0f %16.0f %8d' % (
+                name, total * 1000, transactions.longest * 1000,
+                transactions.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Measure password checks per second in one worker process.
+
+    python benchmarks/logins.py --threads 1,4,16 --seconds 3
+
+For every --method and pool kind, --threads request threads verify a
+password in a loop for --seconds while one more thread does a small piece
+of pure Python work over and over, standing in for page requests. Prints
+logins/sec, the slowest login, and page work/sec, so hashing cost and pool
+size can be weighed against how much they slow everything else down.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from flask import Flask  # noqa: E402
+from app.exceptions import PasswordCheckBusy  # noqa: E402
+from app.passwords import Passwords  # noqa: E402
+
+
+def page_work():
+    return sum(i * i for i in range(2000))
+
+
+def run(passwords, threads, seconds):
+    pwhash = passwords.hash('correct horse')
+    stop = time.perf_counter() + seconds
+    logins, busy, slowest, pages = [0], [0], [0.0], [0]
+    lock = threading.Lock()
+
+    def login():
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                passwords.verify(pwhash, 'correct horse')
+            except PasswordCheckBusy:
+                with lock:
+                    busy[0] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                logins[0] += 1
+                slowest[0] = max(slowest[0], elapsed)
+
+    def page():
+        while time.perf_counter() < stop:
+            page_work()
+            pages[0] += 1
+
+    workers = [threading.Thread(target=login) for i in range(threads)]
+    workers.append(threading.Thread(target=page))
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return logins[0] / seconds, busy[0], slowest[0], pages[0] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--method', action='append',
+                        help='werkzeug hashing method, can be repeated '
+                             '(default scrypt and pbkdf2:sha256:600000)')
+    parser.add_argument('--pool', default='thread,process')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', default='1,4,16')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--queue-timeout', type=float, default=2)
+    args = parser.parse_args()
+
+    pages, stop = 0, time.perf_counter() + args.seconds
+    while time.perf_counter() < stop:
+        page_work()
+        pages += 1
+    print('page work without logins: %.0f/sec' % (pages / args.seconds))
+
+    print('%-24s %-8s %7s %11s %6s %11s %10s' % (
+        'method', 'pool', 'threads', 'logins/sec', 'busy', 'slowest ms',
+        'pages/sec'))
+    for method in args.method or ['scrypt', 'pbkdf2:sha256:600000']:
+        for pool in args.pool.split(','):
+            app = Flask(__name__)
+            app.config.update(
+                FLASKY_PASSWORD_METHOD=method,
+                FLASKY_PASSWORD_POOL=pool,
+                FLASKY_PASSWORD_WORKERS=args.workers,
+                FLASKY_PASSWORD_QUEUE_TIMEOUT=args.queue_timeout)
+            passwords = Passwords(app)
+            try:
+                for threads in map(int, args.threads.split(',')):
+                    rate, busy, slowest, pages = run(passwords, threads,
+                                                     args.seconds)
+                    print('%-24s %-8s %7d %11.1f %6d %11.1f %10.0f' % (
+                        method, pool, threads, rate, busy, slowest * 1000,
+                        pages))
+            finally:
+                passwords.shutdown()
+
+
+if __name__ == '__main__':
+    main()
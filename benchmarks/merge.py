@@ -0,0 +1,96 @@
+"""Top N of k sorted streams: lazy heap merge against sorting everything.
+
+    python benchmarks/merge.py --streams 2,8,32 --rows 100000 --top 25
+
+Builds --streams sorted lists of synthetic (timestamp, id) rows, --rows in
+total, newest first like the feeds, and reads rows --offset .. --offset +
+--top of their merge with app/merge.py and by concatenating and sorting
+all rows. It also counts the rows the lazy merge pulled from the streams,
+next to the rows that asking every stream for offset + top of them would
+read; with database cursors that is the difference in rows fetched.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from app import merge  # noqa: E402
+
+
+def make_streams(count, rows, skew):
+    # rows spread over the streams, the first ones busier with --skew
+    start = datetime(2026, 1, 1)
+    weights = [1 / (i + 1) ** skew for i in range(count)]
+    streams = [[] for i in range(count)]
+    for id in range(rows):
+        stream = random.choices(range(count), weights)[0]
+        streams[stream].append(
+            (start + timedelta(seconds=random.randrange(10 ** 7)), id))
+    for stream in streams:
+        stream.sort(reverse=True)
+    return streams
+
+
+class Counting:
+    # an iterable that counts the rows taken from it
+    def __init__(self, rows):
+        self.rows = rows
+        self.pulled = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.pulled += 1
+            yield row
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        result = func()
+    return (time.perf_counter() - start) / calls * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', default='2,8,32')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--offset', type=int, default=0)
+    parser.add_argument('--skew', type=float, default=0.0,
+                        help='0 spreads rows evenly, 1 and up favours the '
+                             'first streams')
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+    random.seed(1)
+
+    def key(row):
+        return row
+
+    print('%7s %12s %12s %8s %8s' % ('streams', 'merge us', 'sort us',
+                                     'pulled', 'limited'))
+    for count in [int(n) for n in args.streams.split(',')]:
+        streams = make_streams(count, args.rows, args.skew)
+        lazy, expected = per_call(lambda: merge.top(
+            streams, key, args.top, descending=True, offset=args.offset),
+            args.calls)
+        full, result = per_call(lambda: sorted(
+            [row for stream in streams for row in stream], reverse=True)[
+                args.offset:args.offset + args.top],
+            max(args.calls // 20, 1))
+        assert result == expected
+        counted = [Counting(stream) for stream in streams]
+        merge.top(counted, key, args.top, descending=True,
+                  offset=args.offset)
+        limited = sum(min(len(stream), args.offset + args.top)
+                      for stream in streams)
+        print('%7d %12.1f %12.1f %8d %8d' % (
+            count, lazy, full, sum(c.pulled for c in counted), limited))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Per-call cost of the hot lookups, ORM queries against lambda statements.
+
+    FLASK_CONFIG=development python benchmarks/queries.py --calls 2000
+
+Runs each lookup of app/queries.py --calls times against the configured
+database. It runs both the ORM Query the views used before and the
+lambda statement they use now. A raw SQL string with the same query
+gives the cost of the database round trip. The rest is spent building
+the statement, finding its compiled form and loading the rows into
+objects, and only the first two differ between the variants.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from sqlalchemy import text  # noqa: E402
+from app import create_app, db, queries  # noqa: E402
+from app.models import Post, User  # noqa: E402
+from app.pagination import KeysetPagination  # noqa: E402
+
+
+def per_call(func, calls):
+    func()
+    start = time.perf_counter()
+    for i in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def report(name, raw, variants, calls):
+    baseline = per_call(raw, calls)
+    print('%s (raw SQL %.0f us)' % (name, baseline))
+    for label, func in variants:
+        elapsed = per_call(func, calls)
+        print('  %-10s %8.0f us/call %8.0f us over raw SQL' % (
+            label, elapsed, elapsed - baseline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.app_context():
+        user = db.session.scalars(db.select(User).join(User.followed)
+                                  .limit(1)).first()
+        if user is None:
+            print('no users following anyone, run flask fake first')
+            return
+        other = user.followed.first().followed
+        username, email = user.username, user.email
+        per_page = app.config['FLASKY_POSTS_PER_PAGE']
+
+        report('user by username', lambda: db.session.execute(
+            text('SELECT * FROM users WHERE username = :u LIMIT 1'),
+            {'u': username}).first(), [
+            ('query', lambda: User.query.filter_by(
+                username=username).first()),
+            ('lambda', lambda: queries.user_by_username(username)),
+        ], args.calls)
+
+        report('user by email', lambda: db.session.execute(
+            text('SELECT * FROM users WHERE email = :e LIMIT 1'),
+            {'e': email}).first(), [
+            ('query', lambda: User.query.filter_by(email=email).first()),
+            ('lambda', lambda: queries.user_by_email(email)),
+        ], args.calls)
+
+        report('is_following', lambda: db.session.execute(
+            text('SELECT follower_id FROM follows WHERE follower_id = :a '
+                 'AND followed_id = :b LIMIT 1'),
+            {'a': user.id, 'b': other.id}).first(), [
+            ('query', lambda: user.followed.filter_by(
+                followed_id=other.id).first()),
+            ('lambda', lambda: queries.is_following(user.id, other.id)),
+        ], args.calls)
+
+        columns = [Post.timestamp, Post.id]
+        report('followed posts page', lambda: db.session.execute(
+            text('SELECT posts.* FROM posts JOIN follows '
+                 'ON follows.followed_id = posts.author_id '
+                 'WHERE follows.follower_id = :u '
+                 'ORDER BY posts.timestamp DESC, posts.id DESC LIMIT :n'),
+            {'u': user.id, 'n': per_page + 1}).all(), [
+            ('query', lambda: KeysetPagination(
+                user.followed_posts.order_by(None), columns, per_page)),
+            ('lambda', lambda: KeysetPagination(
+                queries.followed_posts(user.id), columns, per_page)),
+        ], max(args.calls // 4, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Time the pieces of an API list response.
+
+    FLASK_CONFIG=development python benchmarks/serialization.py --count 200
+
+Loads up to --count posts, users and comments from the configured
+database and times, per item: URL building, Post/User/Comment.to_json
+(including the queries they issue) and encoding the dicts with the
+stdlib and the orjson JSON providers.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+from flask import g, url_for  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from app import create_app  # noqa: E402
+from app.json_provider import OrjsonProvider  # noqa: E402
+from app.models import Post, User, Comment  # noqa: E402
+from app.urls import external_url  # noqa: E402
+
+
+def timed(label, func, items, repeat):
+    best = None
+    for i in range(repeat):
+        g.pop('url_templates', None)
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('%-36s %9.1f us/item' % (label, best / max(len(items), 1) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.test_request_context(base_url='https://example.com'):
+        ids = list(range(1, args.count + 1))
+        timed('url_for(_external=True)', lambda ids: [
+            url_for('api.get_post', id=id, _external=True) for id in ids],
+            ids, args.repeat)
+        timed('external_url', lambda ids: [
+            external_url('api.get_post', id) for id in ids],
+            ids, args.repeat)
+
+        for model in (Post, User, Comment):
+            items = model.query.order_by(model.id).limit(args.count).all()
+            if not items:
+                print('%-36s no rows' % (model.__name__ + '.to_json'))
+                continue
+            timed(model.__name__ + '.to_json',
+                  lambda items: [item.to_json() for item in items],
+                  items, args.repeat)
+            dicts = [item.to_json() for item in items]
+            for provider in (DefaultJSONProvider(app), OrjsonProvider(app)):
+                timed('  %s.dumps' % type(provider).__name__,
+                      lambda dicts: provider.dumps({'items': dicts}),
+                      dicts, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
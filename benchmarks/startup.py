@@ -0,0 +1,103 @@
+"""Measure how long the application takes to start.
+
+    python benchmarks/startup.py                 # import + create_app
+    python benchmarks/startup.py --path /        # ... and the first request
+    python benchmarks/startup.py --server        # gunicorn boot to first 200
+
+Every run uses a fresh interpreter so nothing is cached between them.
+FLASK_CONFIG and the database settings come from the environment.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CHILD = '''
+import time
+t0 = time.perf_counter()
+from wsgi import app
+t1 = time.perf_counter()
+path = %r
+if path:
+    app.test_client().get(path)
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+'''
+
+
+def run_import(path, runs):
+    imports, requests = [], []
+    for i in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', CHILD % path],
+                                      cwd=basedir)
+        create, first = out.split()[-2:]
+        imports.append(float(create))
+        requests.append(float(first))
+    report('import + create_app', imports)
+    if path:
+        report('first request %s' % path, requests)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_server(path, runs, preload):
+    times = []
+    for i in range(runs):
+        port = free_port()
+        env = dict(os.environ, GUNICORN_BIND='127.0.0.1:%d' % port,
+                   GUNICORN_PIDFILE='', GUNICORN_ACCESSLOG='')
+        args = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                'wsgi:app']
+        if not preload:
+            env['GUNICORN_PRELOAD'] = 'false'
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=basedir, env=env,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    urllib.request.urlopen('http://127.0.0.1:%d%s'
+                                           % (port, path or '/'), timeout=1)
+                    break
+                except OSError:
+                    if proc.poll() is not None:
+                        sys.exit('gunicorn exited with %d' % proc.returncode)
+                    time.sleep(0.01)
+            times.append(time.perf_counter() - start)
+        finally:
+            proc.terminate()
+            proc.wait()
+    report('gunicorn boot to first response (%s)'
+           % ('preload' if preload else 'no preload'), times)
+
+
+def report(label, times):
+    print('%-45s min %7.1f ms  median %7.1f ms  (%d runs)' % (
+        label, min(times) * 1000, statistics.median(times) * 1000,
+        len(times)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default=None,
+                        help='URL requested after startup')
+    parser.add_argument('--server', action='store_true',
+                        help='time a gunicorn boot with and without preload')
+    args = parser.parse_args()
+    if args.server:
+        run_server(args.path, args.runs, preload=True)
+        run_server(args.path, args.runs, preload=False)
+    else:
+        run_import(args.path, args.runs)
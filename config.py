@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -22,7 +23,32 @@ class Config:
     FLASKY_FOLLOWERS_PER_PAGE = int(os.getenv('FLASKY_FOLLOWERS_PER_PAGE', '50'))
     FLASKY_COMMENTS_PER_PAGE = int(os.getenv('FLASKY_COMMENTS_PER_PAGE', '30'))
     FLASKY_SLOW_DB_QUERY_TIME = float(os.getenv('FLASKY_SLOW_DB_QUERY_TIME', '0.5'))
+    FLASKY_LOGS_PER_PAGE = int(os.getenv('FLASKY_LOGS_PER_PAGE', '20'))
+    FLASKY_LOG_PARTITIONS_AHEAD = int(os.getenv('FLASKY_LOG_PARTITIONS_AHEAD', '3'))
+    FLASKY_LOG_RETENTION_MONTHS = int(os.getenv('FLASKY_LOG_RETENTION_MONTHS', '12'))
+    FLASKY_LOG_ARCHIVE_DIR = os.getenv('FLASKY_LOG_ARCHIVE_DIR')
+    # posts whose thread is quiet for FLASKY_ARCHIVE_AFTER_DAYS are moved
+    # to segment files by flask archive-posts, FLASKY_ARCHIVE_CHUNK a file
+    FLASKY_ARCHIVE_DIR = os.getenv('FLASKY_ARCHIVE_DIR') or \
+        os.path.join(basedir, 'archive')
+    FLASKY_ARCHIVE_AFTER_DAYS = int(os.getenv('FLASKY_ARCHIVE_AFTER_DAYS', '365'))
+    FLASKY_ARCHIVE_CHUNK = int(os.getenv('FLASKY_ARCHIVE_CHUNK', '5000'))
+    # rows per transaction when a user is deleted from /manage
+    FLASKY_DELETE_CHUNK = int(os.getenv('FLASKY_DELETE_CHUNK', '1000'))
+    FLASKY_HOT_HALF_LIFE = float(os.getenv('FLASKY_HOT_HALF_LIFE', '12'))
+    FLASKY_SUGGESTIONS_PER_USER = int(os.getenv('FLASKY_SUGGESTIONS_PER_USER', '20'))
+    FLASKY_SUGGESTIONS_BATCH_SIZE = int(os.getenv('FLASKY_SUGGESTIONS_BATCH_SIZE', '1000'))
+    FLASKY_SUGGESTIONS_NEIGHBORS = int(os.getenv('FLASKY_SUGGESTIONS_NEIGHBORS', '50'))
+    FLASKY_SUGGESTIONS_MAX_FANOUT = int(os.getenv('FLASKY_SUGGESTIONS_MAX_FANOUT', '1000'))
     SQLALCHEMY_RECORD_QUERIES = True
+    FLASKY_TEMPLATE_CACHE_DIR = os.getenv('FLASKY_TEMPLATE_CACHE_DIR')
+    # serve the fingerprinted copies from `flask build-assets` when present
+    FLASKY_HASHED_ASSETS = os.getenv('FLASKY_HASHED_ASSETS', 'true').lower() in \
+        ['true', 'on', '1']
+    FLASKY_WARM_UP_URLS = os.getenv('FLASKY_WARM_UP_URLS',
+                                    '/,/hot,/auth/login').split(',')
+    # 'full' serves the website and the API, 'api' only /api/v1
+    FLASKY_APP_PROFILE = os.getenv('FLASKY_APP_PROFILE', 'full')
     
     # PostgreSQL specific configurations
     SQLALCHEMY_ENGINE_OPTIONS = {
@@ -32,6 +58,110 @@ class Config:
         'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10'))
     }
 
+    # Pool statistics per worker (Administrator > Connection Pool); a
+    # connection held longer than the leak threshold (0 turns the check
+    # off) is logged with the stack of the thread holding it, and with
+    # the stack it was checked out from when checkouts are traced
+    FLASKY_POOL_MONITOR = os.getenv('FLASKY_POOL_MONITOR', 'true').lower() in \
+        ['true', 'on', '1']
+    FLASKY_POOL_LEAK_THRESHOLD = float(os.getenv('FLASKY_POOL_LEAK_THRESHOLD',
+                                                 '30'))
+    FLASKY_POOL_TRACE_CHECKOUTS = os.getenv('FLASKY_POOL_TRACE_CHECKOUTS',
+                                            'false').lower() in \
+        ['true', 'on', '1']
+
+    # Rate limits are "<count>/<second|minute|hour|day>" per client, keyed
+    # by endpoint, then blueprint, then 'default'
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() in \
+        ['true', 'on', '1']
+    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_RULES = {
+        'api': os.getenv('RATELIMIT_API', '300/minute'),
+        'auth.login': os.getenv('RATELIMIT_LOGIN', '10/minute'),
+    }
+    # requests allowed in flight per worker before new ones are shed
+    RATELIMIT_MAX_CONCURRENT = int(os.getenv(
+        'RATELIMIT_MAX_CONCURRENT',
+        SQLALCHEMY_ENGINE_OPTIONS['pool_size'] +
+        SQLALCHEMY_ENGINE_OPTIONS['max_overflow']))
+    RATELIMIT_QUEUE_TIMEOUT = float(os.getenv('RATELIMIT_QUEUE_TIMEOUT', '0.5'))
+
+    # Password hashing: a werkzeug method such as scrypt:32768:8:1 or
+    # pbkdf2:sha256:600000, stored hashes made with another one are
+    # replaced on login. Hashes run in a pool of FLASKY_PASSWORD_WORKERS
+    # threads (or processes) per worker and logins that wait longer than
+    # the queue timeout for one are turned away
+    FLASKY_PASSWORD_METHOD = os.getenv('FLASKY_PASSWORD_METHOD', 'scrypt')
+    FLASKY_PASSWORD_POOL = os.getenv('FLASKY_PASSWORD_POOL', 'thread')
+    FLASKY_PASSWORD_WORKERS = int(os.getenv('FLASKY_PASSWORD_WORKERS', '2'))
+    FLASKY_PASSWORD_QUEUE_TIMEOUT = float(os.getenv(
+        'FLASKY_PASSWORD_QUEUE_TIMEOUT', '2'))
+
+    # API tokens are checked without loading the user; a revoked token can
+    # still work on other workers for up to the generation TTL
+    FLASKY_TOKEN_EXPIRATION = int(os.getenv('FLASKY_TOKEN_EXPIRATION', '3600'))
+    FLASKY_TOKEN_GENERATION_TTL = float(os.getenv(
+        'FLASKY_TOKEN_GENERATION_TTL', '30'))
+
+    # Posts and comments sharded over these databases (comma separated
+    # URLs, e.g. sqlite:////var/lib/flasky/shard0.db), see app/sharding.py
+    FLASKY_SHARD_URLS = [url for url in
+                         os.getenv('FLASKY_SHARD_URLS', '').split(',') if url]
+
+    # Listing totals are estimated from PostgreSQL statistics (?exact=1
+    # counts); smaller estimates are counted exactly, cached counts for
+    # the moderation tabs and log filters are recomputed after the TTL
+    COUNTS_EXACT_BELOW = int(os.getenv('COUNTS_EXACT_BELOW', '1000'))
+    COUNTS_CACHE_TTL = float(os.getenv('COUNTS_CACHE_TTL', '60'))
+
+    # limits for POST /api/v1/query: nesting depth, rows per list and
+    # the number of rows a query could return at most
+    FLASKY_QUERY_MAX_DEPTH = int(os.getenv('FLASKY_QUERY_MAX_DEPTH', '4'))
+    FLASKY_QUERY_MAX_LIMIT = int(os.getenv('FLASKY_QUERY_MAX_LIMIT', '50'))
+    FLASKY_QUERY_MAX_COST = int(os.getenv('FLASKY_QUERY_MAX_COST', '1000'))
+
+    # Live updates (server-sent events). memory:// only reaches streams in
+    # the publishing process, use redis:// when running several workers
+    LIVE_BACKEND_URL = os.getenv('LIVE_BACKEND_URL', 'memory://')
+    LIVE_REDIS_STREAM = os.getenv('LIVE_REDIS_STREAM', 'flasky:events')
+    LIVE_REDIS_MAXLEN = int(os.getenv('LIVE_REDIS_MAXLEN', '10000'))
+    LIVE_BUFFER_SIZE = int(os.getenv('LIVE_BUFFER_SIZE', '1000'))
+    LIVE_MAX_STREAMS = int(os.getenv('LIVE_MAX_STREAMS', '20'))
+    LIVE_STREAM_TIMEOUT = float(os.getenv('LIVE_STREAM_TIMEOUT', '300'))
+    LIVE_HEARTBEAT = float(os.getenv('LIVE_HEARTBEAT', '15'))
+    LIVE_RETRY_MS = int(os.getenv('LIVE_RETRY_MS', '3000'))
+
+    # encode JSON with orjson when it is installed
+    FLASKY_FAST_JSON = os.getenv('FLASKY_FAST_JSON', 'true').lower() in \
+        ['true', 'on', '1']
+
+    # Response compression, algorithms in order of preference
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() in \
+        ['true', 'on', '1']
+    COMPRESS_ALGORITHMS = os.getenv('COMPRESS_ALGORITHMS',
+                                    'br,zstd,gzip').split(',')
+    COMPRESS_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '500'))
+    COMPRESS_MIMETYPES = ['text/html', 'text/css', 'text/plain',
+                          'text/event-stream', 'application/json',
+                          'application/javascript']
+    # compressed bodies kept per worker for responses served repeatedly
+    COMPRESS_CACHE_SIZE = int(os.getenv('COMPRESS_CACHE_SIZE', str(16 * 1024 * 1024)))
+
+    # Background jobs. Without a broker they run in JOBS_THREADS threads of
+    # the calling process (inline when 0), after the response is on its
+    # way; set CELERY_BROKER_URL (e.g. redis://localhost:6379/0) and start
+    # `flask worker` to move them out of the web process.
+    CELERY = {
+        'broker_url': os.getenv('CELERY_BROKER_URL', 'memory://'),
+        'result_backend': os.getenv('CELERY_RESULT_BACKEND'),
+        'task_always_eager': not os.getenv('CELERY_BROKER_URL'),
+        'task_ignore_result': True,
+        'task_acks_late': True,
+        'worker_prefetch_multiplier': 1,
+    }
+    JOBS_THREADS = int(os.getenv('JOBS_THREADS', '2'))
+
     @staticmethod
     def init_app(app):
         pass
@@ -45,15 +175,26 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    RATELIMIT_ENABLED = False
+    CELERY = dict(Config.CELERY, broker_url='memory://',
+                  task_always_eager=True, task_eager_propagates=True)
+    # jobs finish before the request returns
+    JOBS_THREADS = 0
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL') or \
         'postgresql://localhost/flask_test'
     WTF_CSRF_ENABLED = False
+    # full strength hashing only slows the tests down
+    FLASKY_PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+    # no leak check thread for every app the tests create
+    FLASKY_POOL_LEAK_THRESHOLD = 0
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL') or \
         'postgresql://localhost/flask_prod'
     SERVER_NAME = os.getenv('SERVER_NAME')  # configure the domain name in use
+    FLASKY_TEMPLATE_CACHE_DIR = os.getenv('FLASKY_TEMPLATE_CACHE_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'flasky-templates')
     
     @classmethod
     def init_app(cls, app):
@@ -64,6 +64,76 @@ def profile(length, profile_dir):
     app.run(debug=False)
 
 
+@app.cli.command('build-assets')
+def build_assets():
+    """Minify, fingerprint and precompress the files in app/static."""
+    from app import assets
+    manifest = assets.build_assets(app.static_folder, echo=click.echo)
+    click.echo('Built %d assets, restart the workers to serve them.'
+               % len(manifest))
+
+
+@app.cli.command('compile-templates')
+def compile_templates():
+    """Compile every template into the shared bytecode cache."""
+    from app import templating
+    if not app.config['FLASKY_TEMPLATE_CACHE_DIR']:
+        click.echo('FLASKY_TEMPLATE_CACHE_DIR is not set.')
+        sys.exit(1)
+    compiled, errors = templating.compile_templates(app, echo=click.echo)
+    click.echo('Compiled %d templates into %s.' % (
+        len(compiled), app.config['FLASKY_TEMPLATE_CACHE_DIR']))
+    if errors:
+        sys.exit(1)
+
+
+@app.cli.command('startup-report')
+@click.option('--limit', default=15,
+              help='Number of packages and imports to list.')
+@click.option('--module', default='wsgi',
+              help='Module whose import is measured.')
+@click.option('--profile', 'app_profile', default=None,
+              type=click.Choice(['full', 'api']),
+              help='Application profile to measure.')
+def startup_report(limit, module, app_profile):
+    """Summarize python -X importtime for the application start-up."""
+    import subprocess
+    env = dict(os.environ)
+    env.setdefault('FLASK_CONFIG', 'default')
+    if app_profile:
+        env['FLASKY_APP_PROFILE'] = app_profile
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        click.echo(result.stderr[-2000:])
+        sys.exit(result.returncode)
+
+    # lines look like "import time:  self [us] | cumulative |   package",
+    # with the nesting of the import shown by the indentation
+    imports, packages, total = [], {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        imports.append((int(cumulative), name))
+        top = name.split('.')[0]
+        packages[top] = packages.get(top, 0) + int(self_us)
+        if depth == 0:
+            total += int(cumulative)
+
+    click.echo('Total import time: %.1f ms' % (total / 1000))
+    click.echo('\nPackages (self time, all submodules):')
+    for name, us in sorted(packages.items(), key=lambda p: -p[1])[:limit]:
+        click.echo('  %8.1f ms  %s' % (us / 1000, name))
+    click.echo('\nSlowest imports (cumulative):')
+    for us, name in sorted(imports, reverse=True)[:limit]:
+        click.echo('  %8.1f ms  %s' % (us / 1000, name))
+
+
 @app.cli.command()
 def deploy():
 
@@ -74,13 +144,146 @@ def deploy():
     Role.insert_roles()
 
     # ensure all users are following their own posts
-    User.add_self_follows()
+    from app import jobs
+    jobs.enqueue('add_self_follows')
+
+    # make sure upcoming months have a user log partition
+    from app import partitions
+    if partitions.is_partitioned('user_logs'):
+        partitions.create_partitions(
+            'user_logs', app.config['FLASKY_LOG_PARTITIONS_AHEAD'])
+
+    # fingerprinted static files and compiled templates for the new workers
+    from app import assets
+    assets.build_assets(app.static_folder)
+    if app.config['FLASKY_TEMPLATE_CACHE_DIR']:
+        from app import templating
+        templating.compile_templates(app)
+
+    # score posts created before the hot feed existed
+    from app import trending
+    trending.rebuild_hot_scores(missing_only=True)
+
+
+@app.cli.command('create-shards')
+def create_shards():
+    """Create the post and comment tables on the FLASKY_SHARD_URLS."""
+    sharding = app.extensions['sharding']
+    if not sharding.enabled:
+        click.echo('FLASKY_SHARD_URLS is not set.')
+        sys.exit(1)
+    sharding.create_all()
+    click.echo('Created the tables on %d shards.' % sharding.count)
+
+
+@app.cli.command('move-to-shards')
+@click.option('--chunk-size', default=1000, type=int,
+              help='Number of posts moved per transaction.')
+def move_to_shards(chunk_size):
+    """Move the posts and comments of the primary database to the shards."""
+    sharding = app.extensions['sharding']
+    if not sharding.enabled:
+        click.echo('FLASKY_SHARD_URLS is not set.')
+        sys.exit(1)
+    posts, comments = sharding.move_from_primary(chunk_size)
+    click.echo('Moved %d posts and %d comments, restart the web and job '
+               'processes.' % (posts, comments))
+
+
+@app.cli.command('partition-logs')
+@click.option('--months-ahead', default=None, type=int,
+              help='Number of future monthly partitions to create.')
+def partition_logs(months_ahead):
+    """Create the upcoming monthly user log partitions."""
+    from app import partitions
+    if not partitions.is_partitioned('user_logs'):
+        click.echo('user_logs is not a partitioned table.')
+        sys.exit(1)
+    if months_ahead is None:
+        months_ahead = app.config['FLASKY_LOG_PARTITIONS_AHEAD']
+    for name in partitions.create_partitions('user_logs', months_ahead):
+        click.echo('Created %s' % name)
+
+
+@app.cli.command('prune-logs')
+@click.option('--keep-months', default=None, type=int,
+              help='Number of months of logs to keep.')
+@click.option('--archive-dir', default=None,
+              help='Directory where expired partitions are archived.')
+@click.option('--dry-run', is_flag=True,
+              help='Only list the partitions that would be removed.')
+def prune_logs(keep_months, archive_dir, dry_run):
+    """Archive and drop user log partitions past the retention period."""
+    from app import partitions
+    if not partitions.is_partitioned('user_logs'):
+        click.echo('user_logs is not a partitioned table.')
+        sys.exit(1)
+    if keep_months is None:
+        keep_months = app.config['FLASKY_LOG_RETENTION_MONTHS']
+    archive_dir = archive_dir or app.config['FLASKY_LOG_ARCHIVE_DIR']
+    expired = partitions.expire_partitions('user_logs', keep_months,
+                                           archive_dir=archive_dir,
+                                           dry_run=dry_run)
+    for name, path in expired:
+        if dry_run:
+            click.echo('Would drop %s' % name)
+        elif path:
+            click.echo('Archived %s to %s' % (name, path))
+        else:
+            click.echo('Dropped %s' % name)
+
+
+@app.cli.command('archive-posts')
+@click.option('--older-than', default=None, type=int,
+              help='Archive threads without activity for this many days.')
+@click.option('--dry-run', is_flag=True,
+              help='Only count the posts that would be archived.')
+def archive_posts(older_than, dry_run):
+    """Move quiet posts and their comments to archive segment files."""
+    from datetime import datetime, timedelta
+    from app import archive
+    if app.extensions['sharding'].enabled:
+        click.echo('Archiving sharded posts is not supported.')
+        sys.exit(1)
+    if older_than is None:
+        older_than = app.config['FLASKY_ARCHIVE_AFTER_DAYS']
+    before = datetime.utcnow() - timedelta(days=older_than)
+    if dry_run:
+        click.echo('Would archive %d posts.' % archive.count_cold_posts(before))
+        return
+    for path, posts, comments in archive.archive_posts(before):
+        click.echo('Archived %d posts and %d comments to %s'
+                   % (posts, comments, path))
+
+
+@app.cli.command('rebuild-hot-scores')
+def rebuild_hot_scores():
+    """Recompute the hot feed score of every post."""
+    from app import trending
+    count = trending.rebuild_hot_scores()
+    click.echo('Hot scores rebuilt for %d posts.' % count)
+
+
+@app.cli.command('recompute-suggestions')
+@click.option('--full/--incremental', default=False,
+              help='Rescore every user instead of only those whose follows '
+                   'changed.')
+@click.option('--batch-size', default=None, type=int,
+              help='Number of users scored per batch.')
+@click.option('--limit', default=None, type=int,
+              help='Number of suggestions kept per user.')
+def recompute_suggestions(full, batch_size, limit):
+    """Recompute the who-to-follow suggestions."""
+    from app import suggestions
+    count = suggestions.recompute_suggestions(
+        full=full, batch_size=batch_size, limit=limit, echo=click.echo)
+    click.echo('Suggestions updated for %d users.' % count)
     
 @app.cli.command()
 def forge():
     """Generate fake data (dev only)."""
     from app.models import User, Post, Comment, Role
-    from app import db
+    from app import db, jobs
     import click
     
     db.create_all()
@@ -89,20 +292,56 @@ def forge():
         click.echo('Inserting roles...')
         Role.insert_roles()
 
+    counts = {}
     if User.query.count() == 0:
-        click.echo('Generating users...')
-        User.generate_fake(10)
-
+        counts['users'] = 10
     if Post.query.count() == 0:
-        click.echo('Generating posts...')
-        Post.generate_fake(50)
-
+        counts['posts'] = 50
     if Comment.query.count() == 0:
-        click.echo('Generating comments...')
-        Comment.generate_fake_comments(100)
-
+        counts['comments'] = 100
     if UserLog.query.count() == 0:
-        click.echo('Generating user logs...')
-        UserLog.generate_fake_logs(100)
+        counts['logs'] = 100
+
+    if counts:
+        click.echo('Generating %s...' % ', '.join(counts))
+        jobs.enqueue('generate_fake', **counts)
+
+    click.echo('Done.')
+
+
+@app.cli.command(context_settings={'ignore_unknown_options': True})
+@click.argument('celery_args', nargs=-1, type=click.UNPROCESSED)
+def worker(celery_args):
+    """Run a background job worker (extra options go to celery worker)."""
+    from app import jobs
+    celery = jobs.get_celery(app)
+    if celery.conf.task_always_eager:
+        click.echo('CELERY_BROKER_URL is not set, jobs run eagerly.')
+        sys.exit(1)
+    celery.worker_main(['worker', '--loglevel=INFO'] + list(celery_args))
+
 
-    click.echo('Done.')
\ No newline at end of file
+@app.cli.command('jobs-stats')
+@click.option('--json', 'as_json', is_flag=True,
+              help='Print the statistics as JSON.')
+def jobs_stats(as_json):
+    """Show job queue depth and per-task latency."""
+    import json
+    from app import jobs
+    stats = jobs.job_stats(jobs.get_celery(app))
+    if as_json:
+        click.echo(json.dumps(stats, indent=2))
+        return
+    if stats['eager']:
+        click.echo('Jobs run eagerly, there is no queue.')
+    for queue, depth in stats['queues'].items():
+        click.echo('Queue %s: %d waiting' % (queue, depth))
+    if not stats['workers']:
+        click.echo('No workers replied.')
+    for worker, tasks in stats['workers'].items():
+        click.echo(worker)
+        for name, t in sorted(tasks.items()):
+            wait = '-' if t['avg_wait'] is None else '%.3fs' % t['avg_wait']
+            click.echo('  %-32s %6d runs %4d failed  run %.3fs (max %.3fs)  '
+                       'wait %s' % (name, t['count'], t['failed'],
+                                    t['avg_runtime'], t['max_runtime'], wait))
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The app is imported once in the master and the workers are forked from
+# it. Every worker gets its own SQLAlchemy pool of DB_POOL_SIZE connections
+# (plus DB_MAX_OVERFLOW in bursts), so threads per worker follow the pool
+# size (plus one thread per live update stream) and the number of workers
+# is capped by what the database accepts.
+
+pool_size = int(os.getenv('DB_POOL_SIZE', '5'))
+max_overflow = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+db_max_connections = int(os.getenv('DB_MAX_CONNECTIONS', '100'))
+# live update streams hold a thread each but no database connection
+live_streams = int(os.getenv('LIVE_MAX_STREAMS', '20'))
+
+
+def default_workers():
+    by_cpu = multiprocessing.cpu_count() * 2 + 1
+    by_db = db_max_connections // (pool_size + max_overflow)
+    return max(1, min(by_cpu, by_db))
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:%s' % os.getenv('PORT', '8000'))
+workers = int(os.getenv('GUNICORN_WORKERS', default_workers()))
+threads = int(os.getenv('GUNICORN_THREADS', pool_size + live_streams))
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in \
+    ['true', 'on', '1']
+# render the hot templates once before accepting traffic
+warm_up = os.getenv('GUNICORN_WARM_UP', 'true').lower() in ['true', 'on', '1']
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+# heartbeat files on tmpfs, a disk-backed /tmp can block workers
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# needed to find the master for a zero-downtime reload (see README)
+pidfile = os.getenv('GUNICORN_PIDFILE', '/tmp/flasky-gunicorn.pid') or None
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master while preloading would otherwise be
+    # shared by every worker. close=False leaves them open for the parent
+    # and only drops this process's references.
+    if not server.cfg.preload_app:
+        return
+    from app import db
+    with worker.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+
+def when_ready(server):
+    # with preload the master warms up once and the workers inherit it
+    if warm_up and server.cfg.preload_app:
+        from app import templating
+        templating.warm_up(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    if warm_up and not worker.cfg.preload_app:
+        from app import templating
+        templating.warm_up(worker.wsgi)
+    worker.wsgi.extensions['pool_monitor'].start_watcher()
+
+
+def on_starting(server):
+    server.log.info('Starting %d %s workers with %d threads each',
+                    workers, worker_class, threads)
+    if server.cfg.preload_app:
+        # the warm-up checks out connections in the master, its leak
+        # watcher would be forked into the workers mid-lock
+        server.app.wsgi().extensions['pool_monitor'].autostart = False
@@ -0,0 +1,28 @@
+"""add token_generation to users
+
+Revision ID: 375ad0ab7e66
+Revises: e4e3d3a8a5f9
+Create Date: 2026-10-19 17:40:12.904213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '375ad0ab7e66'
+down_revision = 'e4e3d3a8a5f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tokens issued before this carry no generation and stop working
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_generation', sa.Integer(),
+                                      server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('token_generation')
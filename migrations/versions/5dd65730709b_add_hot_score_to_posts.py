@@ -0,0 +1,29 @@
+"""add hot_score to posts
+
+Revision ID: 5dd65730709b
+Revises: f62675da7a60
+Create Date: 2026-10-19 10:03:27.904115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5dd65730709b'
+down_revision = 'f62675da7a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing posts are scored by `flask deploy` / `flask rebuild-hot-scores`
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hot_score', sa.Float(), nullable=True))
+        batch_op.create_index('ix_posts_hot_score', ['hot_score', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_hot_score')
+        batch_op.drop_column('hot_score')
@@ -0,0 +1,45 @@
+"""add archive tables
+
+Revision ID: 8c1f5e2a9d47
+Revises: 375ad0ab7e66
+Create Date: 2026-10-19 19:02:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1f5e2a9d47'
+down_revision = '375ad0ab7e66'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archive_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('month', sa.DateTime(), nullable=False),
+    sa.Column('posts', sa.Integer(), nullable=False),
+    sa.Column('comments', sa.Integer(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('archived_posts',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('segment_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['segment_id'], ['archive_segments.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archived_posts', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_archived_posts_segment_id'), ['segment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('archived_posts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_archived_posts_segment_id'))
+
+    op.drop_table('archived_posts')
+    op.drop_table('archive_segments')
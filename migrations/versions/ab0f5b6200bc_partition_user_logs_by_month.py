@@ -0,0 +1,107 @@
+"""partition user_logs by month
+
+Revision ID: ab0f5b6200bc
+Revises: 5dd65730709b
+Create Date: 2026-10-19 11:26:05.381942
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ab0f5b6200bc'
+down_revision = '5dd65730709b'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def _month(d, months=0):
+    index = d.year * 12 + d.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    op.execute('UPDATE user_logs SET timestamp = CURRENT_TIMESTAMP '
+               'WHERE timestamp IS NULL')
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('user_logs', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(),
+                                  nullable=False)
+            batch_op.create_index('ix_user_logs_user_id_timestamp',
+                                  ['user_id', 'timestamp', 'id'], unique=False)
+            batch_op.create_index('ix_user_logs_timestamp_id',
+                                  ['timestamp', 'id'], unique=False)
+        return
+
+    # the partition key has to be part of the primary key, so the table is
+    # rebuilt as a partitioned table and the rows are copied over
+    op.execute('ALTER TABLE user_logs RENAME TO user_logs_legacy')
+    op.execute('ALTER TABLE user_logs_legacy '
+               'RENAME CONSTRAINT user_logs_pkey TO user_logs_legacy_pkey')
+    op.execute("""
+        CREATE TABLE user_logs (
+            id INTEGER NOT NULL DEFAULT nextval('user_logs_id_seq'),
+            user_id INTEGER REFERENCES users (id),
+            action VARCHAR(20),
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            ip VARCHAR(64),
+            CONSTRAINT user_logs_pkey PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)""")
+    op.execute('ALTER SEQUENCE user_logs_id_seq OWNED BY user_logs.id')
+    op.execute('CREATE TABLE user_logs_default PARTITION OF user_logs DEFAULT')
+
+    first = bind.execute(
+        sa.text('SELECT min(timestamp) FROM user_logs_legacy')).scalar()
+    month = _month(first or datetime.utcnow())
+    last = _month(datetime.utcnow(), MONTHS_AHEAD)
+    while month <= last:
+        op.execute("CREATE TABLE user_logs_%04d_%02d PARTITION OF user_logs "
+                   "FOR VALUES FROM ('%s') TO ('%s')" % (
+                       month.year, month.month, month.strftime('%Y-%m-%d'),
+                       _month(month, 1).strftime('%Y-%m-%d')))
+        month = _month(month, 1)
+
+    op.execute('CREATE INDEX ix_user_logs_user_id_timestamp '
+               'ON user_logs (user_id, timestamp, id)')
+    op.execute('CREATE INDEX ix_user_logs_timestamp_id '
+               'ON user_logs (timestamp, id)')
+    op.execute('INSERT INTO user_logs (id, user_id, action, timestamp, ip) '
+               'SELECT id, user_id, action, timestamp, ip '
+               'FROM user_logs_legacy')
+    op.execute('DROP TABLE user_logs_legacy')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('user_logs', schema=None) as batch_op:
+            batch_op.drop_index('ix_user_logs_timestamp_id')
+            batch_op.drop_index('ix_user_logs_user_id_timestamp')
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(),
+                                  nullable=True)
+        return
+
+    op.execute('ALTER TABLE user_logs RENAME TO user_logs_partitioned')
+    op.execute('ALTER TABLE user_logs_partitioned '
+               'RENAME CONSTRAINT user_logs_pkey TO user_logs_partitioned_pkey')
+    op.create_table('user_logs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('action', sa.String(length=20), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('ip', sa.String(length=64), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER TABLE user_logs "
+               "ALTER COLUMN id SET DEFAULT nextval('user_logs_id_seq')")
+    op.execute('ALTER SEQUENCE user_logs_id_seq OWNED BY user_logs.id')
+    op.execute('INSERT INTO user_logs (id, user_id, action, timestamp, ip) '
+               'SELECT id, user_id, action, timestamp, ip '
+               'FROM user_logs_partitioned')
+    op.execute('DROP TABLE user_logs_partitioned CASCADE')
@@ -0,0 +1,35 @@
+"""add comment moderation indexes
+
+Revision ID: c56a535c5580
+Revises: ab0f5b6200bc
+Create Date: 2026-10-19 13:40:52.117730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c56a535c5580'
+down_revision = 'ab0f5b6200bc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_moderation', ['timestamp', 'id'],
+                              unique=False,
+                              postgresql_where=sa.text('disabled IS NOT false'),
+                              sqlite_where=sa.text('disabled IS NOT 0'))
+        batch_op.create_index('ix_comments_author_id_timestamp',
+                              ['author_id', 'timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_comments_post_id_timestamp',
+                              ['post_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_post_id_timestamp')
+        batch_op.drop_index('ix_comments_author_id_timestamp')
+        batch_op.drop_index('ix_comments_moderation')
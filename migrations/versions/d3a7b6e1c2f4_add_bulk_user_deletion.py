@@ -0,0 +1,83 @@
+"""add users.disabled, deletion jobs and ON DELETE rules
+
+Revision ID: d3a7b6e1c2f4
+Revises: 8c1f5e2a9d47
+Create Date: 2026-10-19 20:14:52.630817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7b6e1c2f4'
+down_revision = '8c1f5e2a9d47'
+branch_labels = None
+depends_on = None
+
+# (table, column, referenced table, ON DELETE)
+FOREIGN_KEYS = [
+    ('posts', 'author_id', 'users', 'CASCADE'),
+    ('comments', 'author_id', 'users', 'CASCADE'),
+    ('comments', 'post_id', 'posts', 'CASCADE'),
+    ('follows', 'follower_id', 'users', 'CASCADE'),
+    ('follows', 'followed_id', 'users', 'CASCADE'),
+    ('user_logs', 'user_id', 'users', 'SET NULL'),
+]
+
+
+def _replace_foreign_keys(ondelete):
+    # SQLite does not enforce them unless asked to and its constraints have
+    # no names to drop them by, the deletion job deletes the rows itself
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    inspector = sa.inspect(bind)
+    for table, column, referred, rule in FOREIGN_KEYS:
+        for fk in inspector.get_foreign_keys(table):
+            if fk['constrained_columns'] == [column]:
+                op.drop_constraint(fk['name'], table, type_='foreignkey')
+        # on the partitioned user_logs the constraint goes to every partition
+        op.create_foreign_key('%s_%s_fkey' % (table, column), table, referred,
+                              [column], ['id'],
+                              ondelete=rule if ondelete else None)
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('disabled', sa.Boolean(),
+                                      server_default=sa.false(),
+                                      nullable=False))
+    op.create_table('deletion_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('requested_by_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('done', sa.Integer(), nullable=False),
+    sa.Column('rows', sa.BigInteger(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('finished', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['requested_by_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('pending_deletions',
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['deletion_jobs.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('job_id', 'user_id')
+    )
+    with op.batch_alter_table('pending_deletions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_pending_deletions_user_id'), ['user_id'], unique=False)
+    _replace_foreign_keys(ondelete=True)
+
+
+def downgrade():
+    _replace_foreign_keys(ondelete=False)
+    with op.batch_alter_table('pending_deletions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_pending_deletions_user_id'))
+    op.drop_table('pending_deletions')
+    op.drop_table('deletion_jobs')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('disabled')
@@ -0,0 +1,42 @@
+"""add seek pagination indexes
+
+Revision ID: e4e3d3a8a5f9
+Revises: c56a535c5580
+Create Date: 2026-10-19 15:12:04.381527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4e3d3a8a5f9'
+down_revision = 'c56a535c5580'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_timestamp_id', ['timestamp', 'id'],
+                              unique=False)
+        batch_op.create_index('ix_posts_author_id_timestamp',
+                              ['author_id', 'timestamp', 'id'], unique=False)
+
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.create_index('ix_follows_followed_id_timestamp',
+                              ['followed_id', 'timestamp', 'follower_id'],
+                              unique=False)
+        batch_op.create_index('ix_follows_follower_id_timestamp',
+                              ['follower_id', 'timestamp', 'followed_id'],
+                              unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.drop_index('ix_follows_follower_id_timestamp')
+        batch_op.drop_index('ix_follows_followed_id_timestamp')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_author_id_timestamp')
+        batch_op.drop_index('ix_posts_timestamp_id')
@@ -0,0 +1,39 @@
+"""add suggestion tables
+
+Revision ID: f62675da7a60
+Revises: ae66feffc28e
+Create Date: 2026-10-19 09:12:41.513207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f62675da7a60'
+down_revision = 'ae66feffc28e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('suggestions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('suggested_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['suggested_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'suggested_id')
+    )
+    op.create_table('suggestion_refreshes',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('suggestion_refreshes')
+    op.drop_table('suggestions')
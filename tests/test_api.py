@@ -1,9 +1,10 @@
 import unittest
 import json
 import re
+from datetime import datetime, timedelta
 from base64 import b64encode
 from app import create_app, db
-from app.models import User, Role, Post, Comment
+from app.models import User, Role, Post, Comment, Permission
 
 
 class APITestCase(unittest.TestCase):
@@ -86,6 +87,64 @@ class APITestCase(unittest.TestCase):
             headers=self.get_api_headers(token, ''))
         self.assertEqual(response.status_code, 200)
 
+    def test_stateless_tokens(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.post(
+            '/api/v1/tokens/',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.get_data(as_text=True))['token']
+
+        # once the generation is cached the token is checked without queries
+        self.assertIsNotNone(User.verify_auth_token(token))
+        statements = []
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            user = User.verify_auth_token(token)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(statements, [])
+        self.assertEqual(user.id, u.id)
+        self.assertTrue(user.confirmed)
+        self.assertTrue(user.can(Permission.WRITE))
+        self.assertFalse(user.can(Permission.MODERATE))
+
+        # write with the token
+        response = self.client.post(
+            '/api/v1/posts/',
+            headers=self.get_api_headers(token, ''),
+            data=json.dumps({'body': 'posted with a token'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.one().author_id, u.id)
+
+        # tokens expire
+        expired = u.generate_auth_token(expiration=-1)
+        self.assertIsNone(User.verify_auth_token(expired))
+
+        # and are revoked together
+        response = self.client.delete(
+            '/api/v1/tokens/', headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(
+            '/api/v1/posts/', headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
+        # a new password revokes them too
+        db.session.refresh(u)
+        token = u.generate_auth_token()
+        self.assertIsNotNone(User.verify_auth_token(token))
+        u.password = 'dog'
+        db.session.commit()
+        self.assertIsNone(User.verify_auth_token(token))
+
     def test_anonymous(self):
         response = self.client.get(
             '/api/v1/posts/',
@@ -269,3 +328,152 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_hot_posts(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john',
+                 password='cat', confirmed=True, role=r)
+        db.session.add(u)
+        db.session.commit()
+
+        # the older post gets a burst of recent comments
+        now = datetime.utcnow()
+        old = Post(body='old post', author=u,
+                   timestamp=now - timedelta(days=2))
+        new = Post(body='new post', author=u, timestamp=now)
+        db.session.add_all([old, new])
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Comment(body='comment', author=u, post=old,
+                                   timestamp=now))
+        db.session.commit()
+
+        response = self.client.get(
+            '/api/v1/posts/?sort=hot',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([p['body'] for p in json_response['posts']],
+                         ['old post', 'new post'])
+
+        response = self.client.get(
+            '/api/v1/posts/?sort=bogus',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_fields_and_embed(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john',
+                 password='cat', confirmed=True, role=r)
+        p = Post(body='a post', author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        db.session.add_all([Comment(body='one', author=u, post=p),
+                            Comment(body='two', author=u, post=p)])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        response = self.client.get(
+            '/api/v1/posts/?fields=body,timestamp&embed=author,comment_count',
+            headers=headers)
+        self.assertEqual(response.status_code, 200)
+        post = response.get_json()['posts'][0]
+        self.assertEqual(sorted(post),
+                         ['author', 'body', 'comment_count', 'timestamp'])
+        self.assertEqual(post['comment_count'], 2)
+        self.assertEqual(post['author']['username'], 'john')
+        self.assertTrue(post['author']['url'].endswith(
+            '/api/v1/users/%d' % u.id))
+
+        response = self.client.get(
+            '/api/v1/posts/%d/comments/?fields=body&embed=author' % p.id,
+            headers=headers)
+        comments = response.get_json()['comments']
+        self.assertEqual([c['body'] for c in comments], ['one', 'two'])
+        self.assertEqual(comments[0]['author']['username'], 'john')
+
+        # the default representation is unchanged
+        response = self.client.get('/api/v1/posts/%d' % p.id,
+                                   headers=headers)
+        self.assertEqual(sorted(response.get_json()), [
+            'author_url', 'body', 'body_html', 'comment_count',
+            'comments_url', 'timestamp', 'url'])
+        self.assertEqual(response.get_json()['comment_count'], 2)
+
+        response = self.client.get('/api/v1/posts/?fields=body,secret',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['message'],
+                         'unknown fields: secret')
+
+    def test_batched_query(self):
+        from sqlalchemy import event
+        r = Role.query.filter_by(name='User').first()
+        john = User(email='john@example.com', username='john',
+                    password='cat', confirmed=True, role=r)
+        susan = User(email='susan@example.com', username='susan',
+                     password='dog', confirmed=True, role=r)
+        db.session.add_all([john, susan])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        query = {'posts': {
+            'limit': 10, 'fields': ['body'],
+            'author': {'fields': ['username']},
+            'comments': {'limit': 2, 'fields': ['body'],
+                         'author': {'fields': ['username', 'post_count']}}}}
+
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        def run(posts):
+            for i in range(posts):
+                p = Post(body='post %d' % i, author=[john, susan][i % 2],
+                         timestamp=datetime(2026, 1, 1 + i))
+                db.session.add(p)
+                db.session.add_all([
+                    Comment(body='c%d-%d' % (i, j), post=p,
+                            author=[susan, john][j % 2],
+                            timestamp=datetime(2026, 2, 1 + j))
+                    for j in range(3)])
+            db.session.commit()
+            del statements[:]
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                response = self.client.post('/api/v1/query', headers=headers,
+                                            data=json.dumps(query))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            self.assertEqual(response.status_code, 200)
+            return response.get_json(), len(statements)
+
+        result, queries = run(2)
+        posts = result['data']['posts']
+        self.assertEqual([p['body'] for p in posts], ['post 1', 'post 0'])
+        self.assertEqual(posts[0]['author'], {'username': 'susan'})
+        # the two newest comments of each post
+        self.assertEqual([c['body'] for c in posts[0]['comments']],
+                         ['c1-2', 'c1-1'])
+        self.assertEqual(posts[0]['comments'][0]['author'],
+                         {'username': 'susan', 'post_count': 1})
+        self.assertEqual(result['cost'], 10 + 10 + 20 + 20)
+
+        # one query per level and type, however many rows come back
+        result, more_queries = run(4)
+        self.assertEqual(len(result['data']['posts']), 6)
+        self.assertEqual(queries, more_queries)
+
+        response = self.client.post('/api/v1/query', headers=headers,
+                                    data=json.dumps({'post': {'id': 0}}))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/query', headers=headers,
+                                    data=json.dumps({'user': {
+                                        'id': john.id, 'password': {}}}))
+        self.assertEqual(response.get_json()['message'],
+                         'user: unknown fields: password')
+        deep = {'users': {'limit': 50, 'posts': {'limit': 50, 'comments': {}}}}
+        response = self.client.post('/api/v1/query', headers=headers,
+                                    data=json.dumps(deep))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('query cost', response.get_json()['message'])
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app import create_app, db, archive
+from app.models import User, Role, Post, Comment, ArchivedPost
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.archive_dir = tempfile.mkdtemp()
+        self.app.config['FLASKY_ARCHIVE_DIR'] = self.archive_dir
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.archive_dir)
+
+    def add_post(self, body, timestamp, comments=()):
+        post = Post(body=body, author=self.user, timestamp=timestamp)
+        db.session.add(post)
+        for i, ts in enumerate(comments):
+            db.session.add(Comment(body='%s comment %d' % (body, i),
+                                   post=post, author=self.user,
+                                   timestamp=ts))
+        db.session.commit()
+        return post.id
+
+    def test_archive(self):
+        now = datetime.utcnow()
+        old = now - timedelta(days=400)
+        quiet = self.add_post('quiet', old,
+                              [old + timedelta(minutes=i) for i in range(300)])
+        busy = self.add_post('busy', old, [now])
+        recent = self.add_post('recent', now)
+        other = self.add_post('other', old - timedelta(days=40))
+        self.assertEqual(archive.count_cold_posts(now - timedelta(days=365)),
+                         2)
+
+        written = archive.archive_posts(now - timedelta(days=365),
+                                        chunk_size=10)
+        # one segment per month
+        self.assertEqual([(posts, comments) for path, posts, comments
+                          in written], [(1, 0), (1, 300)])
+        for path, posts, comments in written:
+            self.assertTrue(os.path.exists(path))
+        self.assertIsNone(db.session.get(Post, quiet))
+        self.assertEqual(Comment.query.filter_by(post_id=quiet).count(), 0)
+        self.assertEqual(ArchivedPost.query.count(), 2)
+        self.assertIsNotNone(db.session.get(Post, busy))
+        self.assertIsNotNone(db.session.get(Post, recent))
+
+        post = archive.load_post(quiet)
+        self.assertEqual(post.body, 'quiet')
+        self.assertEqual(post.timestamp, old)
+        self.assertEqual(post.author.username, 'john')
+        self.assertEqual([c.body for c in post.comments],
+                         ['quiet comment %d' % i for i in range(300)])
+        self.assertEqual(archive.load_post(other).comments, [])
+        self.assertIsNone(archive.load_post(busy))
+
+        client = self.app.test_client()
+        response = client.get('/post/%d' % quiet)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('quiet comment 299', data)
+        self.assertIn('archived', data)
+        self.assertIn('archive;dur=', response.headers['Server-Timing'])
+        response = client.get('/post/%d' % busy)
+        self.assertNotIn('Server-Timing', response.headers)
+
+        headers = {'Authorization': 'Basic ' + b64encode(
+            b'john@example.com:cat').decode('utf-8'),
+                   'Accept': 'application/json'}
+        response = client.get('/api/v1/posts/%d' % quiet, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['body'], 'quiet')
+        self.assertEqual(response.get_json()['comment_count'], 300)
+
+    def test_comment_during_archive(self):
+        now = datetime.utcnow()
+        old = now - timedelta(days=400)
+        quiet = self.add_post('quiet', old, [old])
+        other = self.add_post('other', old, [old])
+        comments = Comment.__table__
+        added = []
+
+        def comment(conn, cursor, statement, *args):
+            # a comment arriving between the posts query and the comments
+            # query, from the same connection as the other transaction
+            # would wait for the lock
+            if not added and 'FROM posts' in statement and \
+                    'ORDER BY posts.id' in statement:
+                added.append(True)
+                conn.execute(insert(comments).values(
+                    body='late', timestamp=now, author_id=self.user.id,
+                    post_id=quiet))
+
+        event.listen(db.engine, 'after_cursor_execute', comment)
+        try:
+            written = archive.archive_posts(now - timedelta(days=365))
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', comment)
+        self.assertEqual([(posts, comments) for path, posts, comments
+                          in written], [(1, 1)])
+        self.assertIsNone(db.session.get(Post, other))
+        self.assertIsNotNone(db.session.get(Post, quiet))
+        self.assertEqual(sorted(c.body for c in
+                                Comment.query.filter_by(post_id=quiet)),
+                         ['late', 'quiet comment 0'])
@@ -0,0 +1,83 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from flask import url_for
+from app import create_app
+from app.assets import Assets, build_assets, minify_css, minify_js
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.mkdtemp()
+        self.css = '/* header */\n' + '\n'.join(
+            'div.c%d > p,\nspan {\n    margin: 0px;\n}' % i for i in range(40))
+        with open(os.path.join(self.static, 'styles.css'), 'w') as f:
+            f.write(self.css)
+        os.mkdir(os.path.join(self.static, 'img'))
+        with open(os.path.join(self.static, 'img', 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        self.app = create_app('testing')
+        self.app.static_folder = self.static
+
+    def tearDown(self):
+        shutil.rmtree(self.static)
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css('/* x */ a:hover ,\n b > i {\n  color: red;\n}'),
+                         'a:hover,b>i{color: red}')
+
+    def test_minify_js(self):
+        self.assertEqual(minify_js(
+            '// notice\nvar a = b / 2;  /* half */\n\n'
+            '    var s = "x // y" + \'/* z */\';\n'
+            '    return /[/]\\/ x/.test(s)\n'),
+            'var a = b / 2;\nvar s = "x // y" + \'/* z */\';\n'
+            'return /[/]\\/ x/.test(s)\n')
+        # a comment spanning lines still ends the statement
+        self.assertEqual(minify_js('a = 1 /* multi\nline */ b = 2\n'),
+                         'a = 1\nb = 2\n')
+        # after a postfix operator / divides
+        self.assertEqual(minify_js('x = i++ / 2; y = j-- / 3 // note\n'),
+                         'x = i++ / 2; y = j-- / 3\n')
+
+    def test_build_and_serve(self):
+        manifest = build_assets(self.static)
+        hashed = manifest['styles.css']
+        self.assertRegex(hashed, r'^dist/styles\.[0-9a-f]{12}\.css$')
+        self.assertRegex(manifest['img/logo.png'],
+                         r'^dist/img/logo\.[0-9a-f]{12}\.png$')
+        path = os.path.join(self.static, *hashed.split('/'))
+        self.assertTrue(os.path.exists(path + '.gz'))
+        self.assertTrue(os.path.exists(path + '.br'))
+        # rebuilding unchanged files gives the same names
+        self.assertEqual(build_assets(self.static), manifest)
+
+        Assets(self.app)
+        with self.app.test_request_context():
+            self.assertEqual(url_for('static', filename='styles.css'),
+                             '/static/' + hashed)
+            self.assertEqual(url_for('static', filename='other.css'),
+                             '/static/other.css')
+
+        client = self.app.test_client()
+        response = client.get('/static/' + hashed,
+                              headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        minified = gzip.decompress(response.get_data())
+        self.assertEqual(minified, minify_css(self.css).encode('utf-8'))
+        response.close()
+
+        response = client.get('/static/' + hashed,
+                              headers={'Accept-Encoding': 'br, gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        response.close()
+
+        response = client.get('/static/' + hashed)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(), minified)
+        response.close()
@@ -21,4 +21,22 @@ class BasicsTestCase(unittest.TestCase):
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
         
-        
\ No newline at end of file
+        
+
+class APIProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        from config import config
+        config['testing'].FLASKY_APP_PROFILE = 'api'
+        try:
+            self.app = create_app('testing')
+        finally:
+            del config['testing'].FLASKY_APP_PROFILE
+
+    def test_api_only(self):
+        self.assertIn('api', self.app.blueprints)
+        self.assertNotIn('main', self.app.blueprints)
+        self.assertNotIn('auth', self.app.blueprints)
+        self.assertNotIn('bootstrap', self.app.blueprints)
+        response = self.app.test_client().get('/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['error'], 'not found')
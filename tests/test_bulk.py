@@ -0,0 +1,150 @@
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post, Comment, Follow, UserLog, \
+    DeletionJob, PendingDeletion, Suggestion, SuggestionRefresh
+
+
+class BulkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_DELETE_CHUNK'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        admin = Role.query.filter_by(name='Administrator').first()
+        self.admin = User(email='admin@example.com', username='admin',
+                          password='cat', confirmed=True, role=admin)
+        self.users = [User(email='%s@example.com' % name, username=name,
+                           password='cat', confirmed=True)
+                      for name in ('alice', 'bob', 'carol')]
+        db.session.add_all([self.admin] + self.users)
+        db.session.commit()
+        self.client = self.app.test_client()
+        self.client.post('/auth/login', data={'email': 'admin@example.com',
+                                              'password': 'cat'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def ids(self, *names):
+        return [User.query.filter_by(username=name).one().id
+                for name in names]
+
+    def test_disable_and_role(self):
+        alice, bob = self.ids('alice', 'bob')
+        response = self.client.post('/manage', data={
+            'action': 'disable', 'ids': [alice, bob, self.admin.id]})
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual([u.disabled for u in self.users], [True, True, False])
+        self.assertEqual([u.token_generation for u in self.users], [1, 1, 0])
+        # the administrator applying it is left out
+        self.assertFalse(self.admin.disabled)
+
+        client = self.app.test_client()
+        response = client.post('/auth/login', data={
+            'email': 'alice@example.com', 'password': 'cat'})
+        self.assertIn('This account has been disabled.',
+                      response.get_data(as_text=True))
+        response = client.get('/api/v1/posts/', headers={
+            'Authorization': 'Basic ' + b64encode(
+                b'alice@example.com:cat').decode('utf-8'),
+            'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 401)
+
+        # every user matching the search
+        moderator = Role.query.filter_by(name='Moderator').first()
+        self.client.post('/manage?q=bo', data={
+            'action': 'role:%d' % moderator.id, 'everyone': 'y'})
+        self.client.post('/manage', data={'action': 'enable',
+                                          'ids': [alice, bob]})
+        db.session.expire_all()
+        self.assertEqual([u.role.name for u in self.users],
+                         ['User', 'Moderator', 'User'])
+        self.assertEqual([u.disabled for u in self.users],
+                         [False, False, False])
+        self.assertEqual(self.admin.role.name, 'Administrator')
+
+    def test_pending_deletion_left_alone(self):
+        # a user queued for deletion can be neither enabled nor promoted
+        alice, bob = self.ids('alice', 'bob')
+        self.client.post('/manage', data={'action': 'disable',
+                                          'ids': [alice, bob]})
+        job = DeletionJob(total=1)
+        db.session.add(job)
+        db.session.flush()
+        db.session.add(PendingDeletion(job_id=job.id, user_id=alice))
+        db.session.commit()
+        moderator = Role.query.filter_by(name='Moderator').first()
+        response = self.client.post('/manage', data={
+            'action': 'enable', 'ids': [alice, bob]}, follow_redirects=True)
+        self.assertIn('1 users enabled.', response.get_data(as_text=True))
+        self.client.post('/manage', data={
+            'action': 'role:%d' % moderator.id, 'ids': [alice, bob]})
+        db.session.expire_all()
+        self.assertEqual([u.disabled for u in self.users[:2]], [True, False])
+        self.assertEqual([u.role.name for u in self.users[:2]],
+                         ['User', 'Moderator'])
+
+    def test_delete(self):
+        alice, bob, carol = self.users
+        posts = [Post(body='post %d' % i, author=alice) for i in range(5)]
+        db.session.add_all(posts)
+        db.session.add_all([Comment(body='hi', post=post, author=bob)
+                            for post in posts])
+        kept = Post(body='kept', author=bob)
+        db.session.add(kept)
+        db.session.add_all([Comment(body='mine', post=kept, author=alice)
+                            for i in range(3)])
+        log = UserLog(user=alice, action='login')
+        db.session.add_all([Follow(follower=alice, followed=bob),
+                            Follow(follower=carol, followed=alice), log])
+        db.session.flush()
+        db.session.add_all([
+            Suggestion(user_id=alice.id, suggested_id=carol.id, score=1),
+            Suggestion(user_id=bob.id, suggested_id=alice.id, score=1),
+            Suggestion(user_id=bob.id, suggested_id=carol.id, score=1),
+            SuggestionRefresh(user_id=alice.id)])
+        db.session.commit()
+        alice_id, log_id = alice.id, log.id
+
+        response = self.client.post('/manage', data={
+            'action': 'delete', 'ids': [alice_id]})
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        # run eagerly in testing
+        job = DeletionJob.query.one()
+        self.assertEqual((job.status, job.total, job.done), ('finished', 1, 1))
+        # 5 comments on her posts, 3 of hers, 5 posts, 2 follows,
+        # 2 suggestions, 1 refresh, 1 log
+        self.assertEqual(job.rows, 19)
+        self.assertIsNone(db.session.get(User, alice_id))
+        self.assertEqual(PendingDeletion.query.count(), 0)
+        self.assertEqual(Post.query.all(), [kept])
+        self.assertEqual(Comment.query.count(), 0)
+        self.assertEqual(Follow.query.count(), 0)
+        self.assertEqual([(s.user_id, s.suggested_id)
+                          for s in Suggestion.query], [(bob.id, carol.id)])
+        self.assertIsNone(db.session.get(SuggestionRefresh, alice_id))
+        self.assertIsNone(UserLog.query.filter_by(id=log_id).one().user_id)
+
+        response = self.client.get('/manage/deletions/%d' % job.id)
+        self.assertEqual(response.get_json()['status'], 'finished')
+        self.assertIn('finished: 1 of 1 users',
+                      self.client.get('/manage').get_data(as_text=True))
+
+    def test_delete_user(self):
+        bob = self.users[1].id
+        self.assertEqual(self.client.get('/delete_user/%d' % bob).status_code,
+                         405)
+        response = self.client.post('/delete_user/%d' % bob)
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(db.session.get(User, bob))
+        self.assertEqual(self.client.post(
+            '/delete_user/%d' % self.admin.id).status_code, 400)
+        self.assertEqual(self.client.post('/delete_user/%d' % bob)
+                         .status_code, 404)
@@ -1,7 +1,8 @@
 import re
 import unittest
+from datetime import datetime, timedelta
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, Role, UserLog, Post, Comment
 
 class FlaskClientTestCase(unittest.TestCase):
     def setUp(self):
@@ -56,3 +57,152 @@ class FlaskClientTestCase(unittest.TestCase):
         response = self.client.get('/auth/logout', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(b'You have been logged out' in response.data)
+
+    def test_user_logs_pagination(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        admin = User(email='admin@example.com', username='admin',
+                     password='cat', confirmed=True, role=admin_role)
+        db.session.add(admin)
+        db.session.commit()
+        start = datetime(2026, 1, 1)
+        for i in range(30):
+            db.session.add(UserLog(user=admin, ip='10.0.0.%d' % (i % 2),
+                                   action='login',
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+        self.client.post('/auth/login', data={
+            'email': 'admin@example.com',
+            'password': 'cat'
+        })
+
+        # first page holds the login entry plus the 19 newest fake ones
+        response = self.client.get('/logs')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'10.0.0.1', response.data)
+        older = re.search(rb'href="([^"]*after=[^"]*)"', response.data)
+        self.assertIsNotNone(older)
+        response = self.client.get(older.group(1).decode().replace('&amp;', '&'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'2026-01-01 00:00:00', response.data)
+        self.assertNotIn(b'after=', response.data)
+
+        # filters narrow the listing
+        response = self.client.get('/logs?ip=10.0.0.1&action=login')
+        self.assertEqual(response.data.count(b'<td>10.0.0.1</td>'), 15)
+        self.assertNotIn(b'<td>10.0.0.0</td>', response.data)
+        response = self.client.get('/logs?after=garbage')
+        self.assertEqual(response.status_code, 400)
+
+    def test_moderation(self):
+        mod_role = Role.query.filter_by(name='Moderator').first()
+        mod = User(email='mod@example.com', username='mod',
+                   password='cat', confirmed=True, role=mod_role)
+        db.session.add(mod)
+        post = Post(body='a post', author=mod)
+        db.session.add(post)
+        comments = [Comment(body='comment %d' % i, author=mod, post=post)
+                    for i in range(3)]
+        db.session.add_all(comments)
+        db.session.commit()
+        ids = [c.id for c in comments]
+        self.client.post('/auth/login', data={
+            'email': 'mod@example.com',
+            'password': 'cat'
+        })
+
+        # new comments wait in the queue as pending
+        response = self.client.get('/moderate')
+        self.assertEqual(response.data.count(b'Pending review'), 3)
+
+        # bulk disable two of them with a single form post
+        response = self.client.post('/moderate', data={
+            'ids': ids[:2], 'disable': 'Disable selected'},
+            follow_redirects=True)
+        self.assertIn(b'2 comments disabled.', response.data)
+        response = self.client.get('/moderate?status=disabled')
+        self.assertIn(b'comment 0', response.data)
+        self.assertNotIn(b'comment 2', response.data)
+
+        # the JSON endpoint approves without reloading the page
+        response = self.client.post('/moderate/comments', json={
+            'ids': ids, 'action': 'enable'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['updated'], 3)
+        response = self.client.get('/moderate')
+        self.assertNotIn(b'<div class="comment-body">', response.data)
+        response = self.client.get('/moderate?status=approved&author=mod')
+        self.assertEqual(response.data.count(b'<div class="comment-body">'), 3)
+        response = self.client.post('/moderate/comments', json={
+            'ids': 'all', 'action': 'enable'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_comments_jump_to_latest(self):
+        role = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True, role=role)
+        post = Post(body='a post', author=u)
+        start = datetime(2026, 1, 1)
+        db.session.add_all([u, post] + [
+            Comment(body='comment %02d' % i, author=u, post=post,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(35)])
+        db.session.commit()
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+
+        # posting a comment lands on the last page, found without a count
+        response = self.client.post('/post/%d' % post.id,
+                                    data={'body': 'the newest one'})
+        self.assertIn('last=1', response.headers['Location'])
+        response = self.client.get(response.headers['Location'])
+        self.assertIn(b'the newest one', response.data)
+        self.assertIn(b'comment 34', response.data)
+        self.assertNotIn(b'comment 05', response.data)
+        older = re.search(rb'href="([^"]*before=[^"]*)"', response.data)
+        response = self.client.get(older.group(1).decode().replace('&amp;', '&'))
+        self.assertIn(b'comment 00', response.data)
+        self.assertNotIn(b'comment 34', response.data)
+
+        # the first page is the oldest comments
+        response = self.client.get('/post/%d' % post.id)
+        self.assertIn(b'comment 00', response.data)
+        self.assertNotIn(b'the newest one', response.data)
+
+    def test_followed_feed_pages(self):
+        role = Role.query.filter_by(name='User').first()
+        john = User(email='john@example.com', username='john',
+                    password='cat', confirmed=True, role=role)
+        susan = User(email='susan@example.com', username='susan',
+                     password='dog', confirmed=True, role=role)
+        db.session.add_all([john, susan])
+        db.session.commit()
+        john.follow(susan)
+        start = datetime(2026, 1, 1)
+        posts = [Post(body='post %d' % i, author=susan,
+                      timestamp=start + timedelta(minutes=i))
+                 for i in range(5)]
+        db.session.add_all(posts)
+        db.session.add(Post(body='not followed', author=john,
+                            timestamp=start))
+        db.session.commit()
+        self.assertTrue(john.is_following(susan))
+        self.assertFalse(susan.is_following(john))
+        self.assertTrue(susan.is_followed_by(john))
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 2
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        self.client.set_cookie('show_followed', '1')
+
+        seen = []
+        url = '/'
+        while url:
+            data = self.client.get(url).get_data(as_text=True)
+            seen += [int(id) for id in dict.fromkeys(
+                re.findall(r'href="/post/(\d+)"', data))]
+            next = re.search(r'href="(/\?after=[^"]+)"', data)
+            url = next.group(1).replace('&amp;', '&') if next else None
+        self.assertEqual(seen, [p.id for p in reversed(posts)])
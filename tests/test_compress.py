@@ -0,0 +1,73 @@
+import gzip
+import unittest
+import zlib
+import brotli
+import zstandard
+from flask import Response, jsonify
+from app import create_app
+
+
+class CompressTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.items = [{'id': i, 'body': 'comment number %d' % i}
+                      for i in range(100)]
+        self.app.add_url_rule('/_big', 'big',
+                              lambda: jsonify({'items': self.items}))
+        self.app.add_url_rule('/_small', 'small',
+                              lambda: jsonify({'id': 1}))
+        self.app.add_url_rule('/_stream', 'stream', lambda: Response(
+            ('line %d\n' % i for i in range(1000)), mimetype='text/plain'))
+        self.client = self.app.test_client()
+        self.compress = self.app.extensions['compress']
+
+    def get(self, path, accept):
+        return self.client.get(path, headers={'Accept-Encoding': accept})
+
+    def test_negotiation(self):
+        plain = self.client.get('/_big').get_data()
+        self.assertIn('Accept-Encoding', self.client.get('/_big').headers['Vary'])
+
+        response = self.get('/_big', 'gzip, deflate, br, zstd')
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.get_data()), plain)
+
+        response = self.get('/_big', 'gzip;q=1, br;q=0.5, zstd;q=0.8')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.get_data()), plain)
+
+        response = self.get('/_big', 'zstd')
+        self.assertEqual(response.headers['Content-Encoding'], 'zstd')
+        self.assertEqual(zstandard.ZstdDecompressor().decompress(
+            response.get_data()), plain)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.get_data()))
+
+        response = self.get('/_big', 'identity, br;q=0')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        # below the size threshold
+        response = self.get('/_small', 'gzip')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_compressed_once(self):
+        cache = self.compress.cache
+        self.get('/_big', 'gzip')
+        misses = cache.misses
+        for i in range(3):
+            self.get('/_big', 'gzip')
+        self.assertEqual(cache.misses, misses)
+        self.assertGreaterEqual(cache.hits, 3)
+        # a changed body is compressed again
+        self.items.append({'id': 100, 'body': 'new'})
+        self.get('/_big', 'gzip')
+        self.assertEqual(cache.misses, misses + 1)
+
+    def test_streaming(self):
+        expected = ''.join('line %d\n' % i for i in range(1000)).encode()
+        response = self.get('/_stream', 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(zlib.decompress(response.get_data(), 31), expected)
+        response = self.get('/_stream', 'br')
+        self.assertEqual(brotli.decompress(response.get_data()), expected)
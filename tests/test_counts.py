@@ -0,0 +1,69 @@
+import unittest
+from base64 import b64encode
+from sqlalchemy import text
+from app import create_app, db
+from app.counts import count, cached_count
+from app.models import User, Role, Post
+
+
+class CountsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.role = Role.query.filter_by(name='User').first()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True, role=self.role)
+        db.session.add(self.user)
+        db.session.add_all([Post(body='post %d' % i, author=self.user)
+                            for i in range(30)])
+        db.session.commit()
+        self.postgresql = db.engine.dialect.name == 'postgresql'
+        if self.postgresql:
+            db.session.execute(text('ANALYZE posts'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_estimates(self):
+        self.assertEqual(count(Post.query), (30, True))
+        self.app.config['COUNTS_EXACT_BELOW'] = 0
+        total = count(Post.query.order_by(Post.timestamp.desc()))
+        self.assertEqual(total.value, 30)
+        self.assertEqual(total.exact, not self.postgresql)
+        total = count(Post.query.filter(Post.body.like('post 1%')))
+        self.assertEqual(total.exact, not self.postgresql)
+        self.assertEqual(count(Post.query.filter(Post.body.like('post 1%')),
+                               exact=True), (11, True))
+
+    def test_cached_count(self):
+        query = Post.query.filter_by(author_id=self.user.id)
+        self.assertEqual(cached_count(query).value, 30)
+        db.session.add(Post(body='one more', author=self.user))
+        db.session.commit()
+        self.assertEqual(cached_count(query).value, 30)
+        self.assertEqual(cached_count(query, exact=True).value, 31)
+        self.assertEqual(cached_count(query).value, 31)
+
+    def test_api_count(self):
+        self.app.config['COUNTS_EXACT_BELOW'] = 0
+        headers = {'Authorization': 'Basic ' + b64encode(
+            b'john@example.com:cat').decode('utf-8')}
+        response = self.client_get('/api/v1/posts/', headers)
+        self.assertEqual(response['count'], 30)
+        self.assertEqual(response['count_exact'], not self.postgresql)
+        self.assertIn('page=2', response['next'])
+        response = self.client_get('/api/v1/posts/?exact=1&page=2', headers)
+        self.assertEqual(response['count_exact'], True)
+        self.assertIn('exact=1', response['prev'])
+        self.assertIsNone(response['next'])
+        self.assertEqual(len(response['posts']), 10)
+
+    def client_get(self, url, headers):
+        response = self.app.test_client().get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
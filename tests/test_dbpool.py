@@ -0,0 +1,98 @@
+import os
+import time
+import unittest
+from sqlalchemy import text
+from app import create_app, db
+from app.models import User, Role
+
+
+class PoolMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.monitor = self.app.extensions['pool_monitor']
+        if not self.monitor.enabled:
+            self.skipTest('pool statistics need a pooled database')
+        self.monitor.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_checkouts(self):
+        with self.app.test_request_context('/user/john'):
+            db.session.execute(text('SELECT 1'))
+            db.session.remove()
+        first = db.engine.connect()
+        second = db.engine.connect()
+        stats = self.monitor.snapshot()
+        self.assertEqual(stats['checked_out'], 2)
+        self.assertEqual(stats['peak'], 2)
+        first.close()
+        second.close()
+        stats = self.monitor.snapshot()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['checkouts'], 3)
+        self.assertEqual(stats['timeouts'], 0)
+        endpoints = {row[0]: row[1] for row in stats['endpoints']}
+        self.assertEqual(endpoints['main.user'], 1)
+        self.assertEqual(endpoints['(outside a request)'], 2)
+
+        recommendation = self.monitor.recommend(5, 10)
+        self.assertEqual(recommendation['pool_size'], 2)
+        self.assertEqual(recommendation['max_overflow'], 0)
+
+    def test_leaks(self):
+        self.monitor.leak_threshold = 0.05
+        connection = db.engine.connect()
+        try:
+            self.assertEqual(self.monitor.find_leaks(), 0)
+            time.sleep(0.1)
+            with self.assertLogs('app.dbpool', 'WARNING') as logs:
+                self.assertEqual(self.monitor.find_leaks(), 1)
+            self.assertIn('test_leaks', logs.output[0])
+            # reported once
+            self.assertEqual(self.monitor.find_leaks(), 0)
+        finally:
+            connection.close()
+        self.assertEqual(len(self.monitor.snapshot()['leaks']), 1)
+
+    def test_fork(self):
+        self.monitor.autostart = False
+        db.engine.connect().close()
+        self.assertIsNone(self.monitor.watcher_pid)
+        # forked while another thread holds the lock
+        with self.monitor.lock:
+            pid = os.fork()
+            if pid == 0:
+                ok = False
+                try:
+                    ok = self.monitor.lock.acquire(timeout=1)
+                    self.monitor.lock.release()
+                    ok = ok and self.monitor.snapshot()['checkouts'] == 0
+                finally:
+                    os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(self.monitor.snapshot()['checkouts'], 1)
+        self.monitor.leak_threshold = 60
+        self.monitor.start_watcher()
+        self.assertEqual(self.monitor.watcher_pid, os.getpid())
+
+    def test_admin_page(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        db.session.add(User(email='admin@example.com', username='admin',
+                            password='cat', confirmed=True, role=admin_role))
+        db.session.commit()
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'admin@example.com',
+                                         'password': 'cat'})
+        response = client.get('/pool')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('auth.login', data)
+        self.assertIn('DB_POOL_SIZE=', data)
@@ -0,0 +1,76 @@
+import unittest
+from app import create_app, db, jobs
+from app.models import User, Post, Role
+
+
+class JobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.celery = jobs.get_celery(self.app)
+
+    def tearDown(self):
+        self.celery.conf.task_always_eager = True
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_body_rendered_after_commit(self):
+        u = User(email='john@example.com', password='cat')
+        p = Post(body='*hello*', author=u)
+        db.session.add(p)
+        db.session.flush()
+        self.assertIsNone(p.body_html)
+        db.session.commit()
+        self.assertEqual(p.body_html, '<p><em>hello</em></p>')
+
+        # editing clears the stale html until the new render lands
+        p.body = '**bye**'
+        self.assertIsNone(p.body_html)
+        db.session.commit()
+        self.assertEqual(p.body_html, '<p><strong>bye</strong></p>')
+
+        # nothing is rendered for a change that is rolled back
+        p.body = 'rolled back'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(p.body_html, '<p><strong>bye</strong></p>')
+
+    def test_threads_without_broker(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.app.config['JOBS_THREADS'] = 1
+        future = jobs.enqueue('add_self_follows')
+        self.assertTrue(future.result(timeout=10).successful())
+        db.session.expire_all()
+        self.assertTrue(u.is_following(u))
+        # a failure is logged, the request does not see it
+        with self.assertLogs('app.jobs', 'ERROR') as logs:
+            future = jobs.enqueue('render_body_html', 'no such table', 1)
+            self.assertTrue(future.result(timeout=10).failed())
+        self.assertIn('KeyError', logs.output[0])
+
+    def test_task_stats(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        jobs.enqueue('add_self_follows')
+        self.assertTrue(u.is_following(u))
+        stats = jobs.job_stats(self.celery)
+        self.assertTrue(stats['eager'])
+        entry = stats['workers']['local']['app.tasks.add_self_follows']
+        self.assertGreaterEqual(entry['count'], 1)
+        self.assertEqual(entry['failed'], 0)
+
+    def test_queue_depth(self):
+        self.celery.conf.task_always_eager = False
+        jobs.enqueue('add_self_follows')
+        jobs.enqueue('add_self_follows')
+        self.assertEqual(jobs.queue_depth(self.celery), {'celery': 2})
+        with self.celery.connection_for_write() as conn:
+            conn.default_channel.queue_purge('celery')
+        self.assertEqual(jobs.queue_depth(self.celery), {'celery': 0})
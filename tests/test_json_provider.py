@@ -0,0 +1,49 @@
+import json
+import unittest
+from datetime import datetime
+from flask import jsonify, url_for
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from app.json_provider import OrjsonProvider
+from app.urls import external_url
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_same_output_as_default(self):
+        self.assertIsInstance(self.app.json, OrjsonProvider)
+        default = DefaultJSONProvider(self.app)
+        value = {'b': [1, 2.5, None, True], 'a': 'café',
+                 'when': datetime(2026, 10, 19, 12, 30, 5)}
+        self.assertEqual(json.loads(self.app.json.dumps(value)),
+                         json.loads(default.dumps(value)))
+        self.assertEqual(json.loads(self.app.json.dumps(value))['when'],
+                         'Mon, 19 Oct 2026 12:30:05 GMT')
+        self.assertTrue(self.app.json.dumps(value).startswith('{"a":'))
+        # too wide for orjson, handled by the stdlib encoder
+        self.assertEqual(self.app.json.dumps({'n': 2 ** 70}),
+                         '{"n": 1180591620717411303424}')
+        self.assertEqual(self.app.json.loads(b'{"a": [1]}'), {'a': [1]})
+
+    def test_response(self):
+        with self.app.test_request_context():
+            response = jsonify({'id': 1, 'when': datetime(2026, 1, 2)})
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.get_json(),
+                             {'id': 1, 'when': 'Fri, 02 Jan 2026 00:00:00 GMT'})
+
+    def test_external_url(self):
+        with self.app.test_request_context(base_url='https://example.com'):
+            for id in (1, 42, 123456):
+                self.assertEqual(external_url('api.get_post', id),
+                                 url_for('api.get_post', id=id, _external=True))
+                self.assertEqual(
+                    external_url('api.get_post_comments', id),
+                    url_for('api.get_post_comments', id=id, _external=True))
@@ -0,0 +1,118 @@
+import threading
+import time
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.live import Hub, MemoryBackend, Live, RESET
+from app.models import User, Role, Post, Comment
+
+
+class HubTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.live = self.app.extensions['live']
+
+    def listen(self, channels, last_id=None, timeout=0.2):
+        return list(self.live.listen(set(channels), last_id, timeout, 0.05))
+
+    def test_replay_from_last_event_id(self):
+        for i in range(3):
+            self.live.publish('post', ['posts', 'user:%d' % i], {'id': i})
+        first = self.live.hub.events[0][1].id
+        chunks = ''.join(self.listen(['posts'], first))
+        self.assertNotIn('"id":0', chunks)
+        self.assertIn('"id":1', chunks)
+        self.assertIn('"id":2', chunks)
+        # only the channels asked for
+        chunks = ''.join(self.listen(['user:2'], first))
+        self.assertNotIn('"id":1', chunks)
+        self.assertIn('event: post\ndata: {"id":2}', chunks)
+
+    def test_unknown_last_event_id(self):
+        self.live.publish('post', ['posts'], {'id': 1})
+        chunks = self.listen(['posts'], 'elsewhere-1')
+        self.assertEqual(chunks[0], RESET)
+
+    def test_waits_for_new_events(self):
+        timer = threading.Timer(0.05, self.live.publish,
+                                ('comment', ['post:7'], {'id': 3}))
+        timer.start()
+        chunks = self.listen(['post:7'], timeout=0.5)
+        timer.join()
+        self.assertEqual(len([c for c in chunks if 'event: comment' in c]), 1)
+        self.assertIn('keep-alive', chunks[-1])
+
+    def test_slow_listener_is_reset(self):
+        hub = Hub(2)
+        backend = MemoryBackend(hub)
+        backend.publish('post', ['posts'], {})
+        after = hub.sequence
+        for i in range(3):
+            backend.publish('post', ['posts'], {})
+        events = hub.wait(after, 0)
+        self.assertEqual(len(events), 2)
+        self.assertGreater(events[0][0], after + 1)
+
+
+class LiveStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['LIVE_STREAM_TIMEOUT'] = 0.2
+        self.app.config['LIVE_HEARTBEAT'] = 0.05
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.live = self.app.extensions['live']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_committed_posts_and_comments_are_published(self):
+        r = Role.query.filter_by(name='User').first()
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        p = Post(body='a post', author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        c = Comment(body='a comment', author=u, post=p)
+        db.session.add(c)
+        db.session.commit()
+        # rolled back changes are never published
+        db.session.add(Post(body='dropped', author=u))
+        db.session.flush()
+        db.session.rollback()
+
+        events = [e for _, e in self.live.hub.events]
+        self.assertEqual([e.kind for e in events], ['post', 'comment'])
+        self.assertEqual(events[0].channels, ['posts', 'user:%d' % u.id])
+        self.assertEqual(events[1].data, {'id': c.id, 'post_id': p.id,
+                                          'author_id': u.id})
+
+        headers = {'Authorization': 'Basic ' + b64encode(
+            b'john@example.com:cat').decode('utf-8'),
+            'Last-Event-ID': events[0].id}
+        response = self.client.get('/api/v1/events?post=%d' % p.id,
+                                   headers=headers)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith('retry: '))
+        self.assertIn('id: %s\nevent: comment\n' % events[1].id, body)
+        self.assertNotIn('event: post', body)
+
+        response = self.client.get('/api/v1/events', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream_limit(self):
+        for i in range(self.app.config['LIVE_MAX_STREAMS']):
+            self.live.slots.acquire()
+        response = self.client.get('/events?feed=all')
+        self.assertEqual(response.status_code, 503)
+        for i in range(self.app.config['LIVE_MAX_STREAMS']):
+            self.live.slots.release()
+        response = self.client.get('/events?feed=all')
+        self.assertEqual(response.status_code, 200)
+        response.close()
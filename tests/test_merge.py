@@ -0,0 +1,31 @@
+import unittest
+from app import merge
+
+
+class MergeTestCase(unittest.TestCase):
+    def test_top(self):
+        streams = [[(9, 1), (5, 4), (1, 7)], [], [(8, 2), (7, 3), (2, 6)],
+                   [(3, 5)]]
+        self.assertEqual(merge.top(streams, lambda row: row, 3,
+                                   descending=True),
+                         [(9, 1), (8, 2), (7, 3)])
+        self.assertEqual(merge.top(streams, lambda row: row, 3,
+                                   descending=True, offset=5),
+                         [(2, 6), (1, 7)])
+        ascending = [list(reversed(stream)) for stream in streams]
+        self.assertEqual(merge.top(ascending, lambda row: row[0], 2),
+                         [(1, 7), (2, 6)])
+
+    def test_lazy(self):
+        pulled = []
+
+        def stream(name, rows):
+            for row in rows:
+                pulled.append(name)
+                yield row
+
+        rows = merge.top([stream('a', range(0, 1000, 2)),
+                          stream('b', range(1, 1000, 2))],
+                         lambda row: row, 4)
+        self.assertEqual(rows, [0, 1, 2, 3])
+        self.assertLessEqual(len(pulled), 6)
@@ -0,0 +1,105 @@
+import unittest
+from base64 import b64encode
+from werkzeug.security import generate_password_hash
+from app import create_app, db
+from app.exceptions import PasswordCheckBusy
+from app.models import User, Role
+
+
+class PasswordsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.passwords = self.app.extensions['passwords']
+        self.user = User(email='john@example.com', username='john',
+                         confirmed=True)
+        # hashed with older, cheaper parameters
+        self.user.password_hash = generate_password_hash(
+            'cat', 'pbkdf2:sha256:500')
+        db.session.add(self.user)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                ('john@example.com:' + password).encode('utf-8'))
+            .decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def stored_hash(self):
+        db.session.expire_all()
+        return db.session.get(User, self.user.id).password_hash
+
+    def test_hash_and_verify(self):
+        pwhash = self.passwords.hash('dog')
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(self.passwords.needs_rehash(pwhash))
+        self.assertTrue(self.passwords.verify(pwhash, 'dog'))
+        self.assertFalse(self.passwords.verify(pwhash, 'cat'))
+        self.assertFalse(self.passwords.verify(None, 'cat'))
+        self.assertTrue(self.passwords.needs_rehash(
+            generate_password_hash('dog', 'scrypt')))
+
+    def test_rehash_on_login(self):
+        response = self.client.post('/auth/login', data={
+            'email': 'john@example.com', 'password': 'dog'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:500$'))
+        response = self.client.post('/auth/login', data={
+            'email': 'john@example.com', 'password': 'cat'})
+        self.assertEqual(response.status_code, 302)
+        pwhash = self.stored_hash()
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(self.passwords.verify(pwhash, 'cat'))
+
+    def test_rehash_on_api_request(self):
+        response = self.client.get('/api/v1/users/%d' % self.user.id,
+                                   headers=self.get_api_headers('cat'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            self.stored_hash().startswith('pbkdf2:sha256:1000$'))
+
+    def test_busy(self):
+        self.passwords.timeout = 0.01
+        for i in range(self.passwords.workers):
+            self.passwords.slots.acquire()
+        try:
+            with self.assertRaises(PasswordCheckBusy):
+                self.passwords.hash('dog')
+            response = self.client.get('/api/v1/users/%d' % self.user.id,
+                                       headers=self.get_api_headers('cat'))
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+            response = self.client.post('/auth/login', data={
+                'email': 'john@example.com', 'password': 'cat'},
+                follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Too many sign-ins', response.get_data(as_text=True))
+        finally:
+            for i in range(self.passwords.workers):
+                self.passwords.slots.release()
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:500$'))
+
+    def test_busy_rehash(self):
+        # the check got a slot but the rehash does not: the login goes on
+        # with the old hash, replaced on a later login
+        def busy(password):
+            raise PasswordCheckBusy()
+        self.passwords.hash = busy
+        try:
+            response = self.client.post('/auth/login', data={
+                'email': 'john@example.com', 'password': 'cat'})
+            self.assertEqual(response.status_code, 302)
+        finally:
+            del self.passwords.hash
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:500$'))
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role
+from app.ratelimit import MemoryStore, FileStore, parse_rate
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def check_store(self, store):
+        rate, capacity = parse_rate('2/second')
+        self.assertEqual((rate, capacity), (2, 2))
+        self.assertTrue(store.consume('k', rate, capacity, now=100)[0])
+        self.assertTrue(store.consume('k', rate, capacity, now=100)[0])
+        allowed, retry_after = store.consume('k', rate, capacity, now=100)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 0.5)
+        # half a second refills one token, other keys are independent
+        self.assertTrue(store.consume('k', rate, capacity, now=100.5)[0])
+        self.assertFalse(store.consume('k', rate, capacity, now=100.5)[0])
+        self.assertTrue(store.consume('other', rate, capacity, now=100.5)[0])
+
+    def test_memory_store(self):
+        self.check_store(MemoryStore())
+
+    def test_file_store(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.check_store(FileStore(path))
+            # a second handle on the same file sees the same buckets
+            self.assertFalse(FileStore(path).consume('k', 2, 2, now=100.5)[0])
+        finally:
+            os.remove(path)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('300/minute'), (5, 300))
+        self.assertEqual(parse_rate('10/hours'), (10 / 3600, 10))
+        with self.assertRaises(ValueError):
+            parse_rate('10/fortnight')
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['RATELIMIT_ENABLED'] = True
+        self.app.config['RATELIMIT_RULES'] = {'api': '2/minute'}
+        self.app.config['RATELIMIT_QUEUE_TIMEOUT'] = 0
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        u = User(email='john@example.com', password='cat', confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json'
+        }
+
+    def test_rate_limit(self):
+        headers = self.get_api_headers('john@example.com', 'cat')
+        for i in range(2):
+            response = self.client.get('/api/v1/posts/', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.get_json()['error'], 'too many requests')
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+        # other clients and endpoints without a rule are unaffected
+        response = self.client.get(
+            '/api/v1/posts/', headers=self.get_api_headers('susan', 'dog'),
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get('/').status_code, 200)
+
+        # the user's own bucket follows them to another address
+        response = self.client.get('/api/v1/posts/', headers=headers,
+                                   environ_base={'REMOTE_ADDR': '10.0.0.3'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_unverified_credentials(self):
+        # someone else sending john's email drains their own address' bucket
+        headers = self.get_api_headers('john@example.com', 'wrong')
+        for i in range(3):
+            self.client.get('/api/v1/posts/', headers=headers,
+                            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        response = self.client.get(
+            '/api/v1/posts/', headers=self.get_api_headers(
+                'john@example.com', 'cat'))
+        self.assertEqual(response.status_code, 200)
+        # and made up names do not get fresh buckets
+        response = self.client.get(
+            '/api/v1/posts/', headers=self.get_api_headers('nobody', 'x'),
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_load_shedding(self):
+        # hold every slot as if that many requests were in flight
+        slots = self.app.extensions['ratelimit'].slots
+        held = 0
+        while slots.acquire(blocking=False):
+            held += 1
+        try:
+            response = self.client.get('/')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+        finally:
+            for i in range(held):
+                slots.release()
+        self.assertEqual(self.client.get('/').status_code, 200)
+        # another application has slots of its own
+        self.assertIsNot(create_app('testing').extensions['ratelimit'].slots,
+                         slots)
@@ -0,0 +1,297 @@
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from base64 import b64encode
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+from app import create_app, db, moderation, sharding, trending
+from app.models import User, Role, Post, Comment, Follow
+
+
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        from config import config
+        self.shard_dir = tempfile.mkdtemp()
+        self.files = [os.path.join(self.shard_dir, 'shard%d.db' % i)
+                      for i in range(3)]
+        config['testing'].FLASKY_SHARD_URLS = ['sqlite:///' + path
+                                               for path in self.files]
+        try:
+            self.app = create_app('testing')
+        finally:
+            del config['testing'].FLASKY_SHARD_URLS
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.sharding = self.app.extensions['sharding']
+        self.sharding.create_all()
+        self.users = []
+        for i in range(3):
+            self.users.append(User(email='u%d@example.com' % i,
+                                   username='u%d' % i, password='cat',
+                                   confirmed=True))
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        self.sharding.remove_session(None)
+        db.session.remove()
+        db.drop_all()
+        for engine in self.sharding.engines.values():
+            engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.shard_dir)
+
+    def rows(self, index, table):
+        with sqlite3.connect(self.files[index]) as connection:
+            return connection.execute(
+                'SELECT id FROM %s ORDER BY id' % table).fetchall()
+
+    def add_posts(self, start=datetime(2026, 1, 1)):
+        session = sharding.session()
+        posts = []
+        for i in range(12):
+            author = self.users[i % 3]
+            posts.append(Post(body='post %d' % i, author_id=author.id,
+                              timestamp=start + timedelta(minutes=i)))
+        session.add_all(posts)
+        session.commit()
+        return posts
+
+    def test_placement(self):
+        posts = self.add_posts()
+        session = sharding.session()
+        for post in posts:
+            shard = post.author_id % 3
+            self.assertEqual(post.id % 3, shard)
+            self.assertIn((post.id,), self.rows(shard, 'posts'))
+        session.add(Comment(body='hi', post_id=posts[0].id,
+                            author_id=self.users[1].id))
+        session.commit()
+        comment = sharding.comments_of(posts[0].id).one()
+        # rendered on the shard by the background job
+        self.assertEqual(comment.body_html, '<p>hi</p>')
+        self.assertEqual(comment.id % 3, posts[0].id % 3)
+        self.assertEqual(self.rows(posts[0].id % 3, 'comments'),
+                         [(comment.id,)])
+        # the primary keeps users only
+        self.assertEqual(db.session.query(Post).count(), 0)
+
+        # a lookup by id reads one shard, the author comes from the primary
+        id = posts[5].id
+        session.expunge_all()
+        post = sharding.get_or_404(Post, id)
+        self.assertEqual(post.body, 'post 5')
+        self.assertEqual(post.author.username, self.users[2].username)
+        self.assertEqual(sharding.posts_by(self.users[1].id).count(), 4)
+
+    def test_views(self):
+        posts = self.add_posts()
+        for user in self.users[1:]:
+            db.session.add(Follow(follower=self.users[0], followed=user))
+        db.session.commit()
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 3
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'u0@example.com',
+                                         'password': 'cat'})
+
+        response = client.get('/user/u1')
+        data = response.get_data(as_text=True)
+        self.assertIn('4 blog posts', data)
+        self.assertIn('post 10', data)
+
+        response = client.post('/post/%d' % posts[4].id,
+                               data={'body': 'a comment'},
+                               follow_redirects=True)
+        self.assertIn('a comment', response.get_data(as_text=True))
+        response = client.post('/edit/%d' % posts[3].id,
+                               data={'body': 'edited'},
+                               follow_redirects=True)
+        self.assertIn('edited', response.get_data(as_text=True))
+        # the comment made post 4 the hottest
+        data = client.get('/hot').get_data(as_text=True)
+        self.assertEqual(_bodies(data), [4, 11, 10])
+
+        # followed feed merged from two shards, newest first, in pages
+        client.set_cookie('show_followed', '1')
+        seen = []
+        url = '/'
+        while url:
+            data = client.get(url).get_data(as_text=True)
+            seen += _bodies(data)
+            cursor = _next_cursor(data)
+            url = '/?after=' + cursor if cursor else None
+        self.assertEqual(seen, [11, 10, 8, 7, 5, 4, 2, 1])
+
+        client.set_cookie('show_followed', '')
+        data = client.get('/').get_data(as_text=True)
+        self.assertEqual(_bodies(data), [11, 10, 9])
+
+    def test_api_listing(self):
+        posts = self.add_posts()
+        self.app.config['FLASKY_POSTS_PER_PAGE'] = 5
+        client = self.app.test_client()
+        headers = {'Authorization': 'Basic ' + b64encode(
+            b'u0@example.com:cat').decode('utf-8'),
+                   'Accept': 'application/json'}
+        # merged across the shards, newest first
+        bodies = []
+        url = '/api/v1/posts/?fields=body'
+        while url:
+            response = client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertEqual(data['count'], 12)
+            bodies += [post['body'] for post in data['posts']]
+            url = data['next']
+        self.assertEqual(bodies, ['post %d' % i for i in range(11, -1, -1)])
+
+        response = client.get('/api/v1/posts/%d' % posts[7].id,
+                              headers=headers)
+        self.assertEqual(response.get_json()['body'], 'post 7')
+
+    def test_api_writes(self):
+        client = self.app.test_client()
+        headers = {'Authorization': 'Basic ' + b64encode(
+            b'u1@example.com:cat').decode('utf-8'),
+                   'Accept': 'application/json',
+                   'Content-Type': 'application/json'}
+        response = client.post('/api/v1/posts/', headers=headers,
+                               json={'body': 'from the api'})
+        self.assertEqual(response.status_code, 201)
+        url = response.headers['Location']
+        id = int(url.rsplit('/', 1)[1])
+        self.assertEqual(id % 3, self.users[1].id % 3)
+        self.assertEqual(self.rows(id % 3, 'posts'), [(id,)])
+        self.assertEqual(db.session.query(Post).count(), 0)
+        response = client.put(url, headers=headers, json={'body': 'edited'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.get(url, headers=headers).get_json()['body'],
+                         'edited')
+
+        response = client.post(url + '/comments/', headers=headers,
+                               json={'body': 'a comment'})
+        self.assertEqual(response.status_code, 201)
+        comment_url = response.headers['Location']
+        self.assertEqual(client.get(comment_url, headers=headers)
+                         .get_json()['body'], 'a comment')
+        data = client.get(url + '/comments/', headers=headers).get_json()
+        self.assertEqual([c['body'] for c in data['comments']], ['a comment'])
+        self.assertEqual(client.get('/api/v1/comments/', headers=headers)
+                         .get_json()['count'], 1)
+        self.assertEqual(client.get(url, headers=headers)
+                         .get_json()['comment_count'], 1)
+        data = client.get('/api/v1/users/%d/posts/' % self.users[1].id,
+                          headers=headers).get_json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(client.get('/api/v1/users/%d' % self.users[1].id,
+                                    headers=headers)
+                         .get_json()['post_count'], 1)
+
+    def test_moderation(self):
+        posts = self.add_posts()
+        session = sharding.session()
+        comments = [Comment(body='comment %d' % i, post_id=post.id,
+                            author_id=self.users[i % 2].id,
+                            timestamp=datetime(2026, 2, 1, i))
+                    for i, post in enumerate(posts[:6])]
+        session.add_all(comments)
+        session.commit()
+        self.assertEqual(moderation.moderation_queue().count(), 6)
+        self.assertEqual(moderation.moderation_queue(author='u1').count(), 3)
+        self.assertEqual(moderation.moderation_queue(author='nobody')
+                         .count(), 0)
+        ids = [c.id for c in comments[:4]]
+        self.assertEqual(moderation.set_disabled(ids, False), 4)
+        self.assertEqual(moderation.moderation_queue('approved').count(), 4)
+
+        self.users[0].role = Role.query.filter_by(name='Moderator').first()
+        db.session.commit()
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'u0@example.com',
+                                         'password': 'cat'})
+        data = client.get('/moderate').get_data(as_text=True)
+        self.assertIn('comment 5', data)
+        self.assertNotIn('comment 0', data)
+
+        # scored on every shard, the newest comment makes post 5 the hottest
+        for engine in sharding.engines():
+            with engine.begin() as connection:
+                connection.execute(update(Post.__table__)
+                                   .values(hot_score=None))
+        self.assertEqual(trending.rebuild_hot_scores(missing_only=True), 12)
+        self.assertEqual(sharding.hot_posts().limit(1).all()[0].id,
+                         posts[5].id)
+
+    def test_shard_tables(self):
+        # created on PostgreSQL shards too, which have no users table
+        ddl = {table.name: str(CreateTable(table).compile(
+            dialect=postgresql.dialect())) for table in
+            sharding.shard_metadata.sorted_tables}
+        self.assertNotIn('REFERENCES users', ddl['posts'])
+        self.assertNotIn('REFERENCES users', ddl['comments'])
+        self.assertIn('REFERENCES posts (id) ON DELETE CASCADE',
+                      ddl['comments'])
+
+    def test_move_from_primary(self):
+        old = [Post(body='old %d' % i, author_id=self.users[i % 3].id,
+                    timestamp=datetime(2025, 1, 1, i)) for i in range(5)]
+        db.session.add_all(old)
+        db.session.flush()
+        db.session.add_all([Comment(body='old comment %d' % i,
+                                    post_id=post.id,
+                                    author_id=self.users[0].id)
+                            for i, post in enumerate(old)])
+        db.session.commit()
+        ids = [post.id for post in old]
+        self.assertEqual(self.sharding.move_from_primary(chunk_size=2),
+                         (5, 5))
+        self.assertEqual(db.session.query(Post).count(), 0)
+        self.assertEqual(db.session.query(Comment).count(), 0)
+        for i, id in enumerate(ids):
+            self.assertIn((id,), self.rows(self.users[i % 3].id % 3, 'posts'))
+        # new ids never collide with the moved ones
+        post = Post(body='new', author_id=self.users[0].id)
+        sharding.session().add(post)
+        sharding.session().commit()
+        self.assertGreater(post.id, max(ids))
+        # nothing left, running it again moves nothing
+        self.assertEqual(self.sharding.move_from_primary(), (0, 0))
+
+        # the old ids still lead to the old posts
+        session = sharding.session()
+        session.expunge_all()
+        self.assertEqual(sharding.get_or_404(Post, ids[4]).body, 'old 4')
+        self.assertEqual(sharding.comments_of(ids[4]).one().body,
+                         'old comment 4')
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'u0@example.com',
+                                         'password': 'cat'})
+        response = client.post('/post/%d' % ids[4], data={'body': 'new one'},
+                               follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertIn('old 4', data)
+        self.assertIn('old comment 4', data)
+        self.assertIn('new one', data)
+        # on the shard of the post, not the one of its id
+        comment = sharding.comments_of(ids[4]).filter_by(body='new one').one()
+        shard = self.users[4 % 3].id % 3
+        self.assertIn((comment.id,), self.rows(shard, 'comments'))
+        self.assertEqual(sharding.all_posts().count(), 6)
+
+
+def _bodies(data):
+    # post numbers in the order shown
+    return list(dict.fromkeys(int(n) for n in re.findall(r'post (\d+)',
+                                                         data)))
+
+
+def _next_cursor(data):
+    match = re.search(r'after=([^"&]+)', data)
+    return match.group(1) if match else None
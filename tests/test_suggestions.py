@@ -0,0 +1,74 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, Suggestion, SuggestionRefresh
+from app.suggestions import recompute_suggestions
+
+
+class SuggestionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = {}
+        for name in ['john', 'susan', 'david', 'mary', 'alex']:
+            u = User(email=name + '@example.com', username=name,
+                     password='cat', confirmed=True)
+            db.session.add(u)
+            self.users[name] = u
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def follow(self, follower, followed):
+        self.users[follower].follow(self.users[followed])
+        db.session.commit()
+
+    def suggested(self, name):
+        return [u.username for u in self.users[name].suggested_users(10)]
+
+    def test_friends_of_friends(self):
+        self.follow('john', 'susan')
+        self.follow('susan', 'david')
+        self.follow('susan', 'mary')
+        self.follow('mary', 'david')
+        recompute_suggestions(full=True)
+        # david is reachable through susan and mary, mary only through susan
+        self.assertEqual(self.suggested('john'), ['david', 'mary'])
+        self.assertEqual(self.suggested('susan'), [])
+
+    def test_followed_users_are_not_suggested(self):
+        self.follow('john', 'susan')
+        self.follow('susan', 'david')
+        recompute_suggestions(full=True)
+        self.assertEqual(self.suggested('john'), ['david'])
+        self.follow('john', 'david')
+        self.assertEqual(self.suggested('john'), [])
+
+    def test_incremental_refresh(self):
+        self.follow('john', 'susan')
+        self.follow('susan', 'david')
+        recompute_suggestions(full=True)
+        self.assertEqual(SuggestionRefresh.query.count(), 0)
+
+        # susan's new edge changes john's friends-of-friends as well
+        self.follow('susan', 'alex')
+        self.assertEqual(SuggestionRefresh.query.count(), 1)
+        count = recompute_suggestions()
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(self.suggested('john')), ['alex', 'david'])
+        self.assertEqual(SuggestionRefresh.query.count(), 0)
+
+    def test_unfollowing_everyone_clears_suggestions(self):
+        self.follow('john', 'susan')
+        self.follow('susan', 'david')
+        recompute_suggestions(full=True)
+        self.users['john'].unfollow(self.users['susan'])
+        db.session.commit()
+        recompute_suggestions()
+        self.assertEqual(Suggestion.query.filter_by(
+            user_id=self.users['john'].id).count(), 0)
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, db, templating
+from app.models import Role
+
+
+class TemplatingTestCase(unittest.TestCase):
+    def setUp(self):
+        from config import config
+        self.cache_dir = tempfile.mkdtemp()
+        config['testing'].FLASKY_TEMPLATE_CACHE_DIR = self.cache_dir
+        try:
+            self.app = create_app('testing')
+        finally:
+            del config['testing'].FLASKY_TEMPLATE_CACHE_DIR
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_compile_templates(self):
+        compiled, errors = templating.compile_templates(self.app)
+        self.assertEqual(errors, [])
+        self.assertIn('index.html', compiled)
+        self.assertIn('bootstrap/base.html', compiled)
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(compiled))
+
+    def test_warm_up(self):
+        templating.warm_up(self.app)
+        # the templates rendered for the home page are already loaded
+        cache = self.app.jinja_env.cache
+        names = {name for (loader, name) in cache.keys()}
+        self.assertIn('index.html', names)
+        self.assertIn('_macros.html', names)
@@ -0,0 +1,6 @@
+import os
+from app import create_app
+
+# Production entry point for gunicorn (see gunicorn.conf.py). Unlike
+# flasky.py it leaves out the CLI, Flask-Migrate and coverage setup.
+app = create_app(os.getenv('FLASK_CONFIG') or 'production')